@@ -0,0 +1,67 @@
+""" Скорость полного обхода cars.txt в режимах проверки strict и trusted
+    для форматов данных json и binary
+
+    python benchmarks/bench_decode.py [число машин] [число повторов]
+
+    Первый обход (загрузка индексов, отображение файла) не считается,
+    выводится медиана повторов.
+"""
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'src'))
+
+from bibip_car_service import CarService  # noqa: E402
+from models import Car, CarStatus  # noqa: E402
+
+
+def bench(count: int, data_format: str, repeats: int) -> None:
+    root = tempfile.mkdtemp(prefix='bench_decode_')
+    try:
+        with CarService(root, data_format=data_format) as service:
+            service.add_cars(
+                Car(
+                    vin=f'BENCH{i:012d}',
+                    model=i % 50,
+                    price=Decimal(1000 + i % 5000) / 100,
+                    date_start=datetime(2024, 1, 1) + timedelta(minutes=i),
+                    status=CarStatus.available,
+                )
+                for i in range(count)
+            )
+
+        for validation in ('strict', 'trusted'):
+            with CarService(root, validation=validation) as service:
+                # Прогрев: индексы загружаются, файл отображается в память
+                cars = service.get_cars(CarStatus.available)
+                timings = []
+                for _ in range(repeats):
+                    started = time.perf_counter()
+                    cars = service.get_cars(CarStatus.available)
+                    timings.append(time.perf_counter() - started)
+            elapsed = statistics.median(timings)
+            print(
+                f'{data_format:>6} {validation:>8}: {len(cars)} строк за '
+                f'{elapsed:.3f} с ({len(cars) / elapsed:.0f} строк/с, '
+                f'медиана {repeats} повторов)'
+            )
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main(count: int, repeats: int) -> None:
+    for data_format in ('json', 'binary'):
+        bench(count, data_format, repeats)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    )
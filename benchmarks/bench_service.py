@@ -0,0 +1,256 @@
+""" Замеры всех операций CarService на синтетических данных
+
+    python benchmarks/bench_service.py --rows 10000 100000 1000000
+    python benchmarks/bench_service.py --rows 10000 --save baseline.json
+    python benchmarks/bench_service.py --rows 10000 --compare baseline.json
+
+Для каждой операции выводятся операции в секунду, задержки p50/p99,
+прочитанные и записанные байты (счетчики bytes_read/bytes_written из
+service.enable_metrics(), вместе с чтением через mmap) и пиковая память
+(tracemalloc, отдельный короткий прогон перед замером времени). С --compare скрипт завершается
+с кодом 1, если операция стала медленнее базовой больше чем на
+--threshold.
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'src'))
+
+from bibip_car_service import CarService  # noqa: E402
+from models import Car, CarStatus, Model, Sale  # noqa: E402
+
+# Генератор данных
+VIN_CHARS = 'ABCDEFGHJKLMNPRSTUVWXYZ0123456789'
+VIN_VALUES = dict(zip('ABCDEFGHJKLMNPRSTUVWXYZ', (
+    1, 2, 3, 4, 5, 6, 7, 8, 1, 2, 3, 4, 5, 7, 9, 2, 3, 4, 5, 6, 7, 8, 9
+)))
+VIN_VALUES.update({str(digit): digit for digit in range(10)})
+VIN_WEIGHTS = (8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2)
+# Производители (WMI) и годы выпуска (10-й знак vin)
+WMI = ('KNA', 'KND', 'JM1', '5N1', 'VF1', 'JTD', 'WVW', 'XTA', 'Z94', '1HG')
+YEARS = 'ABCDEFGHJKLMNPRS'
+BRANDS = ('Kia', 'Mazda', 'Nissan', 'Renault', 'Toyota', 'Volkswagen',
+          'Lada', 'Hyundai', 'Honda', 'Skoda')
+STATUSES = (CarStatus.available, CarStatus.reserve, CarStatus.delivery)
+
+
+def make_vin(rng: random.Random, serial: int) -> str:
+    """ vin с правильной контрольной цифрой; serial делает его уникальным """
+    head = rng.choice(WMI) + ''.join(rng.choice(VIN_CHARS) for _ in range(5))
+    tail = rng.choice(YEARS) + VIN_CHARS[serial // 10 ** 6 % 23] + f'{serial % 10 ** 6:06d}'
+    vin = head + '0' + tail
+    check = sum(VIN_VALUES[char] * weight for char, weight in zip(vin, VIN_WEIGHTS)) % 11
+    return head + ('X' if check == 10 else str(check)) + tail
+
+
+def make_models(count: int = 50) -> list[Model]:
+    return [
+        Model(id=id, name=f'Model {id}', brand=BRANDS[id % len(BRANDS)])
+        for id in range(1, count + 1)
+    ]
+
+
+def make_cars(rng: random.Random, count: int, first_serial: int = 0, models: int = 50):
+    started = datetime(2023, 1, 1)
+    for serial in range(first_serial, first_serial + count):
+        yield Car(
+            vin=make_vin(rng, serial),
+            model=rng.randint(1, models),
+            price=Decimal(rng.randrange(1_500_000, 9_000_000)) / 100,
+            date_start=started + timedelta(minutes=rng.randrange(60 * 24 * 730)),
+            status=rng.choice(STATUSES),
+        )
+
+
+def make_sale(rng: random.Random, car: Car) -> Sale:
+    sales_date = datetime(2024, 1, 1) + timedelta(minutes=rng.randrange(60 * 24 * 365))
+    discount = Decimal(rng.randrange(0, 1000)) / 10000
+    return Sale(
+        sales_number=f'{sales_date:%Y%m%d}#{car.vin}',
+        car_vin=car.vin,
+        sales_date=sales_date,
+        cost=(car.price * (1 - discount)).quantize(Decimal('0.01')),
+    )
+
+
+# Замеры
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def measure(method, calls: list[tuple], memory_calls: int, metrics) -> dict:
+    """ Гоняет method на аргументах calls; первые memory_calls вызовов идут
+    под tracemalloc и в замер времени не входят. Байты берутся из счетчиков
+    metrics, которыми обернут method """
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        for args in calls[:memory_calls]:
+            method(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        timed = calls[memory_calls:]
+        latencies = []
+        metrics.reset()
+        started = time.perf_counter()
+        for args in timed:
+            call_started = time.perf_counter()
+            method(*args)
+            latencies.append(time.perf_counter() - call_started)
+        elapsed = time.perf_counter() - started
+        counters = metrics.snapshot().get(method.__name__, {})
+
+    latencies.sort()
+    return {
+        'ops': len(timed),
+        'ops_per_sec': len(timed) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'bytes_read_per_op': counters.get('bytes_read', 0) // max(len(timed), 1),
+        'bytes_written_per_op': counters.get('bytes_written', 0) // max(len(timed), 1),
+        'peak_memory_kb': peak // 1024,
+    }
+
+
+def bench(rows: int, ops: int, scans: int, options: dict, seed: int = 1) -> dict:
+    """ Заполняет базу из rows машин (половина продана) и замеряет операции """
+    rng = random.Random(seed)
+    root = tempfile.mkdtemp(prefix='bench_service_')
+    try:
+        with CarService(root, **options) as service:
+            service.add_models(make_models())
+            cars = []
+            for start in range(0, rows, 10000):
+                batch = list(make_cars(rng, min(10000, rows - start), start))
+                service.add_cars(batch)
+                cars.extend(batch)
+            sold = cars[:rows // 2]
+            for start in range(0, len(sold), 10000):
+                service.sell_cars([make_sale(rng, car) for car in sold[start:start + 10000]])
+            service.checkpoint()
+            # Методы в plan - обертки со счетчиками байтов
+            metrics = service.enable_metrics()
+
+            memory_calls = max(ops // 50, 1)
+            point = ops + memory_calls
+            scan = scans + 1
+            unsold = cars[rows // 2:]
+            new_cars = list(make_cars(rng, point, rows))
+
+            def pick(population, count):
+                return [(item,) for item in rng.choices(population, k=count)]
+
+            plan = {
+                'find_car': (service.find_car, pick([car.vin for car in cars], point)),
+                'get_car_info': (service.get_car_info, pick([car.vin for car in cars], point)),
+                'get_cars_info': (service.get_cars_info, [
+                    ([vin for (vin,) in pick([car.vin for car in cars], 100)],)
+                    for _ in range(point // 100 + memory_calls)
+                ]),
+                'get_cars': (service.get_cars, [(CarStatus.available,)] * scan),
+                'top_models_by_sales': (service.top_models_by_sales, [()] * scan),
+                'sales_report': (service.sales_report, [('brand',)] * scan),
+                'inventory_report': (service.inventory_report, [('status',)] * scan),
+                'add_car': (service.add_car, [(car,) for car in new_cars]),
+                'sell_car': (service.sell_car, [
+                    (make_sale(rng, car),) for car in rng.sample(unsold, min(point, len(unsold)))
+                ]),
+                'update_vin': (service.update_vin, [
+                    (car.vin, make_vin(rng, 2 * rows + serial))
+                    for serial, car in enumerate(rng.sample(new_cars, min(point, len(new_cars))))
+                ]),
+                'revert_sale': (service.revert_sale, [
+                    (key,) for key, _ in rng.sample(service.sales_index.items(), min(point, len(sold)))
+                ]),
+            }
+            # Для полных обходов память меряем на одном вызове
+            return {
+                name: measure(method, calls, memory_calls if len(calls) > scan else 1, metrics)
+                for name, (method, calls) in plan.items()
+            }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def regressions(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """ Операции, которые стали медленнее базовых больше чем на threshold """
+    found = []
+    for rows, operations in results.items():
+        for name, current in operations.items():
+            base = baseline.get(rows, {}).get(name)
+            if base is None:
+                continue
+            if current['ops_per_sec'] < base['ops_per_sec'] * (1 - threshold):
+                found.append(
+                    f'{rows} {name}: {current["ops_per_sec"]:.0f} оп/с '
+                    f'(было {base["ops_per_sec"]:.0f})'
+                )
+            if current['p99_ms'] > base['p99_ms'] * (1 + threshold):
+                found.append(
+                    f'{rows} {name}: p99 {current["p99_ms"]:.3f} мс '
+                    f'(было {base["p99_ms"]:.3f})'
+                )
+    return found
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Замеры операций CarService')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--ops', type=int, default=1000, help='вызовов точечных операций')
+    parser.add_argument('--scans', type=int, default=5, help='вызовов полных обходов')
+    parser.add_argument('--data-format', choices=['json', 'binary'], default='json')
+    parser.add_argument('--index-format', choices=['json', 'sorted'], default='json')
+    parser.add_argument('--validation', choices=['strict', 'trusted'], default='strict')
+    parser.add_argument('--columns', action='store_true', help='вести колонки (нужен numpy)')
+    parser.add_argument('--save', help='записать результаты в JSON')
+    parser.add_argument('--compare', help='сравнить с базовыми результатами из JSON')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    options = {
+        'data_format': args.data_format,
+        'index_format': args.index_format,
+        'validation': args.validation,
+        'columns': args.columns,
+    }
+    results = {}
+    for rows in args.rows:
+        results[str(rows)] = bench(rows, args.ops, args.scans, options)
+        for name, stats in results[str(rows)].items():
+            print(
+                f'{rows:>8} {name:>20}: {stats["ops_per_sec"]:>10.0f} оп/с '
+                f'p50 {stats["p50_ms"]:.3f} мс p99 {stats["p99_ms"]:.3f} мс '
+                f'чтение {stats["bytes_read_per_op"]} Б/оп '
+                f'запись {stats["bytes_written_per_op"]} Б/оп '
+                f'память {stats["peak_memory_kb"]} КБ'
+            )
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'options': options, 'results': results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        found = regressions(results, baseline, args.threshold)
+        for line in found:
+            print(f'регрессия: {line}')
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
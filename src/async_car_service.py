@@ -0,0 +1,180 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+import asyncio
+
+from pydantic import BaseModel
+
+from bibip_car_service import CarService
+from models import (
+    Car, CarFullInfo, CarStatus, InventoryReport, Model, ModelSaleStats,
+    Sale, SalesReport
+)
+
+
+def copy_result(result):
+    """ Копия результата чтения: объекты моделей копируются, в том числе
+    внутри списков и кортежей """
+    if isinstance(result, BaseModel):
+        return result.model_copy()
+    if isinstance(result, (list, tuple)):
+        return type(result)(copy_result(item) for item in result)
+    return result
+
+
+class AsyncCarService:
+    """ CarService для asyncio: те же методы, но корутинами.
+
+    Вызовы CarService выполняются в пуле из max_workers потоков, поэтому
+    цикл событий не ждет файлового ввода-вывода. CarService работает в
+    режиме concurrency='thread' (или 'process'): читатели идут
+    параллельно, писатели - по одному.
+
+    Одинаковые одновременные запросы на чтение объединяются: пока запрос
+    выполняется, остальные вызовы с теми же аргументами ждут его результат.
+    Каждый получает свою копию объектов результата (как из RecordCache),
+    поэтому изменения у одного не видны другим. Любая запись сбрасывает
+    объединение, чтобы запросы после нее не получили старые данные.
+    """
+
+    def __init__(
+        self,
+        root_directory_path: str,
+        max_workers: int = 8,
+        concurrency: str = 'thread',
+        **options
+    ) -> None:
+        if concurrency == 'none':
+            raise ValueError('AsyncCarService нужна блокировка потоков')
+        self.service = CarService(
+            root_directory_path, concurrency=concurrency, **options
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix='bibip'
+        )
+        # Выполняющиеся запросы на чтение: (метод, аргументы) -> future
+        self._inflight: dict[tuple, asyncio.Future] = {}
+
+    # Вызов метода CarService в пуле потоков
+    async def _call(self, method: str, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, partial(getattr(self.service, method), *args)
+        )
+
+    async def _read(self, method: str, *args):
+        """ Чтение; одинаковые одновременные чтения выполняются один раз """
+        key = (method, args)
+        try:
+            future = self._inflight.get(key)
+        except TypeError:
+            # Нехешируемые аргументы не объединяем
+            return await self._call(method, *args)
+        if future is None:
+            future = asyncio.ensure_future(self._call(method, *args))
+            self._inflight[key] = future
+
+            def forget(done: asyncio.Future) -> None:
+                if self._inflight.get(key) is done:
+                    del self._inflight[key]
+            future.add_done_callback(forget)
+        # Отмена одного ожидающего не отменяет запрос для остальных
+        return copy_result(await asyncio.shield(future))
+
+    async def _write(self, method: str, *args):
+        self._inflight.clear()
+        return await self._call(method, *args)
+
+    async def find_car(self, vin: str) -> Car | None:
+        return await self._read('find_car', vin)
+
+    async def find_model(self, id: int) -> Model | None:
+        return await self._read('find_model', id)
+
+    async def find_sale(self, sales_number: str) -> Sale | None:
+        return await self._read('find_sale', sales_number)
+
+    async def get_cars(self, status: CarStatus) -> list[Car]:
+        return await self._read('get_cars', status)
+
+    async def get_cars_page(
+        self,
+        status: CarStatus | None = None,
+        model: int | None = None,
+        limit: int = 50,
+        cursor: int = 0
+    ) -> tuple[list[Car], int | None]:
+        return await self._read('get_cars_page', status, model, limit, cursor)
+
+    async def get_car_info(self, vin: str) -> CarFullInfo | None:
+        return await self._read('get_car_info', vin)
+
+    async def get_cars_info(
+        self, vins: list[str]
+    ) -> list[CarFullInfo | None]:
+        return await self._read('get_cars_info', tuple(vins))
+
+    async def top_models_by_sales(
+        self, limit: int = 3
+    ) -> list[ModelSaleStats] | None:
+        return await self._read('top_models_by_sales', limit)
+
+    async def sales_report(
+        self,
+        group_by: str = 'month',
+        date_from: datetime | None = None,
+        date_to: datetime | None = None
+    ) -> list[SalesReport]:
+        return await self._read('sales_report', group_by, date_from, date_to)
+
+    async def inventory_report(
+        self, group_by: str = 'status'
+    ) -> list[InventoryReport]:
+        return await self._read('inventory_report', group_by)
+
+    async def add_model(self, model: Model) -> Model:
+        return await self._write('add_model', model)
+
+    async def add_car(self, car: Car) -> Car:
+        return await self._write('add_car', car)
+
+    async def sell_car(self, sale: Sale) -> Car | None:
+        return await self._write('sell_car', sale)
+
+    async def add_models(self, models: list[Model | dict]) -> list[Model]:
+        return await self._write('add_models', models)
+
+    async def add_cars(self, cars: list[Car | dict]) -> list[Car]:
+        return await self._write('add_cars', cars)
+
+    async def sell_cars(self, sales: list[Sale | dict]) -> list[Car | None]:
+        return await self._write('sell_cars', sales)
+
+    async def update_status(
+        self, vin: str, new_status: CarStatus
+    ) -> Car | None:
+        return await self._write('update_status', vin, new_status)
+
+    async def update_vin(self, vin: str, new_vin: str) -> Car | None:
+        return await self._write('update_vin', vin, new_vin)
+
+    async def revert_sale(self, sales_number: str) -> Car | None:
+        return await self._write('revert_sale', sales_number)
+
+    async def compact_sales(self) -> int:
+        return await self._write('compact_sales')
+
+    async def checkpoint(self) -> None:
+        return await self._write('checkpoint')
+
+    def close(self) -> None:
+        """ Останавливает пул потоков и закрывает файлы базы """
+        self.executor.shutdown(wait=True)
+        self.service.close()
+
+    async def __aenter__(self) -> 'AsyncCarService':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        # Ожидание потоков и закрытие файлов не блокируют цикл событий
+        await asyncio.to_thread(self.close)
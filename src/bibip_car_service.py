@@ -1,201 +1,1027 @@
 from datetime import datetime
 from decimal import Decimal
 from pathlib import Path
+from bisect import bisect_left
+from functools import partial
+from itertools import islice
 import json
-from collections import Counter
-from models import Car, CarFullInfo, CarStatus, Model, ModelSaleStats, Sale
+import os
+import threading
+from columns import (
+    CAR_COLUMNS, COLUMNS_FILE, SALE_COLUMNS, ColumnStore, car_values, epoch,
+    from_cents, inventory_sums, money, np, sale_values, sales_sums, utc_date
+)
+from decoders import VALIDATION_MODES
+from durability import SyncPolicy, WriteHandles, temp_path
+from locking import make_lock, reading, writing
+import metrics
+from metrics import Metrics
+from models import (
+    Car, CarFullInfo, CarStatus, InventoryReport, Model, ModelSaleStats,
+    Sale, SalesReport
+)
+from parallel_scan import ParallelScanner, extract_keys, filter_rows
+from record_cache import CACHE_SIZE, RecordCache
+from record_codecs import DATA_FORMATS
+from record_file import RecordFile
+from table_index import FreeSlots, ModelSalesIndex, StatusIndex, TableIndex
+
+# Группировки отчетов о продажах и о машинах
+SALES_GROUPS = ('brand', 'model', 'day', 'month')
+INVENTORY_GROUPS = ('status', 'brand', 'model')
+
+
+def report_rows(totals: dict[str, list]) -> list[SalesReport]:
+    """ Строки отчета о продажах по суммам из sales_totals.
+
+    Скидка - разница между ценой машины и стоимостью продажи,
+    discount_rate - доля скидки от суммы цен проданных машин. Строки идут
+    по возрастанию группы.
+    """
+    cents = Decimal('0.01')
+    rows = []
+    for group, (count, revenue, prices) in sorted(totals.items()):
+        discount = prices - revenue
+        rows.append(SalesReport(
+            group=group,
+            sales_number=count,
+            revenue=revenue,
+            average_cost=(revenue / count).quantize(cents),
+            average_discount=(discount / count).quantize(cents),
+            discount_rate=(
+                (discount / prices).quantize(Decimal('0.0001'))
+                if prices else Decimal(0)
+            )
+        ))
+    return rows
+
+
+def inventory_rows(totals: dict[str, list]) -> list[InventoryReport]:
+    """ Строки отчета о машинах по суммам из inventory_totals, по
+    возрастанию группы """
+    return [
+        InventoryReport(
+            group=group,
+            cars_number=count,
+            total_price=total,
+            min_price=lowest,
+            max_price=highest,
+            average_price=(total / count).quantize(Decimal('0.01'))
+        )
+        for group, (count, total, lowest, highest) in sorted(totals.items())
+    ]
+
+
+def merge_sales(totals: dict[str, list], group: str, values: list) -> None:
+    """ Добавляет [число продаж, выручка, сумма цен] к сумме группы """
+    total = totals.setdefault(group, [0, Decimal(0), Decimal(0)])
+    for position, value in enumerate(values):
+        total[position] += value
+
+
+def merge_inventory(
+    totals: dict[str, list], group: str, values: list
+) -> None:
+    """ Добавляет [число машин, сумма цен, минимум, максимум] к группе """
+    total = totals.get(group)
+    if total is None:
+        totals[group] = list(values)
+        return
+    total[0] += values[0]
+    total[1] += values[1]
+    total[2] = min(total[2], values[2])
+    total[3] = max(total[3], values[3])
 
 
 class CarService:
-    def __init__(self, root_directory_path: str) -> None:
-        """ Создает директорию и файлы """
+    def __init__(
+        self,
+        root_directory_path: str,
+        index_format: str = 'json',
+        checkpoint_every: int = 1000,
+        validation: str = 'strict',
+        data_format: str = 'json',
+        concurrency: str = 'none',
+        scan_workers: int | None = None,
+        parallel_scan_threshold: int = 200000,
+        durability: str = 'none',
+        group_commit_ops: int = 100,
+        group_commit_ms: float = 10,
+        cache_size: int = CACHE_SIZE,
+        columns: bool = False
+    ) -> None:
+        """ Создает директорию базы; файлы создаются и открываются при
+        первом обращении и остаются открытыми до close().
+
+        index_format - формат новых файлов индекса: 'json' или 'sorted'
+        (сортированные записи фиксированной ширины, см. sorted_index.py).
+        checkpoint_every - через сколько записей в журнале индекса (не
+        меньше четверти числа записей самого индекса) журнал сливается с
+        основным файлом индекса.
+        validation - разбор строк, прочитанных из файлов: 'strict'
+        (json.loads и проверка словаря pydantic) или 'trusted' (объект
+        собирается прямо из байт записи, для файлов, которые пишет только
+        сам сервис; см. decoders.py).
+        data_format - формат новых файлов с данными: 'json' (500 символов
+        JSON на строку) или 'binary' (компактные записи, см.
+        record_codecs.py). Формат существующего файла берется из его
+        заголовка.
+        concurrency - совместный доступ к базе: 'none' (без блокировок),
+        'thread' (много читающих потоков, пишущие - по одному) или
+        'process' (то же и рекомендательная блокировка fcntl на файл
+        bibip.lock, чтобы с базой могли работать несколько процессов).
+        scan_workers - число процессов для полного обхода файлов (по
+        умолчанию по числу ядер); обходы от parallel_scan_threshold строк
+        идут в пуле процессов (см. parallel_scan.py).
+        durability - когда записи сбрасываются на диск: 'none' (решает ОС),
+        'fsync-per-op' (после каждой записи) или 'group-commit' (раз в
+        group_commit_ops операций или group_commit_ms миллисекунд), см.
+        durability.py.
+        cache_size - сколько разобранных машин, моделей и продаж держать
+        в памяти для поиска по ключу (в каждой таблице; 0 - без кеша), см.
+        record_cache.py.
+        columns - вести для базы колонки числовых полей машин и продаж
+        (см. columns.py) и считать по ним отчеты через numpy. Колонки
+        строятся при первом обращении и дальше ведутся всеми сервисами,
+        которые открывают эту базу.
+        """
+        if validation not in VALIDATION_MODES:
+            raise ValueError(f'Неизвестный режим проверки: {validation}')
+        if data_format not in DATA_FORMATS:
+            raise ValueError(f'Неизвестный формат данных: {data_format}')
         parent_dir = Path(__file__).resolve().parent.parent
         folder_path = parent_dir / root_directory_path
         folder_path.mkdir(parents=True, exist_ok=True)
 
-        files = [
-            'cars.txt', 'cars_index.txt',
-            'models.txt', 'models_index.txt',
-            'sales.txt', 'sales_index.txt'
-        ]
-
-        # Создаем файлы
-        for file_name in files:
-            file_path = parent_dir / root_directory_path / file_name
-            file_path.touch()
-
         self.root_directory_path = folder_path
+        self.validation = validation
+        # Блокировка на чтение/запись для публичных методов (см. locking.py)
+        self.lock = make_lock(concurrency, folder_path / 'bibip.lock')
+        # Счетчики вызовов, см. enable_metrics
+        self.metrics: Metrics | None = None
+        # Пул процессов для обхода больших файлов
+        self.scanner = ParallelScanner(scan_workers)
+        self.parallel_scan_threshold = parallel_scan_threshold
         self.cars_index_path = folder_path / 'cars_index.txt'
         self.cars_data_path = folder_path / 'cars.txt'
         self.models_index_path = folder_path / 'models_index.txt'
         self.models_data_path = folder_path / 'models.txt'
         self.sales_index_path = folder_path / 'sales_index.txt'
         self.sales_data_path = folder_path / 'sales.txt'
+        self.cars_status_index_path = folder_path / 'cars_status_index.txt'
+        self.sales_vin_index_path = folder_path / 'sales_vin_index.txt'
+        self.model_sales_path = folder_path / 'model_sales_stats.txt'
+        self.sales_free_slots_path = folder_path / 'sales_free_slots.txt'
+        self.columns_marker_path = folder_path / COLUMNS_FILE
+        # Новые индексы продаж на время подмены sales.txt в compact_sales
+        self.sales_compact_path = folder_path / 'sales_compact.json'
+
+        # Сброс записей на диск и открытые на запись файлы с данными
+        self.sync_policy = SyncPolicy(
+            durability, group_commit_ops, group_commit_ms
+        )
+        self.writers = WriteHandles(self.sync_policy)
+
+        # Индексы в памяти, перечитываются только при изменении файла.
+        # Испорченный или потерянный файл индекса строится заново по файлу
+        # с данными
+        self.cars_index = TableIndex(
+            self.cars_index_path, index_format, checkpoint_every,
+            self.sync_policy, partial(self.index_pairs, self.cars_data_path)
+        )
+        self.models_index = TableIndex(
+            self.models_index_path, index_format, checkpoint_every,
+            self.sync_policy, partial(self.index_pairs, self.models_data_path)
+        )
+        self.sales_index = TableIndex(
+            self.sales_index_path, index_format, checkpoint_every,
+            self.sync_policy, partial(self.index_pairs, self.sales_data_path)
+        )
+        # Вторичный индекс: vin машины -> номер строки продажи (пустой
+        # индекс строится заново в sale_line_by_vin)
+        self.sales_vin_index = TableIndex(
+            self.sales_vin_index_path, index_format, checkpoint_every,
+            self.sync_policy, list
+        )
+        self.indexes = {
+            self.cars_index_path: self.cars_index,
+            self.models_index_path: self.models_index,
+            self.sales_index_path: self.sales_index,
+            self.sales_vin_index_path: self.sales_vin_index,
+        }
+        # Вторичный индекс: статус -> номера строк в cars.txt
+        self.status_index = StatusIndex(
+            self.cars_status_index_path, checkpoint_every, self.sync_policy
+        )
+        # Файлы с данными, отображенные в память, и их индексы
+        self.data_indexes = {
+            self.cars_data_path: self.cars_index,
+            self.models_data_path: self.models_index,
+            self.sales_data_path: self.sales_index,
+        }
+        self.data_models = {
+            self.cars_data_path: Car,
+            self.models_data_path: Model,
+            self.sales_data_path: Sale,
+        }
+        # Ключевые поля таблиц
+        self.data_keys = {
+            self.cars_data_path: 'vin',
+            self.models_data_path: 'id',
+            self.sales_data_path: 'sales_number',
+        }
+        # Кеш разобранных записей по ключу и индексы, по поколениям
+        # которых видно, что таблицу изменили извне
+        self.caches = {
+            path: RecordCache(cache_size) for path in self.data_models
+        }
+        self.cache_indexes = {
+            self.cars_data_path: (self.cars_index, self.status_index),
+            self.models_data_path: (self.models_index,),
+            self.sales_data_path: (self.sales_index,),
+        }
+        # Колонки числовых полей, см. column_stores
+        self.use_columns = columns
+        self._column_stores: dict[Path, ColumnStore] | None = None
+        self._columns_mutex = threading.RLock()
+        # Файлы с данными создаются при первом обращении
+        self.records = {
+            path: RecordFile(path, model_cls, data_format)
+            for path, model_cls in self.data_models.items()
+        }
+        # Освободившиеся после revert_sale строки sales.txt
+        self.sales_free_slots = FreeSlots(
+            self.sales_free_slots_path, checkpoint_every, self.sync_policy
+        )
+        # Счетчики продаж по моделям для top_models_by_sales
+        self.model_sales = ModelSalesIndex(
+            self.model_sales_path, checkpoint_every, self.sync_policy
+        )
+        # Сжатие продаж, прерванное сбоем, доводим до конца
+        self.finish_compaction()
+
+    # Закрытие файлов
+    def close(self) -> None:
+        """ Сбрасывает накопленные записи и закрывает все открытые файлы и
+        пул процессов. Если сервисом пользоваться дальше, файлы откроются
+        заново при первом обращении. """
+        with self.lock.write():
+            self.sync_policy.flush()
+            self.writers.close_all()
+            for records in self.records.values():
+                records.close()
+            for store in (self._column_stores or {}).values():
+                store.close()
+            for index in (
+                *self.indexes.values(), self.status_index,
+                self.model_sales, self.sales_free_slots
+            ):
+                index.close()
+        self.scanner.close()
+        self.lock.close()
+
+    def __enter__(self) -> 'CarService':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    # Публичные методы, которые считает enable_metrics
+    public_methods = (
+        'find_car', 'find_model', 'find_sale', 'get_cars', 'iter_cars',
+        'get_cars_page', 'get_car_info', 'get_cars_info',
+        'top_models_by_sales', 'sales_report', 'inventory_report',
+        'add_model', 'add_car', 'sell_car', 'add_models', 'add_cars',
+        'sell_cars', 'update_status', 'update_vin', 'revert_sale',
+        'compact_sales', 'checkpoint', 'sync'
+    )
+
+    # Включение счетчиков
+    def enable_metrics(self, hook=None) -> Metrics:
+        """ Включает счетчики вызовов публичных методов (см. metrics.py).
+
+        Методы заменяются на обертки только у этого объекта, поэтому без
+        счетчиков сервис работает как раньше. hook(имя метода, счетчики
+        вызова) вызывается после каждого вызова.
+        """
+        if self.metrics is None:
+            self.metrics = Metrics(hook)
+            for name in self.public_methods:
+                setattr(self, name, self.metrics.wrap(name, getattr(self, name)))
+            self.metrics.enable()
+        return self.metrics
+
+    def disable_metrics(self) -> None:
+        """ Выключает счетчики """
+        if self.metrics is not None:
+            for name in self.public_methods:
+                del self.__dict__[name]
+            self.metrics.disable()
+            self.metrics = None
+
+    # Счетчики кеша
+    def cache_stats(self) -> dict[str, dict]:
+        """ Попадания и промахи кеша по таблицам: cars, models, sales """
+        return {path.stem: cache.stats() for path, cache in self.caches.items()}
+
+    # Проверки вторичных данных перед чтением (см. locking.reading)
+    def stale(self, checks: tuple) -> bool:
+        """ Нужно ли что-то переписать на диске перед чтением: индекс,
+        восстановленный по данным, или устаревшие данные из checks
+        ('status_index', 'sales_vin_index', 'model_sales', 'columns') """
+        return any(index.recovered for index in self.indexes.values()) or any(
+            getattr(self, f'{check}_stale')() for check in checks
+        )
+
+    def maintain(self, checks: tuple) -> None:
+        """ Переписывает устаревшее (под блокировкой на запись) """
+        for index in self.indexes.values():
+            index.save_recovered()
+        for check in checks:
+            getattr(self, f'check_{check}')()
 
     # Чтение файла с индексом
+    @reading
     def read_index(self, path: Path) -> list:
         """ Чтение файла с индексом """
-        with open(path, "r") as f:
-            try:
-                index = json.load(f)
-            except json.JSONDecodeError:
-                index = []
-
-        return index
+        return self.indexes[path].items()
 
     # Обновляет файл с индексом
+    @writing
     def add_index(self, path: Path, index: list) -> None:
         """ Добавляет новый индекс (перезаписывает файл) """
-        with open(path, "w") as f:
-            index = sorted(index)
-            json.dump(index, f)
+        self.indexes[path].replace(index)
 
         return None
 
+    # Сливает журналы индексов с основными файлами
+    @writing
+    def checkpoint(self) -> None:
+        """ Переносит накопленные журналы в файлы индексов """
+        for index in self.indexes.values():
+            index.checkpoint()
+        self.status_index.checkpoint()
+        self.model_sales.checkpoint()
+        self.sales_free_slots.checkpoint()
+
+    # Сброс записей на диск
+    @writing
+    def sync(self) -> None:
+        """ Сбрасывает на диск записи, накопленные в режиме group-commit """
+        self.sync_policy.flush()
+
+    # Пары индекса по файлу с данными
+    def index_pairs(self, path: Path) -> list:
+        """ Пары [ключ, номер строки] для всех записей файла с данными.
+
+        Строки фиксированной ширины, поэтому большой файл разбирается
+        частями в пуле процессов. Пустые строки и свободные строки продаж
+        пропускаются; при повторе ключа побеждает последняя строка.
+        """
+        # Не через data_file: его вызывает сам индекс, пока загружается
+        records = self.records[path]
+        records.reopen_if_replaced()
+        lines = range(len(records))
+        field = self.data_keys[path]
+        if (
+            self.scanner.enabled
+            and len(lines) >= self.parallel_scan_threshold
+        ):
+            pairs = self.scanner.scan_keys(
+                path, self.data_models[path], lines, field
+            )
+        else:
+            pairs = list(extract_keys(records, lines, field))
+        if path == self.sales_data_path:
+            pairs = [
+                pair for pair in pairs if pair[1] not in self.sales_free_slots
+            ]
+        return list({key: [key, line] for key, line in pairs}.values())
+
+    # Восстановление индексов
+    @writing
+    def rebuild_indexes(self) -> dict:
+        """ Строит индексы машин, моделей и продаж заново по файлам с
+        данными, вторичные индексы сбрасывает (они строятся при первом
+        обращении). Возвращает число записей в каждом индексе. """
+        counts = {}
+        for path, index in self.data_indexes.items():
+            pairs = self.index_pairs(path)
+            index.replace(pairs)
+            counts[index.path.name] = len(pairs)
+            self.caches[path].clear()
+        self.status_index.replace([])
+        self.sales_vin_index.replace([])
+        self.model_sales.replace([])
+        if self.column_stores():
+            self.build_columns()
+        return counts
+
+    # Колонки числовых полей
+    def column_stores(self) -> dict[Path, ColumnStore]:
+        """ Колонки машин и продаж; пустой словарь, если они не ведутся.
+
+        Колонки ведутся, если в каталоге базы есть columns.json или сервис
+        создан с columns=True. columns.json создает build_columns, когда
+        колонки построены по данным: при первой записи или первом отчете.
+        Пока колонки не ведутся, columns.json проверяется при каждом
+        вызове: их мог включить другой сервис, уже после запуска этого.
+        """
+        stores = self._column_stores
+        if stores or (
+            stores is not None and not self.columns_marker_path.exists()
+        ):
+            return stores
+        with self._columns_mutex:
+            if not self._column_stores:
+                stores = {}
+                if self.use_columns or self.columns_marker_path.exists():
+                    stores = {
+                        self.cars_data_path: ColumnStore(
+                            self.cars_data_path, CAR_COLUMNS, self.writers
+                        ),
+                        self.sales_data_path: ColumnStore(
+                            self.sales_data_path, SALE_COLUMNS, self.writers
+                        ),
+                    }
+                self._column_stores = stores
+            return self._column_stores
+
+    def column_rows(
+        self, path: Path, rows: list[tuple[int, object]]
+    ) -> list[tuple[int, tuple]]:
+        """ Значения колонок для строк (номер строки, объект) """
+        if path == self.cars_data_path:
+            return [(line, car_values(car)) for line, car in rows]
+        # Пустые строки (отмененные продажи) в индексе машин не ищем
+        sales = [(line, sale) for line, sale in rows if sale is not None]
+        car_lines = dict(zip(
+            (line for line, _ in sales),
+            self.cars_index.get_many(sale.car_vin for _, sale in sales)
+        ))
+        return [
+            (line, sale_values(sale, car_lines.get(line)))
+            for line, sale in rows
+        ]
+
+    def build_columns(self) -> dict:
+        """ Строит колонки заново по живым строкам файлов с данными;
+        возвращает число строк в колонках каждого файла """
+        with self._columns_mutex:
+            stores = self._column_stores
+            counts = {}
+
+            count = len(self.data_file(self.cars_data_path))
+            lines = sorted(line for _, line in self.cars_index.items())
+            cars = dict(self.scan_rows(self.cars_data_path, lines))
+            stores[self.cars_data_path].replace(
+                [car_values(cars.get(line)) for line in range(count)]
+            )
+            counts[self.cars_data_path.name] = count
+
+            count = len(self.data_file(self.sales_data_path))
+            line_vins = self.sale_vins()
+            lines = sorted(line for _, line in self.sales_index.items())
+            sales = self.scan_rows(self.sales_data_path, lines)
+            car_lines = self.cars_index.get_many(
+                line_vins.get(line, sale.car_vin) for line, sale in sales
+            )
+            values = {
+                line: sale_values(sale, car_line)
+                for (line, sale), car_line in zip(sales, car_lines)
+            }
+            blank = sale_values(None, None)
+            stores[self.sales_data_path].replace(
+                [values.get(line, blank) for line in range(count)]
+            )
+            counts[self.sales_data_path.name] = count
+            marker_tmp = temp_path(self.columns_marker_path)
+            marker_tmp.write_text(json.dumps({
+                'cars': [name for name, _ in CAR_COLUMNS],
+                'sales': [name for name, _ in SALE_COLUMNS],
+            }))
+            self.sync_policy.replace(marker_tmp, self.columns_marker_path)
+            return counts
+
+    @writing
+    def rebuild_columns(self) -> dict:
+        """ Включает колонки для базы и строит их заново по файлам с
+        данными; возвращает число строк в колонках каждого файла """
+        self.use_columns = True
+        self._column_stores = None
+        self.column_stores()
+        return self.build_columns()
+
+    def columns_stale(self) -> bool:
+        """ Колонки для отчетов еще не построены или разошлись с файлами
+        с данными (например, после сбоя) """
+        stores = self.column_stores()
+        if np is None or not stores:
+            return False
+        if not self.columns_marker_path.exists():
+            return True
+        return any(
+            store.rows() != len(self.data_file(path))
+            for path, store in stores.items()
+        )
+
+    def check_columns(self) -> None:
+        """ Строит колонки заново, если они устарели """
+        if self.columns_stale():
+            self.build_columns()
+
+    def column_arrays(self) -> tuple[dict, dict] | None:
+        """ Колонки машин и продаж как массивы numpy или None, если
+        колонки не ведутся, устарели или numpy не установлен """
+        stores = self.column_stores()
+        if np is None or not stores or self.columns_stale():
+            return None
+        with self._columns_mutex:
+            return (
+                stores[self.cars_data_path].arrays(),
+                stores[self.sales_data_path].arrays(),
+            )
+
+    # Группа модели в отчетах
+    def model_group(
+        self, model_id: int, group_by: str, models: dict
+    ) -> str | None:
+        """ Марка или "марка модель"; models - уже найденные модели """
+        if model_id not in models:
+            models[model_id] = self.find_row(self.models_data_path, model_id)
+        model = models[model_id]
+        if model is None:
+            return None
+        if group_by == 'brand':
+            return model.brand
+        return f'{model.brand} {model.name}'
+
+    # Файл с данными, отображенный в память
+    def data_file(self, path: Path) -> RecordFile:
+        """ RecordFile для файла с данными.
+
+        Когда индекс таблицы перечитан с диска, проверяем, не подменили ли
+        файл с данными (например, сжатием в другом процессе).
+        """
+        records = self.records[path]
+        generation = self.data_indexes[path].refresh()
+        if records.generation != generation:
+            if records.reopen_if_replaced():
+                # Открытый на запись файл тоже устарел
+                self.writers.close(path)
+            records.generation = generation
+        return records
+
     # Чтение файла с данными:
     def read_data(self, path: Path, line_number: int) -> dict:
         """ Считывает данные из файла по номеру строки """
-        with open(path, "r") as f:
-            f.seek(line_number * (501))
-            val = f.read(500).rstrip()
-        json_obj = json.loads(val)
-        return json_obj
+        return self.data_file(path).read(line_number)
 
     # Записывает данные в файл
     def write_data(self, path: Path, obj, line_number: int | None) -> None:
         """ Записывает данные в файл на нужную строку"""
         if line_number is not None:
-            json_obj = obj.model_dump_json().ljust(500) + '\n'
-            with open(path, "r+") as f:
-                f.seek(line_number * (501))
-                f.write(json_obj)
+            self.write_many(path, [(line_number, obj)])
+
+    # Чтение объекта по номеру строки
+    def read_row(self, path: Path, line_number: int):
+        """ Считывает строку и собирает из нее объект таблицы """
+        records = self.data_file(path)
+        return records.decode(records.read_raw(line_number), self.validation)
+
+    # Чтение нескольких объектов
+    def read_rows(self, path: Path, line_numbers: list[int]) -> list:
+        """ Считывает строки в порядке line_numbers и собирает объекты """
+        records = self.data_file(path)
+        return [
+            records.decode(records.read_raw(line_number), self.validation)
+            for line_number in line_numbers
+        ]
+
+    # Обход многих строк с фильтром
+    def scan_rows(
+        self, path: Path, lines, where: dict | None = None
+    ) -> list[tuple[int, object]]:
+        """ Пары (номер строки, объект) для строк lines, у которых поля
+        равны where. Большие обходы идут в пуле процессов. """
+        records = self.data_file(path)
+        if (
+            self.scanner.enabled
+            and len(lines) >= self.parallel_scan_threshold
+        ):
+            return self.scanner.scan(
+                path, self.data_models[path], lines, where, self.validation
+            )
+        return list(filter_rows(records, lines, where or {}, self.validation))
+
+    # Запись нескольких строк за одно открытие файла
+    def write_many(self, path: Path, rows: list[tuple[int, object]]) -> None:
+        """ Записывает пары (номер строки, объект) в порядке номеров строк """
+        records = self.data_file(path)
+        codec = records.codec
+        f = self.writers.get(path)
+        written = 0
+        # Подряд идущие строки пишем одним вызовом
+        runs: list[tuple[int, list[bytes]]] = []
+        next_line = None
+        for line_number, obj in sorted(rows, key=lambda row: row[0]):
+            if line_number != next_line:
+                runs.append((line_number, []))
+            # None - пустая строка на месте удаленной записи
+            runs[-1][1].append(
+                codec.blank() if obj is None else codec.encode(obj)
+            )
+            next_line = line_number + 1
+        for line_number, chunks in runs:
+            written += os.pwrite(
+                f.fileno(), b''.join(chunks), records.offset(line_number)
+            )
+        self.sync_policy.written(f, data=True)
+        if metrics.active:
+            metrics.record('bytes_written', written)
+        stores = self.column_stores()
+        if path in stores:
+            if not self.columns_marker_path.exists():
+                # Колонки только что включили: сначала строим их по данным
+                self.build_columns()
+            stores[path].write(self.column_rows(path, rows))
 
     # Находит номер строки
     def find_line(self, path: Path, id) -> int | None:
         """ Находит номер строки """
-        index = self.read_index(path)
-        for entry in index:
-            if entry[0] == id:
-                return entry[1]
-        return None
+        return self.indexes[path].get(id)
+
+    # Кеш таблицы
+    def cache_for(self, path: Path) -> RecordCache:
+        """ Кеш таблицы; очищается, если ее индексы изменились на диске """
+        cache = self.caches[path]
+        cache.check(tuple(index.refresh() for index in self.cache_indexes[path]))
+        return cache
+
+    # Поиск объекта по ключу
+    def find_row(self, path: Path, key):
+        """ Объект таблицы по ключу: из кеша, иначе из файла с данными """
+        cache = self.cache_for(path)
+        obj = cache.get(key)
+        if obj is None:
+            line_number = self.data_indexes[path].get(key)
+            if line_number is None:
+                return None
+            obj = self.read_row(path, line_number)
+            cache.put(key, obj)
+        return obj
+
+    def find_rows(self, path: Path, keys) -> dict:
+        """ find_row для пачки ключей: ключ -> объект (без ненайденных).
+
+        Ключи, которых нет в кеше, ищутся в индексе одним вызовом, строки
+        читаются по возрастанию номеров.
+        """
+        cache = self.cache_for(path)
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            obj = cache.get(key)
+            if obj is None:
+                missing.append(key)
+            else:
+                found[key] = obj
+        lines = {
+            line_number: key
+            for key, line_number in zip(
+                missing, self.data_indexes[path].get_many(missing)
+            )
+            if line_number is not None
+        }
+        ordered = sorted(lines)
+        for line_number, obj in zip(ordered, self.read_rows(path, ordered)):
+            key = lines[line_number]
+            found[key] = obj
+            cache.put(key, obj)
+        return found
 
     # Найти машину по vin
+    @reading
     def find_car(self, vin: str) -> Car | None:
         """ По vin находит машину в файле с данными """
-        line_number = self.find_line(self.cars_index_path, vin)
-        if line_number is not None:
-            json_obj = self.read_data(self.cars_data_path, line_number)
-            car = Car(**json_obj)
+        car = self.find_row(self.cars_data_path, vin)
+        if car is not None:
             return car
         else:
             print(f'Данные о машине {vin} не найдены')
             return None
 
     # Найти модель по id
+    @reading
     def find_model(self, id: int) -> Model | None:
         """ По id находит модель"""
-        line_number = self.find_line(self.models_index_path, id)
-        if line_number is not None:
-            json_obj = self.read_data(self.models_data_path, line_number)
-            model = Model(**json_obj)
+        model = self.find_row(self.models_data_path, id)
+        if model is not None:
             return model
         print(f'Данные о модели "{id}" не найдены')
         return None
 
     # Найти продажу но номеру
+    @reading
     def find_sale(self, sales_number):
         """ По номеру продажи находит данные о продаже """
-        line_number = self.find_line(self.sales_index_path, sales_number)
-        if line_number is not None:
-            json_obj = self.read_data(self.sales_data_path, line_number)
-            sale = Sale(**json_obj)
+        sale = self.find_row(self.sales_data_path, sales_number)
+        if sale is not None:
             return sale
         else:
             print('Данные о продаже не найдены')
             return None
 
     # Обновить статус
+    @writing
     def update_status(self, vin: str, new_status: CarStatus) -> Car | None:
         """ Устанавливает новый статус для машины """
         car = self.find_car(vin)  # Находим машину и номер строки
         if car:
+            old_status = car.status
             car.status = CarStatus(new_status)  # Обновляем статус
             line_number = self.find_line(self.cars_index_path, vin)
             self.write_data(self.cars_data_path, car, line_number)
+            self.caches[self.cars_data_path].put(vin, car)
+            self.status_index.set(line_number, car.status)
+            # Обновляем счетчики продаж модели
+            if old_status != CarStatus.sold and car.status == CarStatus.sold:
+                self.model_sales.add(car.model, car.price)
+            elif old_status == CarStatus.sold and car.status != CarStatus.sold:
+                self.model_sales.remove(car.model, car.price)
             return car
         return None
 
     # Задание 1. Сохранение моделей
+    @writing
     def add_model(self, model: Model) -> Model:
         """ Записывает в файлы информацию о новой модели """
-        # Читаем файл с индексами
-        models_index = self.read_index(self.models_index_path)
-
         # Проверяем, есть ли уже такой id в индексе
-        for index in models_index:
-            if index[0] == model.id:
-                break
-        else:
-            line_number = len(models_index)
-            models_index.append([model.id, line_number])
-            self.add_index(self.models_index_path, models_index)
+        if model.id not in self.models_index:
+            line_number = len(self.models_index)
+            # Сначала данные, потом индекс: индекс не должен указывать
+            # на незаписанную строку
             self.write_data(self.models_data_path, model, line_number)
+            self.models_index.put(model.id, line_number)
 
         return model
 
     # Задание 1. Сохранение автомобилей
+    @writing
     def add_car(self, car: Car) -> Car:
         """ Записывает в файлы информацию о новой машине """
-        # Читаем файл с индексами
-        cars_index = self.read_index(self.cars_index_path)
-
-        # Проверяем, есть ли уже такой vin в индексе
-        for index in cars_index:
-            if index[0] == car.vin:
-                break
-        # Если такого нет, добавляем пару "vin - номер строки"
-        else:
-            line_number = len(cars_index)
-            cars_index.append([car.vin, line_number])
-            self.add_index(self.cars_index_path, cars_index)
+        # Если такого vin нет, добавляем пару "vin - номер строки"
+        if car.vin not in self.cars_index:
+            line_number = len(self.cars_index)
             self.write_data(self.cars_data_path, car, line_number)
+            self.cars_index.put(car.vin, line_number)
+            self.status_index.set(line_number, car.status)
+            if car.status == CarStatus.sold:
+                self.model_sales.add(car.model, car.price)
 
         return car
 
     # Задание 2. Сохранение продаж.
+    @writing
     def sell_car(self, sale: Sale) -> Car | None:
         """ Записывает в файлы информацию о новой продаже """
         car = self.find_car(sale.car_vin)
         if car:
-            sales_index = self.read_index(self.sales_index_path)
             # Проверяем, есть ли уже такой номер продажи в индексе
-            for index in sales_index:
-                if index[0] == sale.sales_number:
-                    break
-            else:
-                line_number = len(sales_index)
-                sales_index.append([sale.sales_number, line_number])
-                self.add_index(self.sales_index_path, sales_index)
+            if sale.sales_number not in self.sales_index:
+                line_number = self.allocate_sales_lines(1)[0]
                 self.write_data(self.sales_data_path, sale, line_number)
+                self.sales_index.put(sale.sales_number, line_number)
+                self.sales_vin_index.put(sale.car_vin, line_number)
+                self.caches[self.sales_data_path].put(sale.sales_number, sale)
                 car = self.update_status(sale.car_vin, CarStatus.sold)
             return car
         return None
 
+    # Выделение строк под новые продажи
+    def allocate_sales_lines(self, count: int) -> list[int]:
+        """ Берет свободные строки sales.txt, недостающие - в конце файла """
+        if not count:
+            return []
+        lines = self.sales_free_slots.take(count)
+        end = len(self.data_file(self.sales_data_path))
+        return lines + list(range(end, end + count - len(lines)))
+
+    # Пакетная загрузка моделей
+    @writing
+    def add_models(self, models: list[Model | dict]) -> list[Model]:
+        """ Сохраняет пачку моделей: одна запись в файл и одна в индекс """
+        # Сначала проверяем всю пачку, потом пишем
+        models = [Model.model_validate(model) for model in models]
+        rows, new_ids = [], set()
+        line_number = len(self.models_index)
+        for model in models:
+            if model.id in new_ids or model.id in self.models_index:
+                continue
+            new_ids.add(model.id)
+            rows.append((line_number, model))
+            line_number += 1
+
+        if rows:
+            self.write_many(self.models_data_path, rows)
+            self.models_index.put_many(
+                [(model.id, line) for line, model in rows]
+            )
+        return models
+
+    # Пакетная загрузка машин
+    @writing
+    def add_cars(self, cars: list[Car | dict]) -> list[Car]:
+        """ Сохраняет пачку машин: одна запись в файл и одна в индекс """
+        cars = [Car.model_validate(car) for car in cars]
+        rows, new_vins = [], set()
+        line_number = len(self.cars_index)
+        for car in cars:
+            if car.vin in new_vins or car.vin in self.cars_index:
+                continue
+            new_vins.add(car.vin)
+            rows.append((line_number, car))
+            line_number += 1
+
+        if rows:
+            self.write_many(self.cars_data_path, rows)
+            self.cars_index.put_many([(car.vin, line) for line, car in rows])
+            self.status_index.set_many(
+                [(line, car.status) for line, car in rows]
+            )
+            self.model_sales.add_many([
+                (car.model, car.price) for _, car in rows
+                if car.status == CarStatus.sold
+            ])
+        return cars
+
+    # Пакетная загрузка продаж
+    @writing
+    def sell_cars(self, sales: list[Sale | dict]) -> list[Car | None]:
+        """ Сохраняет пачку продаж и помечает машины проданными """
+        sales = [Sale.model_validate(sale) for sale in sales]
+        car_lines = self.cars_index.get_many(sale.car_vin for sale in sales)
+
+        # Машины читаем за один проход по файлу
+        known_lines = sorted({line for line in car_lines if line is not None})
+        cars_by_line = dict(zip(
+            known_lines,
+            self.read_rows(self.cars_data_path, known_lines)
+        ))
+
+        new_sales, sold, newly_sold, new_numbers = [], {}, [], set()
+        for sale, car_line in zip(sales, car_lines):
+            if car_line is None:
+                continue
+            if sale.sales_number in new_numbers:
+                continue
+            if sale.sales_number in self.sales_index:
+                continue
+            new_numbers.add(sale.sales_number)
+            new_sales.append(sale)
+            car = cars_by_line[car_line]
+            if car.status != CarStatus.sold:
+                newly_sold.append((car.model, car.price))
+            car.status = CarStatus.sold
+            sold[car_line] = car
+
+        rows = list(zip(self.allocate_sales_lines(len(new_sales)), new_sales))
+        if rows:
+            self.write_many(self.sales_data_path, rows)
+            self.sales_index.put_many(
+                [(sale.sales_number, line) for line, sale in rows]
+            )
+            self.sales_vin_index.put_many(
+                [(sale.car_vin, line) for line, sale in rows]
+            )
+            self.write_many(self.cars_data_path, list(sold.items()))
+            # Проданные машины, которые уже есть в кеше, обновляем
+            cache = self.caches[self.cars_data_path]
+            for car in sold.values():
+                cache.update(car.vin, car)
+            self.status_index.set_many(
+                [(line, CarStatus.sold) for line in sold]
+            )
+            self.model_sales.add_many(newly_sold)
+        return [
+            None if line is None else cars_by_line[line] for line in car_lines
+        ]
+
+    # Проверка индекса статусов
+    def status_index_stale(self) -> bool:
+        """ Индекс статусов разошелся с индексом машин """
+        return len(self.status_index) != len(self.cars_index)
+
+    def check_status_index(self) -> None:
+        """ Строит индекс статусов заново, если он устарел """
+        if self.status_index_stale():
+            lines = sorted(line for _, line in self.cars_index.items())
+            self.status_index.replace([
+                (line, car.status)
+                for line, car in self.scan_rows(self.cars_data_path, lines)
+            ])
+
+    # Номера строк машин с нужным статусом
+    @reading('status_index')
+    def status_lines(self, status: CarStatus) -> list[int]:
+        """ Номера строк машин с нужным статусом по возрастанию """
+        return self.status_index.lines(status)
+
     # Задание 3 Доступные к продаже
+    @reading('status_index')
     def get_cars(self, status: CarStatus) -> list[Car]:
         """ Возвращает список машин с нужным статусом """
-        cars_with_status = []
-        index = self.read_index(self.cars_index_path)
+        # Читаем только строки с нужным статусом
+        lines = self.status_lines(status)
+        return [car for _, car in self.scan_rows(self.cars_data_path, lines)]
+
+    # Проверка индекса продаж по vin
+    def sales_vin_index_stale(self) -> bool:
+        """ Индекс vin -> строка продажи пуст, а продажи есть """
+        return not len(self.sales_vin_index) and bool(len(self.sales_index))
+
+    def check_sales_vin_index(self) -> None:
+        """ Строит пустой индекс vin -> строка продажи заново """
+        if self.sales_vin_index_stale():
+            lines = sorted(line for _, line in self.sales_index.items())
+            # При нескольких продажах одной машины побеждает последняя
+            self.sales_vin_index.replace(list({
+                sale.car_vin: line
+                for line, sale in self.scan_rows(self.sales_data_path, lines)
+            }.items()))
 
-        for i in range(len(index)):
-            car_json = self.read_data(self.cars_data_path, i)
-            if car_json["status"] == status:
-                car = Car(**car_json)  # Из json в объект класса.
-                cars_with_status.append(car)
+    # Номер строки продажи по vin
+    @reading('sales_vin_index')
+    def sale_line_by_vin(self, vin: str) -> int | None:
+        """ Берет строку продажи из индекса vin, пустой индекс строит заново """
+        return self.sales_vin_index.get(vin)
+
+    # Текущие vin машин в продажах
+    @reading('sales_vin_index')
+    def sale_vins(self) -> dict[int, str]:
+        """ Номер строки продажи -> текущий vin машины. После update_vin
+        в строке продажи остается старый vin, новый берется из индекса
+        продаж по vin. """
+        return {line: vin for vin, line in self.sales_vin_index.items()}
+
+    # Постраничный обход машин
+    @reading('status_index')
+    def iter_cars(
+        self,
+        status: CarStatus | None = None,
+        model: int | None = None,
+        limit: int | None = None,
+        cursor: int = 0
+    ):
+        """ Лениво отдает пары (курсор, машина) с нужным статусом и моделью.
+
+        Курсор - номер строки, с которой нужно продолжить обход, его можно
+        передать в следующий вызов. Статус берется из индекса статусов,
+        модель сначала проверяется по байтам записи, до создания Car.
+        """
+        if status is not None:
+            lines = self.status_lines(status)
+            lines = lines[bisect_left(lines, cursor):]
+        else:
+            lines = range(cursor, len(self.cars_index))
 
-        return cars_with_status
+        records = self.data_file(self.cars_data_path)
+        prefilter = None
+        if model is not None:
+            prefilter = records.codec.prefilter('model', model)
+
+        def matching():
+            for line_number in lines:
+                # Генератор читается после выхода из iter_cars,
+                # поэтому блокировку берем на каждую строку
+                with self.lock.read():
+                    raw = records.read_raw(line_number)
+                # Быстрая проверка по байтам, потом по собранному объекту
+                if prefilter is not None and not prefilter(raw):
+                    continue
+                car = records.decode(raw, self.validation)
+                if model is not None and car.model != model:
+                    continue
+                yield line_number + 1, car
+
+        return islice(matching(), limit)
+
+    @reading('status_index')
+    def get_cars_page(
+        self,
+        status: CarStatus | None = None,
+        model: int | None = None,
+        limit: int = 50,
+        cursor: int = 0
+    ) -> tuple[list[Car], int | None]:
+        """ Страница машин и курсор следующей страницы (None - это конец) """
+        page = list(self.iter_cars(status, model, limit + 1, cursor))
+        cars = [car for _, car in page[:limit]]
+        next_cursor = page[limit - 1][0] if len(page) > limit else None
+        return cars, next_cursor
 
     # Задание 4. Детальная информация
+    @reading('sales_vin_index')
     def get_car_info(self, vin: str) -> CarFullInfo | None:
         """ Собирает детальную информацию машина-модель-продажа """
         car = self.find_car(vin)
@@ -206,17 +1032,18 @@ class CarService:
         if not model:
             return None  # Если нет модели - None.
 
-        sd, sc = None, None
+        sale = None
         if car.status == 'sold':
-            index = self.read_index(self.sales_index_path)
-            for entry in index:
-                sale_json = self.read_data(self.sales_data_path, entry[1])
-                if sale_json["car_vin"] == car.vin:
-                    sale = Sale(**sale_json)  # Из json в объект класса.
-                    sd = sale.sales_date
-                    sc = sale.cost
-                    break
+            line_number = self.sale_line_by_vin(car.vin)
+            if line_number is not None:
+                sale = self.read_row(self.sales_data_path, line_number)
 
+        return self.full_info(car, model, sale)
+
+    # Сборка детальной информации
+    def full_info(
+        self, car: Car, model: Model, sale: Sale | None
+    ) -> CarFullInfo:
         return CarFullInfo(
             vin=car.vin,
             car_model_name=model.name,
@@ -224,11 +1051,51 @@ class CarService:
             price=Decimal(car.price),
             date_start=car.date_start,
             status=car.status,
-            sales_date=sd,
-            sales_cost=sc
+            sales_date=sale.sales_date if sale else None,
+            sales_cost=sale.cost if sale else None
+        )
+
+    # Детальная информация о пачке машин
+    @reading('sales_vin_index')
+    def get_cars_info(self, vins: list[str]) -> list[CarFullInfo | None]:
+        """ get_car_info для пачки vin за один проход по каждой таблице.
+
+        Машины, которых нет в кеше, читаются по возрастанию номеров строк,
+        каждая модель - один раз, продажи проданных машин - одним чтением.
+        Результаты идут в порядке vins, None - нет машины или ее модели.
+        """
+        cars = self.find_rows(self.cars_data_path, vins)
+        models = self.find_rows(
+            self.models_data_path, [car.model for car in cars.values()]
         )
 
+        sold = [car.vin for car in cars.values() if car.status == 'sold']
+        sale_lines = {
+            line_number: vin
+            for vin, line_number in zip(
+                sold, self.sales_vin_index.get_many(sold)
+            )
+            if line_number is not None
+        }
+        lines = sorted(sale_lines)
+        sales = {
+            sale_lines[line_number]: sale
+            for line_number, sale in zip(
+                lines, self.read_rows(self.sales_data_path, lines)
+            )
+        }
+
+        result: list[CarFullInfo | None] = []
+        for vin in vins:
+            car = cars.get(vin)
+            model = models.get(car.model) if car else None
+            result.append(
+                self.full_info(car, model, sales.get(vin)) if model else None
+            )
+        return result
+
     # Задание 5. Обновление ключевого поля
+    @writing
     def update_vin(self, vin: str, new_vin: str) -> Car | None:
         """ Обновляет vin в записи машины  и перезаписывает новый индекс """
         car = self.find_car(vin)
@@ -237,56 +1104,341 @@ class CarService:
         if car:
             car.vin = new_vin
             self.write_data(self.cars_data_path, car, line_number)
-            index = self.read_index(self.cars_index_path)
+            cache = self.caches[self.cars_data_path]
+            cache.pop(vin)
+            cache.put(new_vin, car)
             # переписываем индекс
-            for entry in index:
-                if entry[0] == vin:
-                    entry[0] = new_vin
-            # записываем новый индекс в файл
-            self.add_index(self.cars_index_path, index)
+            self.cars_index.rename(vin, new_vin)
+            self.sales_vin_index.rename(vin, new_vin)
             return car
         return None
 
     # Задание 6. Удаление продажи
+    @writing
     def revert_sale(self, sales_number: str) -> Car | None:
         """ Удаляет данные о продаже"""
         sale = self.find_sale(sales_number)  # Находим продажу
-        car = self.update_status(sale.car_vin, CarStatus.available)
+        line_number = self.sales_index.get(sales_number)
+        # После update_vin в строке продажи остается старый vin, текущий
+        # берется из индекса продаж по vin
+        vin = sale.car_vin
+        if self.sales_vin_index.get(vin) != line_number:
+            vin = self.sale_vins().get(line_number, vin)
+        car = self.update_status(vin, CarStatus.available)
         if car:
-            index = self.read_index(self.sales_index_path)  # Читаем индекс
-            # Удаляем индекс
-            for i in range(len(index)):
-                if index[i][0] == sales_number:
-                    index.pop(i)
-                    break
-            self.add_index(self.sales_index_path, index)  # Переписываем индекс
+            # Удаляем индекс, строка продажи становится свободной
+            self.sales_index.delete(sales_number)
+            # Затираем строку, чтобы восстановление индекса по данным
+            # не вернуло отмененную продажу
+            self.write_many(self.sales_data_path, [(line_number, None)])
+            self.caches[self.sales_data_path].pop(sales_number)
+            self.sales_free_slots.free(line_number)
+            # Индекс vin мог уже указывать на более позднюю продажу машины
+            if self.sales_vin_index.get(vin) == line_number:
+                self.sales_vin_index.delete(vin)
             return car
         return None
 
-    # Задание 7. Самые продаваемые модели
-    def top_models_by_sales(self) -> list[ModelSaleStats] | None:
-        """ Возвращает список трех самых продаваемых моделей машин """
-        cars = self.get_cars(CarStatus.sold)
-        price_model = sorted(
-            [(car.price, car.model) for car in cars], reverse=True
+    # Сжатие файла продаж
+    def compact_sales(self) -> int:
+        """ Переписывает sales.txt без удаленных строк.
+
+        Живые строки копируются в новый файл под блокировкой на чтение,
+        блокировка на запись берется только на подмену файла и индексов
+        (если продажи за время копирования изменились, файл копируется
+        заново уже под ней). Возвращает число освобожденных байт.
+        """
+        self.finish_compaction()
+        with self.lock.read():
+            live, compact_path = self.copy_live_sales()
+        with self.lock.write():
+            if self.live_sales() != live:
+                compact_path.unlink()
+                live, compact_path = self.copy_live_sales()
+            return self.install_compacted(live, compact_path)
+
+    def live_sales(self) -> list[tuple[int, str]]:
+        """ Пары (номер строки, номер продажи) по возрастанию строк """
+        return sorted((line, key) for key, line in self.sales_index.items())
+
+    def copy_live_sales(self) -> tuple[list[tuple[int, str]], Path]:
+        """ Копирует живые строки sales.txt во временный файл рядом """
+        records = self.data_file(self.sales_data_path)
+        live = self.live_sales()
+        compact_path = temp_path(self.sales_data_path)
+        try:
+            with open(compact_path, "wb") as f:
+                f.write(records.codec.header())
+                for line, _ in live:
+                    f.write(records.read_slot(line))
+        except BaseException:
+            compact_path.unlink(missing_ok=True)
+            raise
+        if metrics.active:
+            metrics.record('file_opens')
+            metrics.record('bytes_written', compact_path.stat().st_size)
+        return live, compact_path
+
+    def install_compacted(
+        self, live: list[tuple[int, str]], compact_path: Path
+    ) -> int:
+        """ Подменяет sales.txt сжатым файлом и переписывает индексы.
+
+        Новые индексы сначала записываются в sales_compact.json: если
+        подмена прервется сбоем, ее доведет до конца finish_compaction.
+        """
+        old_size = self.sales_data_path.stat().st_size
+        new_lines = {line: new_line for new_line, (line, _) in enumerate(live)}
+        state = {
+            'path': compact_path.name,
+            'sales': [[key, new_lines[line]] for line, key in live],
+            'vins': [
+                [vin, new_lines[line]]
+                for vin, line in self.sales_vin_index.items()
+                if line in new_lines
+            ],
+        }
+        self.sync_policy.sync_path(compact_path)
+        marker_tmp = temp_path(self.sales_compact_path)
+        marker_tmp.write_text(json.dumps(state))
+        self.sync_policy.replace(marker_tmp, self.sales_compact_path)
+
+        self.writers.close(self.sales_data_path)
+        os.replace(compact_path, self.sales_data_path)
+        self.sync_policy.sync_path(self.sales_data_path)
+        store = self.column_stores().get(self.sales_data_path)
+        if store is not None:
+            store.compact([line for line, _ in live])
+        self.apply_compaction(state)
+        return old_size - self.sales_data_path.stat().st_size
+
+    def apply_compaction(self, state: dict) -> None:
+        """ Ставит индексы сжатого sales.txt и удаляет sales_compact.json """
+        self.sales_index.replace(state['sales'])
+        self.sales_vin_index.replace(state['vins'])
+        self.sales_free_slots.replace([])
+        self.records[self.sales_data_path].close()
+        self.sales_compact_path.unlink()
+        self.sync_policy.sync_path(self.root_directory_path)
+
+    # Сжатие, прерванное сбоем
+    def finish_compaction(self) -> None:
+        """ Доводит до конца сжатие sales.txt, если от него остался
+        sales_compact.json: если файл с данными уже подменен, ставит
+        записанные индексы, иначе удаляет недописанную копию """
+        if not self.sales_compact_path.exists():
+            return
+        with self.lock.write():
+            try:
+                state = json.loads(self.sales_compact_path.read_text())
+            except FileNotFoundError:
+                # Сжатие уже довел другой сервис
+                return
+            compact_path = self.root_directory_path / state['path']
+            if compact_path.exists():
+                # sales.txt не подменен, старые индексы верны
+                compact_path.unlink()
+                self.sales_compact_path.unlink()
+                return
+            self.writers.close(self.sales_data_path)
+            self.apply_compaction(state)
+            if self.column_stores():
+                self.build_columns()
+
+    # Проверка счетчиков продаж моделей
+    def model_sales_stale(self) -> bool:
+        """ Счетчики продаж разошлись с индексом статусов или у каких-то
+        моделей нужно пересчитать самую высокую цену """
+        return (
+            len(self.model_sales) != self.status_index.count(CarStatus.sold)
+            or bool(self.model_sales.unknown_max())
         )
-        sorted_models = [model for _, model in price_model]
-        top3_models = Counter(sorted_models).most_common(3)
 
-        top3_models_data = []
-        for mdl in top3_models:
-            model = self.find_model(mdl[0])
+    def check_model_sales(self) -> None:
+        """ Пересчитывает счетчики, если они устарели """
+        self.check_status_index()
+        prices = {
+            model: [
+                car.price for _, car in self.iter_cars(CarStatus.sold, model)
+            ]
+            for model in self.model_sales.unknown_max()
+        }
+        if (
+            len(self.model_sales) != self.status_index.count(CarStatus.sold)
+            or not all(prices.values())
+        ):
+            cars = self.get_cars(CarStatus.sold)
+            self.model_sales.replace([(car.model, car.price) for car in cars])
+            return
+        for model, model_prices in prices.items():
+            self.model_sales.set_max(model, model_prices)
+
+    # Суммы продаж по группам
+    @reading('sales_vin_index', 'columns')
+    def sales_totals(
+        self,
+        group_by: str = 'month',
+        date_from: datetime | None = None,
+        date_to: datetime | None = None
+    ) -> dict[str, list]:
+        """ Суммы продаж с date_from <= sales_date < date_to по группам:
+        группа -> [число продаж, выручка, сумма цен проданных машин].
+
+        group_by - 'brand', 'model' (группа - "марка модель"), 'day'
+        (ГГГГ-ММ-ДД) или 'month' (ГГГГ-ММ), дни и месяцы - по UTC. Даты
+        сравниваются как моменты времени, время без часового пояса
+        считается UTC. Продажи читаются
+        одним проходом по sales.txt пачками по parallel_scan_threshold строк
+        (пачка - в пуле процессов) и сразу складываются в суммы; машины
+        пачки - по возрастанию номеров строк, каждая модель - один раз.
+        Продажи, у которых не нашлась машина или модель, не учитываются.
+        """
+        if group_by not in SALES_GROUPS:
+            raise ValueError(f'Неизвестная группировка: {group_by}')
+        models: dict[int, Model | None] = {}
+        totals: dict[str, list] = {}
+        arrays = self.column_arrays()
+        if arrays is not None:
+            # Те же суммы векторно по колонкам
+            sums = sales_sums(*arrays, group_by, date_from, date_to)
+            for key, (count, revenue, prices) in sums.items():
+                group = (
+                    key if group_by in ('day', 'month')
+                    else self.model_group(key, group_by, models)
+                )
+                if group is not None:
+                    merge_sales(
+                        totals, group,
+                        [count, from_cents(revenue), from_cents(prices)]
+                    )
+            return totals
+
+        start = None if date_from is None else epoch(date_from)
+        end = None if date_to is None else epoch(date_to)
+        line_vins = self.sale_vins()
+        lines = sorted(line for _, line in self.sales_index.items())
+        records = self.data_file(self.cars_data_path)
+        for chunk_start in range(0, len(lines), self.parallel_scan_threshold):
+            chunk = lines[
+                chunk_start:chunk_start + self.parallel_scan_threshold
+            ]
+            sales = [
+                (line, sale)
+                for line, sale in self.scan_rows(self.sales_data_path, chunk)
+                if (start is None or epoch(sale.sales_date) >= start)
+                and (end is None or epoch(sale.sales_date) < end)
+            ]
+            car_lines = self.cars_index.get_many(
+                line_vins.get(line, sale.car_vin) for line, sale in sales
+            )
+
+            # От машины нужны только цена и модель
+            cars = {}
+            for car_line in sorted(set(car_lines) - {None}):
+                car = records.decode(records.read_raw(car_line), self.validation)
+                cars[car_line] = (car.price, car.model)
+
+            for car_line, (_, sale) in zip(car_lines, sales):
+                if car_line is None:
+                    continue
+                price, model_id = cars[car_line]
+                if group_by in ('day', 'month'):
+                    group = utc_date(sale.sales_date, group_by)
+                else:
+                    group = self.model_group(model_id, group_by, models)
+                if group is not None:
+                    merge_sales(
+                        totals, group, [1, money(sale.cost), money(price)]
+                    )
+        return totals
+
+    # Отчет о продажах
+    @reading('sales_vin_index', 'columns')
+    def sales_report(
+        self,
+        group_by: str = 'month',
+        date_from: datetime | None = None,
+        date_to: datetime | None = None
+    ) -> list[SalesReport]:
+        """ Число продаж, выручка, средняя стоимость и средняя скидка от
+        цены машины по группам (см. sales_totals и report_rows) """
+        return report_rows(self.sales_totals(group_by, date_from, date_to))
+
+    # Машины по группам
+    @reading('columns')
+    def inventory_totals(self, group_by: str = 'status') -> dict[str, list]:
+        """ Машины по группам: группа -> [число машин, сумма цен,
+        минимальная цена, максимальная цена].
+
+        group_by - 'status', 'brand' или 'model' (группа - "марка
+        модель"). С колонками считается векторно, иначе одним проходом по
+        cars.txt.
+        """
+        if group_by not in INVENTORY_GROUPS:
+            raise ValueError(f'Неизвестная группировка: {group_by}')
+        models: dict[int, Model | None] = {}
+        totals: dict[str, list] = {}
+        arrays = self.column_arrays()
+        if arrays is not None:
+            sums = inventory_sums(arrays[0], group_by)
+            for key, (count, total, lowest, highest) in sums.items():
+                group = (
+                    key if group_by == 'status'
+                    else self.model_group(key, group_by, models)
+                )
+                if group is not None:
+                    merge_inventory(totals, group, [
+                        count, from_cents(total),
+                        from_cents(lowest), from_cents(highest)
+                    ])
+            return totals
+
+        lines = sorted(line for _, line in self.cars_index.items())
+        for _, car in self.scan_rows(self.cars_data_path, lines):
+            group = (
+                str(car.status) if group_by == 'status'
+                else self.model_group(car.model, group_by, models)
+            )
+            if group is not None:
+                price = money(car.price)
+                merge_inventory(totals, group, [1, price, price, price])
+        return totals
+
+    # Отчет о машинах
+    @reading('columns')
+    def inventory_report(
+        self, group_by: str = 'status'
+    ) -> list[InventoryReport]:
+        """ Число машин, сумма, минимум, максимум и среднее цен по
+        группам (см. inventory_totals) """
+        return inventory_rows(self.inventory_totals(group_by))
+
+    # Счетчики продаж моделей
+    @reading('status_index', 'model_sales')
+    def model_sales_stats(self) -> dict:
+        """ Модель -> (число проданных машин, самая высокая цена) """
+        return self.model_sales.stats()
+
+    # Задание 7. Самые продаваемые модели
+    @reading('status_index', 'model_sales')
+    def top_models_by_sales(
+        self, limit: int = 3
+    ) -> list[ModelSaleStats] | None:
+        """ Возвращает список limit самых продаваемых моделей машин """
+        top_models_data = []
+        for model_id, sales_number in self.model_sales.top(limit):
+            model = self.find_model(model_id)
             if not model:
                 return None
 
             model_stat = ModelSaleStats(
                 car_model_name=model.name,
                 brand=model.brand,
-                sales_number=mdl[1]
+                sales_number=sales_number
             )
-            top3_models_data.append(model_stat)
+            top_models_data.append(model_stat)
 
-        return top3_models_data
+        return top_models_data
 
 
 models = [
@@ -444,12 +1596,9 @@ sales = [
 
 if __name__ == "__main__":
     car_service = CarService('bibip_database')
-    for model in models:
-        car_service.add_model(model)
-    for car in cars:
-        car_service.add_car(car)
-    for sale in sales:
-        car_service.sell_car(sale)
+    car_service.add_models(models)
+    car_service.add_cars(cars)
+    car_service.sell_cars(sales)
     # print(car_service.get_cars(CarStatus.available))
     # print(car_service.get_car_info('KNAGH4A48A5414970'))
     # print(car_service.top_models_by_sales())
@@ -0,0 +1,143 @@
+import argparse
+import csv
+import json
+import sys
+import time
+
+from record_file import migrate_directory
+from sharding import batches, database_path, open_car_service, reshard
+
+
+# Чтение входного файла построчно
+def read_records(stream, input_format: str):
+    """ Отдает записи из JSONL или CSV по одной """
+    if input_format == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def load(args) -> None:
+    """ Загружает модели, машины или продажи пачками """
+    input_format = args.format
+    if input_format is None:
+        input_format = 'csv' if args.input.endswith('.csv') else 'jsonl'
+
+    stream = sys.stdin if args.input == '-' else open(args.input, "r")
+    started = time.perf_counter()
+    total = 0
+    with open_car_service(args.database) as service:
+        loaders = {
+            'models': service.add_models,
+            'cars': service.add_cars,
+            'sales': service.sell_cars,
+        }
+        try:
+            for batch in batches(read_records(stream, input_format), args.batch_size):
+                loaders[args.table](batch)
+                total += len(batch)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        service.checkpoint()
+
+    elapsed = time.perf_counter() - started
+    rate = total / elapsed if elapsed else 0.0
+    print(f'{args.table}: {total} записей за {elapsed:.2f} с ({rate:.0f} записей/с)')
+
+
+def compact(args) -> None:
+    """ Сжимает файл продаж """
+    with open_car_service(args.database) as service:
+        reclaimed = service.compact_sales()
+    print(f'sales: освобождено {reclaimed} байт')
+
+
+def migrate(args) -> None:
+    """ Переводит файлы с данными в другой формат (базу нужно остановить) """
+    # У базы с шардами файлы с данными лежат в каталогах шардов
+    root = database_path(args.database)
+    directories = [root, *sorted(root.glob('shard_*'))]
+    for directory in directories:
+        for name, count in migrate_directory(directory, args.to).items():
+            print(f'{directory / name}: переписано {count} строк')
+
+
+def rebuild(args) -> None:
+    """ Строит индексы заново по файлам с данными """
+    with open_car_service(args.database) as service:
+        for shard in getattr(service, 'shards', [service]):
+            for name, count in shard.rebuild_indexes().items():
+                print(f'{shard.root_directory_path / name}: {count} записей')
+
+
+def build_columns(args) -> None:
+    """ Включает колонки числовых полей и строит их по файлам с данными """
+    with open_car_service(args.database) as service:
+        for shard in getattr(service, 'shards', [service]):
+            for name, count in shard.rebuild_columns().items():
+                print(f'{shard.root_directory_path / name}: {count} строк')
+
+
+def reshard_database(args) -> None:
+    """ Раскладывает базу по шардам (базу нужно остановить) """
+    counts = reshard(args.database, args.shards)
+    for table, count in counts.items():
+        print(f'{table}: {count}')
+    print(f'старая база сохранена в {args.database}.bak')
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Утилиты базы bibip')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load_parser = commands.add_parser('load', help='пакетная загрузка данных')
+    load_parser.add_argument('database', help='каталог базы')
+    load_parser.add_argument('table', choices=['models', 'cars', 'sales'])
+    load_parser.add_argument('input', help='файл JSONL/CSV или "-" для stdin')
+    load_parser.add_argument('--format', choices=['jsonl', 'csv'])
+    load_parser.add_argument('--batch-size', type=int, default=10000)
+    load_parser.set_defaults(handler=load)
+
+    compact_parser = commands.add_parser(
+        'compact', help='удалить строки отмененных продаж из sales.txt'
+    )
+    compact_parser.add_argument('database', help='каталог базы')
+    compact_parser.set_defaults(handler=compact)
+
+    migrate_parser = commands.add_parser(
+        'migrate', help='перевести файлы с данными в другой формат'
+    )
+    migrate_parser.add_argument('database', help='каталог базы')
+    migrate_parser.add_argument(
+        '--to', choices=['json', 'binary'], default='binary'
+    )
+    migrate_parser.set_defaults(handler=migrate)
+
+    rebuild_parser = commands.add_parser(
+        'rebuild', help='построить индексы заново по файлам с данными'
+    )
+    rebuild_parser.add_argument('database', help='каталог базы')
+    rebuild_parser.set_defaults(handler=rebuild)
+
+    columns_parser = commands.add_parser(
+        'columns', help='построить колонки числовых полей для отчетов'
+    )
+    columns_parser.add_argument('database', help='каталог базы')
+    columns_parser.set_defaults(handler=build_columns)
+
+    reshard_parser = commands.add_parser(
+        'reshard', help='разложить машины и продажи по шардам'
+    )
+    reshard_parser.add_argument('database', help='каталог базы')
+    reshard_parser.add_argument('--shards', type=int, required=True)
+    reshard_parser.set_defaults(handler=reshard_database)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
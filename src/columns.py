@@ -0,0 +1,273 @@
+from calendar import timegm
+from datetime import datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+import os
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    # Без numpy колонки ведутся, но отчеты считаются по строкам
+    np = None
+
+import metrics
+from durability import WriteHandles, temp_path
+from models import Car, CarStatus, Sale
+
+# Файл-метка в каталоге базы: для базы ведутся колонки
+COLUMNS_FILE = 'columns.json'
+# Коды статусов машин в колонке status; 0 - пустая строка
+STATUS_CODES = {status: code for code, status in enumerate(CarStatus, 1)}
+STATUSES = {code: status for status, code in STATUS_CODES.items()}
+
+# Колонки файлов с данными: (поле, формат struct)
+CAR_COLUMNS = (
+    ('model', 'q'), ('price', 'q'), ('date_start', 'q'), ('status', 'b')
+)
+# car_line - номер строки машины в cars.txt, -1 у пустой строки
+SALE_COLUMNS = (('car_line', 'q'), ('cost', 'q'), ('sales_date', 'q'))
+
+
+def cents(value: Decimal) -> int:
+    """ Сумма в копейках """
+    return int((Decimal(value) * 100).to_integral_value())
+
+
+def from_cents(value: int) -> Decimal:
+    return Decimal(int(value)).scaleb(-2)
+
+
+def money(value: Decimal) -> Decimal:
+    """ Сумма, округленная до копеек так же, как в колонках """
+    return from_cents(cents(value))
+
+
+def epoch(value: datetime) -> int:
+    """ Секунды с 1970-01-01; время без часового пояса считается UTC """
+    return timegm(value.utctimetuple())
+
+
+def utc_date(value: datetime, group_by: str) -> str:
+    """ День (ГГГГ-ММ-ДД) или месяц (ГГГГ-ММ) по UTC - те же ключи, что у
+    sales_sums по колонке sales_date """
+    value = datetime.fromtimestamp(epoch(value), timezone.utc)
+    return f'{value:%Y-%m-%d}' if group_by == 'day' else f'{value:%Y-%m}'
+
+
+def car_values(car: Car | None) -> tuple:
+    """ Значения колонок строки cars.txt """
+    if car is None:
+        return (0, 0, 0, 0)
+    return (
+        car.model, cents(car.price), epoch(car.date_start),
+        STATUS_CODES[CarStatus(car.status)]
+    )
+
+
+def sale_values(sale: Sale | None, car_line: int | None) -> tuple:
+    """ Значения колонок строки sales.txt """
+    if sale is None or car_line is None:
+        return (-1, 0, 0)
+    return (car_line, cents(sale.cost), epoch(sale.sales_date))
+
+
+class ColumnStore:
+    """ Колонки одного файла с данными.
+
+    Каждое поле лежит в своем файле <таблица>.<поле>.col: значения
+    фиксированной ширины без заголовка, значение строки line_number - по
+    смещению line_number * ширина. Файлы дописываются вместе с файлом с
+    данными и читаются через numpy.memmap.
+    """
+
+    def __init__(
+        self, data_path: Path, columns: tuple, writers: WriteHandles
+    ) -> None:
+        self.columns = columns
+        self.writers = writers
+        self.paths = {
+            name: data_path.with_name(f'{data_path.stem}.{name}.col')
+            for name, _ in columns
+        }
+        self.widths = {
+            name: struct.calcsize('<' + code) for name, code in columns
+        }
+        # Отображения файлов: поле -> ((inode, размер), массив)
+        self._arrays: dict[str, tuple] = {}
+
+    def _file(self, name: str):
+        try:
+            return self.writers.get(self.paths[name])
+        except FileNotFoundError:
+            self.paths[name].touch()
+            return self.writers.get(self.paths[name])
+
+    def write(self, rows: list[tuple[int, tuple]]) -> None:
+        """ Записывает пары (номер строки, значения колонок) """
+        # Подряд идущие строки пишем одним вызовом
+        runs: list[tuple[int, list[tuple]]] = []
+        next_line = None
+        for line_number, values in sorted(rows, key=lambda row: row[0]):
+            if line_number != next_line:
+                runs.append((line_number, []))
+            runs[-1][1].append(values)
+            next_line = line_number + 1
+
+        written = 0
+        for position, (name, code) in enumerate(self.columns):
+            f = self._file(name)
+            for line_number, values in runs:
+                data = struct.pack(
+                    f'<{len(values)}{code}',
+                    *(row[position] for row in values)
+                )
+                written += os.pwrite(
+                    f.fileno(), data, line_number * self.widths[name]
+                )
+            self.writers.sync.written(f, data=True)
+        if metrics.active:
+            metrics.record('bytes_written', written)
+
+    def replace(self, values: list[tuple]) -> None:
+        """ Переписывает колонки целиком: строка i получает values[i] """
+        for position, (name, code) in enumerate(self.columns):
+            self._replace_file(name, struct.pack(
+                f'<{len(values)}{code}', *(row[position] for row in values)
+            ))
+
+    def compact(self, lines: list[int]) -> None:
+        """ Оставляет строки lines (по порядку), как при сжатии файла """
+        for name, width in self.widths.items():
+            try:
+                data = self.paths[name].read_bytes()
+            except FileNotFoundError:
+                data = b''
+            self._replace_file(name, b''.join(
+                data[line * width:(line + 1) * width] for line in lines
+            ))
+
+    def _replace_file(self, name: str, data: bytes) -> None:
+        path = self.paths[name]
+        tmp_path = temp_path(path)
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            self.writers.close(path)
+            self.writers.sync.replace(tmp_path, path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        self._arrays.pop(name, None)
+
+    def rows(self) -> int | None:
+        """ Число строк во всех колонках; None, если длины разошлись """
+        counts = set()
+        for name, path in self.paths.items():
+            try:
+                size = os.stat(path).st_size
+            except FileNotFoundError:
+                return None
+            if size % self.widths[name]:
+                return None
+            counts.add(size // self.widths[name])
+        return counts.pop() if len(counts) == 1 else None
+
+    def arrays(self) -> dict:
+        """ Колонки как массивы numpy (отображения файлов в память) """
+        arrays = {}
+        for name, code in self.columns:
+            st = os.stat(self.paths[name])
+            stamp = (st.st_ino, st.st_size)
+            cached = self._arrays.get(name)
+            if cached is None or cached[0] != stamp:
+                dtype = np.dtype('<' + code)
+                if st.st_size:
+                    array = np.memmap(self.paths[name], dtype, mode='r')
+                    if metrics.active:
+                        metrics.record('file_opens')
+                else:
+                    array = np.zeros(0, dtype)
+                cached = self._arrays[name] = (stamp, array)
+            arrays[name] = cached[1]
+        return arrays
+
+    def close(self) -> None:
+        self._arrays = {}
+
+
+# Векторные суммы по колонкам
+def _group(keys) -> tuple:
+    """ Различные ключи и номер группы каждой строки """
+    return np.unique(keys, return_inverse=True)
+
+
+def _sums(groups: int, inverse, values):
+    sums = np.zeros(groups, np.int64)
+    np.add.at(sums, inverse, values)
+    return sums
+
+
+def sales_sums(
+    cars: dict,
+    sales: dict,
+    group_by: str,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None
+) -> dict:
+    """ Суммы продаж по группам: ключ -> [число продаж, выручка в
+    копейках, сумма цен машин в копейках].
+
+    Ключ - дата по UTC (ГГГГ-ММ-ДД или ГГГГ-ММ) для группировки по дням
+    и месяцам, иначе id модели.
+    """
+    mask = sales['car_line'] >= 0
+    if date_from is not None:
+        mask &= sales['sales_date'] >= epoch(date_from)
+    if date_to is not None:
+        mask &= sales['sales_date'] < epoch(date_to)
+    car_lines = sales['car_line'][mask]
+    if group_by in ('day', 'month'):
+        unit = 'D' if group_by == 'day' else 'M'
+        keys = sales['sales_date'][mask].astype('datetime64[s]').astype(
+            f'datetime64[{unit}]'
+        )
+    else:
+        keys = cars['model'][car_lines]
+    unique, inverse = _group(keys)
+    counts = np.bincount(inverse, minlength=len(unique))
+    revenue = _sums(len(unique), inverse, sales['cost'][mask])
+    prices = _sums(len(unique), inverse, cars['price'][car_lines])
+    if group_by in ('day', 'month'):
+        unique = np.datetime_as_string(unique)
+    return {
+        key.item(): [int(count), int(total), int(price)]
+        for key, count, total, price in zip(unique, counts, revenue, prices)
+    }
+
+
+def inventory_sums(cars: dict, group_by: str) -> dict:
+    """ Машины по группам: ключ -> [число машин, сумма цен, минимальная
+    и максимальная цена] (цены в копейках).
+
+    Ключ - статус для группировки по статусу, иначе id модели.
+    """
+    mask = cars['status'] > 0
+    keys = cars['status' if group_by == 'status' else 'model'][mask]
+    prices = cars['price'][mask]
+    unique, inverse = _group(keys)
+    counts = np.bincount(inverse, minlength=len(unique))
+    totals = _sums(len(unique), inverse, prices)
+    lowest = np.full(len(unique), np.iinfo(np.int64).max)
+    np.minimum.at(lowest, inverse, prices)
+    highest = np.full(len(unique), np.iinfo(np.int64).min)
+    np.maximum.at(highest, inverse, prices)
+    result = {}
+    for key, count, total, low, high in zip(
+        unique, counts, totals, lowest, highest
+    ):
+        key = key.item()
+        if group_by == 'status':
+            key = str(STATUSES[key])
+        result[key] = [int(count), int(total), int(low), int(high)]
+    return result
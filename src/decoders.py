@@ -0,0 +1,41 @@
+import json
+
+from pydantic import BaseModel
+
+VALIDATION_MODES = ('strict', 'trusted')
+
+
+def decode_strict(model_cls: type[BaseModel], raw: bytes) -> BaseModel:
+    """ Разбор JSON в словарь и полная проверка полей - для данных извне """
+    return model_cls(**json.loads(raw))
+
+
+def decode_trusted(model_cls: type[BaseModel], raw: bytes) -> BaseModel:
+    """ Сборка объекта прямо из байт записи скомпилированным валидатором
+    pydantic-core, без промежуточного словаря - для строк, записанных
+    самим сервисом.
+
+    model_construct здесь медленнее: Decimal и datetime пришлось бы
+    разбирать на python.
+    """
+    return model_cls.model_validate_json(raw)
+
+
+def construct_trusted(model_cls: type[BaseModel], fields: dict) -> BaseModel:
+    """ Объект из полей, которые уже имеют нужные типы (двоичный формат).
+
+    То же, что model_construct, но без его разбора аргументов: словарь
+    полей сразу становится __dict__ объекта.
+    """
+    obj = object.__new__(model_cls)
+    object.__setattr__(obj, '__dict__', fields)
+    object.__setattr__(obj, '__pydantic_fields_set__', set(fields))
+    object.__setattr__(obj, '__pydantic_extra__', None)
+    object.__setattr__(obj, '__pydantic_private__', None)
+    return obj
+
+
+DECODERS = {
+    'strict': decode_strict,
+    'trusted': decode_trusted,
+}
@@ -0,0 +1,177 @@
+from pathlib import Path
+import os
+import tempfile
+import threading
+
+import metrics
+
+DURABILITY_MODES = ('none', 'fsync-per-op', 'group-commit')
+# Маска прав процесса: временные файлы получают те же права, что и open()
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def temp_path(path: Path) -> Path:
+    """ Новый пустой временный файл рядом с path.
+
+    Имя уникальное, поэтому одновременные записи одного файла из разных
+    процессов не подменяют временные файлы друг друга.
+    """
+    fd, name = tempfile.mkstemp(
+        prefix=f'{path.name}.', suffix='.tmp', dir=path.parent
+    )
+    # mkstemp создает файл с правами только для владельца
+    os.fchmod(fd, 0o666 & ~UMASK)
+    os.close(fd)
+    return Path(name)
+
+
+def fsync_path(path: Path) -> None:
+    """ Сбрасывает на диск файл или каталог по пути """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SyncPolicy:
+    """ Когда записанное попадает на диск.
+
+    'none' - данные уходят в ОС сразу (файлы открыты без буфера), на диск
+    их сбрасывает сама ОС; после сбоя питания может пропасть что угодно
+    из последних записей.
+    'fsync-per-op' - каждый файл сбрасывается на диск после каждой записи:
+    все, что вернул метод сервиса, переживет сбой.
+    'group-commit' - записи копятся и сбрасываются на диск вместе, когда
+    накопится group_ops записей в файлы или пройдет group_ms миллисекунд
+    после первой несброшенной записи. После сбоя теряется не больше одной
+    такой группы.
+
+    Что после сбоя питания видит индекс на диске:
+    'none' - порядок записи на диск выбирает ОС, журнал индекса может
+    попасть туда раньше строки и указывать на пустой или старый слот.
+    'fsync-per-op' - строка сброшена раньше, чем записан журнал, поэтому
+    индекс никогда не указывает на незаписанную строку.
+    'group-commit' - при сбросе группы файлы с данными сбрасываются раньше
+    журналов, поэтому все до последнего сброса согласовано. В последней,
+    несброшенной группе ОС могла записать журнал раньше строки, и индекс
+    может указывать на незаписанную строку, как в 'none'.
+    """
+
+    def __init__(
+        self,
+        mode: str = 'none',
+        group_ops: int = 100,
+        group_ms: float = 10
+    ) -> None:
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f'Неизвестный режим надежности: {mode}')
+        self.mode = mode
+        self.group_ops = group_ops
+        self.group_ms = group_ms
+        self._lock = threading.Lock()
+        # Несброшенные файлы: сначала данные, потом журналы
+        self._dirty_data: dict[int, object] = {}
+        self._dirty_index: dict[int, object] = {}
+        self._pending = 0
+        self._timer: threading.Timer | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != 'none'
+
+    def written(self, f, data: bool = False) -> None:
+        """ Отмечает запись в открытый файл f (data - файл с данными) """
+        if self.mode == 'none':
+            return
+        if self.mode == 'fsync-per-op':
+            self._fsync(f)
+            return
+        with self._lock:
+            dirty = self._dirty_data if data else self._dirty_index
+            dirty[f.fileno()] = f
+            self._pending += 1
+            if self._pending >= self.group_ops:
+                self._flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.group_ms / 1000, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _fsync(self, f) -> None:
+        os.fsync(f.fileno())
+        if metrics.active:
+            metrics.record('fsyncs')
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for dirty in (self._dirty_data, self._dirty_index):
+            for f in dirty.values():
+                self._fsync(f)
+            dirty.clear()
+        self._pending = 0
+
+    def flush(self) -> None:
+        """ Сбрасывает на диск все накопленные записи """
+        with self._lock:
+            self._flush()
+
+    def release(self, f) -> None:
+        """ Сбрасывает файл перед закрытием и забывает о нем """
+        with self._lock:
+            fd = f.fileno()
+            if fd in self._dirty_data or fd in self._dirty_index:
+                self._flush()
+
+    def replace(self, tmp_path: Path, path: Path) -> None:
+        """ Атомарно подменяет path файлом tmp_path: после сбоя на месте
+        будет либо старый файл, либо новый целиком """
+        if self.enabled:
+            self.flush()
+            fsync_path(tmp_path)
+        os.replace(tmp_path, path)
+        if self.enabled:
+            fsync_path(path.parent)
+
+    def sync_path(self, path: Path) -> None:
+        """ Сбрасывает файл, переписанный целиком (и каталог, где он
+        лежит - чтобы пережило переименование) """
+        if self.enabled:
+            self.flush()
+            fsync_path(path)
+            fsync_path(path.parent)
+
+
+class WriteHandles:
+    """ Открытые на запись файлы, чтобы не открывать их на каждую запись """
+
+    def __init__(self, sync: SyncPolicy) -> None:
+        self.sync = sync
+        self._files: dict[Path, object] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: Path, mode: str = "r+b"):
+        f = self._files.get(path)
+        if f is None:
+            with self._lock:
+                f = self._files.get(path)
+                if f is None:
+                    f = self._files[path] = open(path, mode, buffering=0)
+                    if metrics.active:
+                        metrics.record('file_opens')
+        return f
+
+    def close(self, path: Path) -> None:
+        """ Закрывает файл (например, если его подменили) """
+        with self._lock:
+            f = self._files.pop(path, None)
+        if f is not None:
+            self.sync.release(f)
+            f.close()
+
+    def close_all(self) -> None:
+        for path in list(self._files):
+            self.close(path)
@@ -0,0 +1,241 @@
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+import fcntl
+import threading
+
+CONCURRENCY_MODES = ('none', 'thread', 'process')
+
+
+class RWLock:
+    """ Блокировка читатель/писатель внутри процесса.
+
+    Читателей может быть много, писатель - один и без читателей. Ждущий
+    писатель не пропускает новых читателей. Блокировка повторно входима:
+    поток с блокировкой на запись может брать ее на чтение и на запись,
+    поток с блокировкой на чтение - только на чтение.
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    def _depth(self) -> tuple[int, int]:
+        return (
+            getattr(self._local, 'reads', 0),
+            getattr(self._local, 'writes', 0)
+        )
+
+    def acquire_read(self) -> bool:
+        """ Берет блокировку на чтение; True - если это первый вход потока """
+        reads, writes = self._depth()
+        self._local.reads = reads + 1
+        if reads or writes:
+            return False
+        with self._cond:
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        return True
+
+    def release_read(self) -> None:
+        reads, writes = self._depth()
+        self._local.reads = reads - 1
+        if reads > 1 or writes:
+            return
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self) -> bool:
+        """ Берет блокировку на запись; True - если это первый вход потока """
+        reads, writes = self._depth()
+        if reads and not writes:
+            raise RuntimeError('Нельзя повысить блокировку чтения до записи')
+        self._local.writes = writes + 1
+        if writes:
+            return False
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer is not None or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = threading.get_ident()
+        return True
+
+    def can_write(self) -> bool:
+        """ Может ли поток взять блокировку на запись (не держит ее только
+        на чтение) """
+        reads, writes = self._depth()
+        return bool(writes) or not reads
+
+    def release_write(self) -> None:
+        writes = self._depth()[1]
+        self._local.writes = writes - 1
+        if writes > 1:
+            return
+        with self._cond:
+            self._writer = None
+            self._cond.notify_all()
+
+
+class FileLock:
+    """ Рекомендательная блокировка fcntl.flock между процессами.
+
+    Захватами управляет StoreLock: общая блокировка берется первым
+    читателем процесса и снимается последним, исключительная - на время
+    записи, когда читателей в процессе нет.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        # Файл блокировки открывается при первом захвате
+        self._file = None
+        self._readers = 0
+        self._mutex = threading.Lock()
+
+    def _fileno(self) -> int:
+        with self._mutex:
+            if self._file is None:
+                self._file = open(self.path, "a+")
+            return self._file.fileno()
+
+    def acquire_shared(self) -> None:
+        fileno = self._fileno()
+        with self._mutex:
+            self._readers += 1
+            if self._readers == 1:
+                fcntl.flock(fileno, fcntl.LOCK_SH)
+
+    def release_shared(self) -> None:
+        with self._mutex:
+            self._readers -= 1
+            if not self._readers:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def acquire_exclusive(self) -> None:
+        fcntl.flock(self._fileno(), fcntl.LOCK_EX)
+
+    def release_exclusive(self) -> None:
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        with self._mutex:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class StoreLock:
+    """ Блокировка базы: RWLock в процессе и, если задан, FileLock между
+    процессами """
+
+    def __init__(self, file_lock: FileLock | None = None) -> None:
+        self.rw = RWLock()
+        self.file_lock = file_lock
+
+    @contextmanager
+    def read(self):
+        first = self.rw.acquire_read()
+        try:
+            if first and self.file_lock is not None:
+                self.file_lock.acquire_shared()
+            try:
+                yield
+            finally:
+                if first and self.file_lock is not None:
+                    self.file_lock.release_shared()
+        finally:
+            self.rw.release_read()
+
+    @contextmanager
+    def write(self):
+        first = self.rw.acquire_write()
+        try:
+            if first and self.file_lock is not None:
+                self.file_lock.acquire_exclusive()
+            try:
+                yield
+            finally:
+                if first and self.file_lock is not None:
+                    self.file_lock.release_exclusive()
+        finally:
+            self.rw.release_write()
+
+    def can_write(self) -> bool:
+        return self.rw.can_write()
+
+    def close(self) -> None:
+        if self.file_lock is not None:
+            self.file_lock.close()
+
+
+class NullLock:
+    """ Блокировка для режима без конкурентного доступа """
+
+    file_lock = None
+
+    def read(self):
+        return nullcontext()
+
+    def write(self):
+        return nullcontext()
+
+    def can_write(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+def make_lock(concurrency: str, lock_path: Path):
+    """ Блокировка базы для режима concurrency """
+    if concurrency not in CONCURRENCY_MODES:
+        raise ValueError(f'Неизвестный режим конкурентности: {concurrency}')
+    if concurrency == 'none':
+        return NullLock()
+    if concurrency == 'thread':
+        return StoreLock()
+    return StoreLock(FileLock(lock_path))
+
+
+# Декораторы методов CarService
+def reading(*checks):
+    """ Выполняет метод под блокировкой на чтение.
+
+    checks - имена проверок вторичных данных, которые нужны методу:
+    @reading('status_index') (см. CarService.stale). Читатели файлы не
+    пишут, поэтому если данные устарели, они строятся заново, и метод
+    выполняется под блокировкой на запись.
+    """
+    if len(checks) == 1 and callable(checks[0]):
+        return reading()(checks[0])
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.lock.can_write():
+                # Вложенный вызов: проверки уже сделал внешний метод
+                with self.lock.read():
+                    return method(self, *args, **kwargs)
+            with self.lock.read():
+                if not self.stale(checks):
+                    return method(self, *args, **kwargs)
+            with self.lock.write():
+                self.maintain(checks)
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def writing(method):
+    """ Выполняет метод под блокировкой на запись """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock.write():
+            return method(self, *args, **kwargs)
+    return wrapper
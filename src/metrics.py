@@ -0,0 +1,95 @@
+from functools import wraps
+import threading
+import time
+
+COUNTERS = (
+    'calls', 'wall_time', 'file_opens', 'index_loads',
+    'bytes_read', 'bytes_written', 'records_decoded', 'fsyncs'
+)
+
+# Число включенных Metrics; пока 0, места ввода-вывода ничего не считают
+active = 0
+_active_lock = threading.Lock()
+# Стек вызовов публичных методов в текущем потоке
+_local = threading.local()
+
+
+def record(counter: str, amount: int = 1) -> None:
+    """ Добавляет событие ко всем выполняющимся в потоке публичным методам.
+
+    Вызывается из мест ввода-вывода под проверкой `if metrics.active`.
+    """
+    frames = getattr(_local, 'frames', None)
+    if frames:
+        for frame in frames:
+            frame[counter] += amount
+
+
+class Metrics:
+    """ Счетчики публичных методов CarService.
+
+    Для каждого метода считаются вызовы, время, открытия файлов, загрузки
+    индексов с диска, прочитанные и записанные байты, разобранные записи
+    и сбросы на диск (fsyncs). Счетчики метода включают вложенные вызовы
+    (sell_car включает find_car). Работа в пуле процессов parallel_scan
+    не учитывается.
+
+    hook(имя метода, счетчики вызова) вызывается после каждого вызова.
+    """
+
+    def __init__(self, hook=None) -> None:
+        self.hook = hook
+        self._totals: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._enabled = False
+
+    def enable(self) -> None:
+        global active
+        with _active_lock:
+            if not self._enabled:
+                self._enabled = True
+                active += 1
+
+    def disable(self) -> None:
+        global active
+        with _active_lock:
+            if self._enabled:
+                self._enabled = False
+                active -= 1
+
+    def wrap(self, name: str, method):
+        """ Метод, который считает свои вызовы в этих счетчиках """
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            frames = getattr(_local, 'frames', None)
+            if frames is None:
+                frames = _local.frames = []
+            frame = dict.fromkeys(COUNTERS, 0)
+            frames.append(frame)
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                frame['wall_time'] = time.perf_counter() - started
+                frame['calls'] = 1
+                frames.pop()
+                self._add(name, frame)
+
+        return wrapper
+
+    def _add(self, name: str, frame: dict) -> None:
+        with self._lock:
+            totals = self._totals.setdefault(name, dict.fromkeys(COUNTERS, 0))
+            for counter, amount in frame.items():
+                totals[counter] += amount
+        if self.hook is not None:
+            self.hook(name, frame)
+
+    def snapshot(self) -> dict[str, dict]:
+        """ Копия счетчиков: имя метода -> счетчики """
+        with self._lock:
+            return {name: dict(totals) for name, totals in self._totals.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._totals = {}
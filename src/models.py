@@ -57,3 +57,21 @@ class ModelSaleStats(BaseModel):
     car_model_name: str
     brand: str
     sales_number: int
+
+
+class InventoryReport(BaseModel):
+    group: str
+    cars_number: int
+    total_price: Decimal
+    min_price: Decimal
+    max_price: Decimal
+    average_price: Decimal
+
+
+class SalesReport(BaseModel):
+    group: str
+    sales_number: int
+    revenue: Decimal
+    average_cost: Decimal
+    average_discount: Decimal
+    discount_rate: Decimal
@@ -0,0 +1,135 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+import multiprocessing
+import os
+
+from pydantic import BaseModel
+
+from record_file import RecordFile
+
+# Строк в одной части файла, которую разбирает один процесс
+CHUNK_SIZE = 20000
+# Процессы пула не форкаются от процесса сервиса: у него работают потоки
+# (пул потоков, асинхронный сервис, сброс group-commit), и копия чужой
+# захваченной блокировки в дочернем процессе повесила бы его
+START_METHOD = (
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+    else 'spawn'
+)
+
+
+def filter_rows(records: RecordFile, lines, where: dict, validation: str):
+    """ Отдает пары (номер строки, объект) для строк lines, у которых поля
+    равны значениям из where """
+    codec = records.codec
+    checks = [codec.prefilter(field, value) for field, value in where.items()]
+    checks = [check for check in checks if check is not None]
+    for line_number in lines:
+        raw = records.read_raw(line_number)
+        # Быстрая проверка по байтам, потом по собранному объекту
+        if not all(check(raw) for check in checks):
+            continue
+        obj = records.decode(raw, validation)
+        if all(getattr(obj, field) == value for field, value in where.items()):
+            yield line_number, obj
+
+
+def extract_keys(records: RecordFile, lines, field: str):
+    """ Отдает пары [значение поля field, номер строки], пустые строки
+    (удаленные записи) пропускает """
+    codec = records.codec
+    for line_number in lines:
+        raw = records.read_raw(line_number)
+        if not codec.is_blank(raw):
+            yield [codec.to_dict(raw)[field], line_number]
+
+
+def scan_keys_chunk(
+    path: Path, model_cls: type[BaseModel], lines, field: str
+) -> list[list]:
+    """ Собирает ключи части файла в процессе пула """
+    records = RecordFile(path, model_cls)
+    try:
+        return list(extract_keys(records, lines, field))
+    finally:
+        records.close()
+
+
+def scan_chunk(
+    path: Path,
+    model_cls: type[BaseModel],
+    lines,
+    where: dict,
+    validation: str
+) -> list[tuple[int, BaseModel]]:
+    """ Разбирает часть файла в процессе пула """
+    records = RecordFile(path, model_cls)
+    try:
+        return list(filter_rows(records, lines, where, validation))
+    finally:
+        records.close()
+
+
+class ParallelScanner:
+    """ Полный обход файла с данными в пуле процессов.
+
+    Строки фиксированной ширины, поэтому файл легко делится на части по
+    номерам строк. Части разбираются и фильтруются в workers процессах,
+    результаты склеиваются в исходном порядке строк. Пул создается при
+    первом обходе.
+    """
+
+    def __init__(
+        self, workers: int | None = None, chunk_size: int = CHUNK_SIZE
+    ) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self._pool: ProcessPoolExecutor | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 1
+
+    def scan(
+        self,
+        path: Path,
+        model_cls: type[BaseModel],
+        lines,
+        where: dict | None = None,
+        validation: str = 'strict'
+    ) -> list[tuple[int, BaseModel]]:
+        """ Пары (номер строки, объект) по возрастанию номеров строк """
+        return self._map(
+            scan_chunk, path, model_cls, lines, where or {}, validation
+        )
+
+    def scan_keys(
+        self, path: Path, model_cls: type[BaseModel], lines, field: str
+    ) -> list[list]:
+        """ Пары [значение поля field, номер строки] для непустых строк """
+        return self._map(scan_keys_chunk, path, model_cls, lines, field)
+
+    def _map(self, worker, path: Path, model_cls, lines, *args) -> list:
+        """ Делит lines на части, обрабатывает их worker в пуле и склеивает
+        результаты в исходном порядке """
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context(START_METHOD)
+            )
+        # Частей не меньше, чем процессов
+        size = max(min(self.chunk_size, -(-len(lines) // self.workers)), 1)
+        chunks = [
+            lines[start:start + size] for start in range(0, len(lines), size)
+        ]
+        results = self._pool.map(
+            worker, repeat(path), repeat(model_cls), chunks,
+            *(repeat(arg) for arg in args)
+        )
+        return [item for chunk in results for item in chunk]
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
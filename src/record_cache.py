@@ -0,0 +1,78 @@
+from collections import OrderedDict
+import threading
+
+from pydantic import BaseModel
+
+# Записей в кеше одной таблицы по умолчанию
+CACHE_SIZE = 10000
+
+
+class RecordCache:
+    """ LRU-кеш разобранных записей одной таблицы: ключ -> объект.
+
+    Кеш хранит копии объектов и отдает копии, поэтому изменения
+    полученного объекта в кеш не попадают. Свои записи сервис обновляет
+    в кеше сам (put, pop); изменения из других процессов и объектов
+    видны по поколениям индексов таблицы (см. check) - тогда кеш
+    очищается целиком. maxsize = 0 выключает кеш.
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # Поколения индексов, при которых заполнялся кеш
+        self.generation = None
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, generation) -> None:
+        """ Очищает кеш, если индексы таблицы перечитаны с диска """
+        if generation != self.generation:
+            with self._lock:
+                self._items.clear()
+                self.generation = generation
+
+    def get(self, key) -> BaseModel | None:
+        if not self.maxsize:
+            return None
+        with self._lock:
+            obj = self._items.get(key)
+            if obj is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+        return obj.model_copy()
+
+    def put(self, key, obj: BaseModel) -> None:
+        if not self.maxsize:
+            return
+        obj = obj.model_copy()
+        with self._lock:
+            self._items[key] = obj
+            self._items.move_to_end(key)
+            if len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def update(self, key, obj: BaseModel) -> None:
+        """ Заменяет объект, только если ключ уже есть в кеше """
+        if key in self._items:
+            self.put(key, obj)
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        """ Попадания, промахи, число записей и предел кеша """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._items),
+            'maxsize': self.maxsize,
+        }
@@ -0,0 +1,255 @@
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+import json
+import struct
+
+from pydantic import BaseModel
+
+from decoders import DECODERS, construct_trusted
+from models import Car, CarStatus, Model, Sale
+
+DATA_FORMATS = ('json', 'binary')
+
+# Заголовок двоичного файла с данными (64 байта):
+# MAGIC, версия формата, имя таблицы, размер записи
+MAGIC = b'BIBIPDAT'
+VERSION = 1
+HEADER = struct.Struct('>8sB8sH')
+HEADER_SIZE = 64
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+# Смещение часового пояса для datetime без tzinfo
+NAIVE = -2 ** 31
+STATUSES = tuple(CarStatus)
+
+
+class JsonCodec:
+    """ Старый формат: 500 символов JSON и перевод строки, без заголовка """
+
+    name = 'json'
+    header_size = 0
+    record_size = 500
+    slot_size = 501
+
+    def __init__(self, model_cls: type[BaseModel]) -> None:
+        self.model_cls = model_cls
+
+    def header(self) -> bytes:
+        return b''
+
+    def encode(self, obj: BaseModel) -> bytes:
+        raw = obj.model_dump_json().encode()
+        if len(raw) > self.record_size:
+            raise ValueError(f'Запись длиннее {self.record_size} байт: {raw!r}')
+        return raw.ljust(self.record_size) + b'\n'
+
+    def raw(self, slot: bytes) -> bytes:
+        """ Значимые байты записи из слота """
+        return slot[:self.record_size].rstrip()
+
+    def blank(self) -> bytes:
+        """ Пустой слот (строка удаленной записи) """
+        return b' ' * self.record_size + b'\n'
+
+    def is_blank(self, raw: bytes) -> bool:
+        return not raw
+
+    def to_dict(self, raw: bytes) -> dict:
+        return json.loads(raw)
+
+    def decode(self, raw: bytes, validation: str) -> BaseModel:
+        return DECODERS[validation](self.model_cls, raw)
+
+    def prefilter(self, field: str, value):
+        """ Быстрая проверка поля по байтам записи (может давать ложные
+        срабатывания, окончательно поле проверяется после разбора) """
+        marker = f'"{field}":{json.dumps(value)}'.encode()
+        # За значением идет следующее поле или конец объекта
+        inner, last = marker + b',', marker + b'}'
+        return lambda raw: inner in raw or raw.endswith(last)
+
+
+# Упаковка полей двоичного формата
+def pack_str(value: str, width: int) -> bytes:
+    raw = value.encode('utf-8')
+    if len(raw) > width or raw.endswith(b'\0'):
+        raise ValueError(f'Строка не помещается в {width} байт: {value!r}')
+    return raw
+
+
+def unpack_str(raw: bytes) -> str:
+    return raw.rstrip(b'\0').decode('utf-8')
+
+
+def pack_decimal(value: Decimal) -> tuple[int, int]:
+    """ Decimal как целое и десятичный порядок, без потери точности """
+    exponent = value.as_tuple().exponent
+    if not isinstance(exponent, int):
+        raise ValueError(f'Нельзя упаковать число {value}')
+    return int(value.scaleb(-exponent)), exponent
+
+
+def unpack_decimal(coefficient: int, exponent: int) -> Decimal:
+    return Decimal(coefficient).scaleb(exponent)
+
+
+def pack_datetime(value: datetime) -> tuple[int, int]:
+    """ Микросекунды от эпохи и смещение часового пояса в секундах """
+    offset = value.utcoffset()
+    local = value.replace(tzinfo=None)
+    micros = (local - EPOCH) // MICROSECOND
+    if offset is None:
+        return micros, NAIVE
+    return micros, int(offset.total_seconds())
+
+
+def unpack_datetime(micros: int, offset: int) -> datetime:
+    value = EPOCH + timedelta(microseconds=micros)
+    if offset == NAIVE:
+        return value
+    return value.replace(tzinfo=timezone(timedelta(seconds=offset)))
+
+
+class BinaryCodec(ABC):
+    """ Компактный формат: заголовок и записи struct фиксированной ширины """
+
+    name = 'binary'
+    header_size = HEADER_SIZE
+    table = b''
+    record = struct.Struct('')
+
+    def __init__(self, model_cls: type[BaseModel]) -> None:
+        self.model_cls = model_cls
+        self.record_size = self.record.size
+        self.slot_size = self.record.size
+
+    def header(self) -> bytes:
+        header = HEADER.pack(MAGIC, VERSION, self.table, self.record_size)
+        return header.ljust(HEADER_SIZE, b'\0')
+
+    @abstractmethod
+    def pack(self, obj: BaseModel) -> tuple:
+        """ Значения полей записи в порядке record """
+
+    @abstractmethod
+    def to_dict(self, raw: bytes) -> dict:
+        """ Словарь полей из байт записи """
+
+    def encode(self, obj: BaseModel) -> bytes:
+        return self.record.pack(*self.pack(obj))
+
+    def raw(self, slot: bytes) -> bytes:
+        return slot
+
+    def blank(self) -> bytes:
+        return bytes(self.record_size)
+
+    def is_blank(self, raw: bytes) -> bool:
+        return not raw.strip(b'\0')
+
+    def decode(self, raw: bytes, validation: str) -> BaseModel:
+        fields = self.to_dict(raw)
+        if validation == 'strict':
+            return self.model_cls(**fields)
+        # Поля уже нужных типов, проверка не нужна
+        return construct_trusted(self.model_cls, fields)
+
+    def prefilter(self, field: str, value):
+        return None
+
+
+class CarCodec(BinaryCodec):
+    # vin, модель, цена (целое, порядок), дата (мкс, смещение), статус.
+    # id модели той же ширины, что и в ModelCodec
+    table = b'cars'
+    record = struct.Struct('>17sqqbqiB')
+
+    def pack(self, car: Car) -> tuple:
+        return (
+            pack_str(car.vin, 17), car.model,
+            *pack_decimal(car.price), *pack_datetime(car.date_start),
+            STATUSES.index(car.status)
+        )
+
+    def to_dict(self, raw: bytes) -> dict:
+        vin, model, coefficient, exponent, micros, offset, status = (
+            self.record.unpack(raw)
+        )
+        return {
+            'vin': unpack_str(vin),
+            'model': model,
+            'price': unpack_decimal(coefficient, exponent),
+            'date_start': unpack_datetime(micros, offset),
+            'status': STATUSES[status],
+        }
+
+    def prefilter(self, field: str, value):
+        if field != 'model':
+            return None
+        return lambda raw: struct.unpack_from('>q', raw, 17)[0] == value
+
+
+class ModelCodec(BinaryCodec):
+    # id, название, марка
+    table = b'models'
+    record = struct.Struct('>q64s64s')
+
+    def pack(self, model: Model) -> tuple:
+        return model.id, pack_str(model.name, 64), pack_str(model.brand, 64)
+
+    def to_dict(self, raw: bytes) -> dict:
+        id, name, brand = self.record.unpack(raw)
+        return {'id': id, 'name': unpack_str(name), 'brand': unpack_str(brand)}
+
+
+class SaleCodec(BinaryCodec):
+    # номер продажи, vin, дата (мкс, смещение), сумма (целое, порядок)
+    table = b'sales'
+    record = struct.Struct('>48s17sqiqb')
+
+    def pack(self, sale: Sale) -> tuple:
+        return (
+            pack_str(sale.sales_number, 48), pack_str(sale.car_vin, 17),
+            *pack_datetime(sale.sales_date), *pack_decimal(sale.cost)
+        )
+
+    def to_dict(self, raw: bytes) -> dict:
+        sales_number, car_vin, micros, offset, coefficient, exponent = (
+            self.record.unpack(raw)
+        )
+        return {
+            'sales_number': unpack_str(sales_number),
+            'car_vin': unpack_str(car_vin),
+            'sales_date': unpack_datetime(micros, offset),
+            'cost': unpack_decimal(coefficient, exponent),
+        }
+
+
+BINARY_CODECS = {Car: CarCodec, Model: ModelCodec, Sale: SaleCodec}
+
+
+def make_codec(model_cls: type[BaseModel], data_format: str):
+    """ Кодек таблицы model_cls в формате data_format """
+    if data_format not in DATA_FORMATS:
+        raise ValueError(f'Неизвестный формат данных: {data_format}')
+    if data_format == 'binary':
+        return BINARY_CODECS[model_cls](model_cls)
+    return JsonCodec(model_cls)
+
+
+def detect_codec(model_cls: type[BaseModel], head: bytes):
+    """ Кодек по первым байтам файла; без заголовка - старый JSON """
+    if not head.startswith(MAGIC):
+        return JsonCodec(model_cls)
+    _, version, table, record_size = HEADER.unpack(head[:HEADER.size])
+    codec = BINARY_CODECS[model_cls](model_cls)
+    if (version, table.rstrip(b'\0'), record_size) != (
+        VERSION, codec.table, codec.record_size
+    ):
+        raise ValueError(
+            f'Файл таблицы {table!r} версии {version} не подходит для '
+            f'{model_cls.__name__}'
+        )
+    return codec
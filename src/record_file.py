@@ -0,0 +1,251 @@
+from pathlib import Path
+import fcntl
+import mmap
+import os
+import threading
+
+from pydantic import BaseModel
+
+import metrics
+from models import Car, Model, Sale
+from record_codecs import HEADER_SIZE, detect_codec, make_codec
+
+DATA_FILES = {'cars.txt': Car, 'models.txt': Model, 'sales.txt': Sale}
+
+
+class RecordFile:
+    """ Чтение записей фиксированной ширины через отображение файла в память.
+
+    Файл открывается и отображается один раз, записи вырезаются из
+    отображения по смещению header_size + line_number * slot_size. Формат
+    (кодек) определяется по заголовку файла. Если запрошенная строка лежит
+    за концом отображения (файл вырос), файл отображается заново.
+
+    Файл открывается при первом чтении. Если задан data_format, файла
+    еще нет или он пуст, файл создается с заголовком этого формата.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        model_cls: type[BaseModel],
+        data_format: str | None = None
+    ) -> None:
+        self.path = path
+        self.model_cls = model_cls
+        self.data_format = data_format
+        self._file = None
+        self._mm: mmap.mmap | None = None
+        self._codec = None
+        # Поколение индекса, при котором файл последний раз проверялся
+        self.generation = 0
+        # Открытие и отображение файла из нескольких потоков по очереди
+        self._mutex = threading.RLock()
+
+    def _open(self) -> None:
+        with self._mutex:
+            if self._file is None:
+                if self.data_format is not None:
+                    init_data_file(self.path, self.model_cls, self.data_format)
+                f = open(self.path, "rb")
+                codec = detect_codec(self.model_cls, f.read(HEADER_SIZE))
+                if metrics.active:
+                    metrics.record('file_opens')
+                # Кодек ставим последним: по нему другие потоки видят,
+                # что файл открыт
+                self._file = f
+                self._codec = codec
+
+    @property
+    def codec(self):
+        """ Кодек записей этого файла """
+        codec = self._codec
+        if codec is None:
+            self._open()
+            codec = self._codec
+        return codec
+
+    def _remap(self, end: int) -> mmap.mmap | None:
+        # Старое отображение не закрываем: его может держать начатый scan
+        with self._mutex:
+            mm = self._mm
+            if mm is not None and len(mm) >= end:
+                return mm
+            self._open()
+            if os.fstat(self._file.fileno()).st_size:
+                mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mm = mm
+            return mm
+
+    def _view(self, end: int) -> mmap.mmap:
+        """ Отображение файла, которое покрывает байты до end """
+        mm = self._mm
+        if mm is None or len(mm) < end:
+            mm = self._remap(end)
+        if mm is None or len(mm) < end:
+            raise IndexError(f'{self.path}: нет строки до смещения {end}')
+        return mm
+
+    def offset(self, line_number: int) -> int:
+        """ Смещение строки в файле """
+        codec = self.codec
+        return codec.header_size + line_number * codec.slot_size
+
+    def read_slot(self, line_number: int) -> bytes:
+        """ Слот записи целиком, как он лежит в файле """
+        codec = self.codec
+        start = codec.header_size + line_number * codec.slot_size
+        mm = self._view(start + codec.slot_size)
+        if metrics.active:
+            metrics.record('bytes_read', codec.slot_size)
+        return mm[start:start + codec.slot_size]
+
+    def read_raw(self, line_number: int) -> bytes:
+        """ Значимые байты записи """
+        codec = self.codec
+        return codec.raw(self.read_slot(line_number))
+
+    def read(self, line_number: int) -> dict:
+        """ Запись по номеру строки в виде словаря полей """
+        codec = self.codec
+        if metrics.active:
+            metrics.record('records_decoded')
+        return codec.to_dict(self.read_raw(line_number))
+
+    def decode(self, raw: bytes, validation: str) -> BaseModel:
+        """ Объект model_cls из значимых байт записи """
+        if metrics.active:
+            metrics.record('records_decoded')
+        return self.codec.decode(raw, validation)
+
+    def __len__(self) -> int:
+        """ Число строк в файле """
+        codec = self.codec
+        size = os.fstat(self._file.fileno()).st_size
+        return max(size - codec.header_size, 0) // codec.slot_size
+
+    def scan(self, start: int = 0):
+        """ Последовательно отдает пары (номер строки, значимые байты) """
+        codec = self.codec
+        count = len(self)
+        if not count:
+            return
+        mm = self._view(self.offset(count))
+        for line_number in range(start, count):
+            offset = codec.header_size + line_number * codec.slot_size
+            if metrics.active:
+                metrics.record('bytes_read', codec.slot_size)
+            yield line_number, codec.raw(mm[offset:offset + codec.slot_size])
+
+    def reopen_if_replaced(self) -> bool:
+        """ Переоткрывает файл, если его подменили (например, при сжатии);
+        возвращает True, если подменили """
+        if self._file is None:
+            return False
+        try:
+            replaced = (
+                os.stat(self.path).st_ino
+                != os.fstat(self._file.fileno()).st_ino
+            )
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            self.close()
+        return replaced
+
+    def close(self) -> None:
+        with self._mutex:
+            self._mm = None
+            self._codec = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def init_data_file(
+    path: Path, model_cls: type[BaseModel], data_format: str
+) -> None:
+    """ Создает файл с данными, если его нет, и пишет заголовок нужного
+    формата в пустой файл """
+    try:
+        if os.stat(path).st_size:
+            return
+    except FileNotFoundError:
+        pass
+    header = make_codec(model_cls, data_format).header()
+    with open(path, "ab") as f:
+        # Другой процесс мог успеть записать заголовок
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        if header and f.seek(0, os.SEEK_END) == 0:
+            f.write(header)
+
+
+# Перевод файла с данными в другой формат
+def migrate_data_file(
+    path: Path, model_cls: type[BaseModel], data_format: str
+) -> int:
+    """ Переписывает все строки файла в формате data_format.
+
+    Номера строк сохраняются, поэтому индексы остаются верными.
+    Возвращает число переписанных строк.
+    """
+    migrated_path, count = write_migrated(path, model_cls, data_format)
+    if migrated_path is not None:
+        os.replace(migrated_path, path)
+    return count
+
+
+def write_migrated(
+    path: Path, model_cls: type[BaseModel], data_format: str
+) -> tuple[Path | None, int]:
+    """ Пишет строки файла в формате data_format в <файл>.migrate рядом.
+
+    Возвращает путь к новому файлу (None, если файл уже в этом формате)
+    и число строк. Пустые строки (удаленные записи) остаются пустыми.
+    """
+    records = RecordFile(path, model_cls)
+    try:
+        target = make_codec(model_cls, data_format)
+        if records.codec.name == target.name:
+            return None, 0
+        codec = records.codec
+        count = len(records)
+        migrated_path = path.with_suffix('.migrate')
+        try:
+            with open(migrated_path, "wb") as f:
+                f.write(target.header())
+                for line_number in range(count):
+                    raw = records.read_raw(line_number)
+                    if codec.is_blank(raw):
+                        f.write(target.blank())
+                    else:
+                        f.write(target.encode(records.decode(raw, 'strict')))
+        except BaseException:
+            migrated_path.unlink(missing_ok=True)
+            raise
+        return migrated_path, count
+    finally:
+        records.close()
+
+
+def migrate_directory(root_directory_path: Path, data_format: str) -> dict:
+    """ Переводит файлы с данными базы bibip в формат data_format.
+
+    Сначала все файлы переписываются рядом, потом подменяют старые: если
+    какой-то файл не удалось перевести, база остается как была.
+    """
+    root = Path(root_directory_path)
+    written = {}
+    try:
+        for name, model_cls in DATA_FILES.items():
+            if (root / name).exists():
+                written[name] = write_migrated(root / name, model_cls, data_format)
+    except BaseException:
+        for migrated_path, _ in written.values():
+            if migrated_path is not None:
+                migrated_path.unlink(missing_ok=True)
+        raise
+    for name, (migrated_path, _) in written.items():
+        if migrated_path is not None:
+            os.replace(migrated_path, root / name)
+    return {name: count for name, (_, count) in written.items()}
@@ -0,0 +1,412 @@
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+import json
+import os
+import zlib
+
+from bibip_car_service import (
+    CarService, inventory_rows, merge_inventory, merge_sales, report_rows
+)
+from durability import SyncPolicy
+from locking import make_lock
+from models import (
+    Car, CarFullInfo, CarStatus, InventoryReport, Model, ModelSaleStats,
+    Sale, SalesReport
+)
+from table_index import TableIndex, top_models
+
+# Файл с описанием раскладки в корне базы
+SHARDS_FILE = 'shards.json'
+DEFAULT_SHARDS = 8
+# Курсор обхода: номер шарда * SHARD_CURSOR + курсор внутри шарда
+SHARD_CURSOR = 2 ** 40
+
+
+def database_path(root_directory_path: str) -> Path:
+    """ Каталог базы, как его понимает CarService """
+    return Path(__file__).resolve().parent.parent / root_directory_path
+
+
+def shard_of(vin: str, shards: int) -> int:
+    """ Номер шарда машины по хешу vin (одинаковый во всех процессах) """
+    return zlib.crc32(vin.encode()) % shards
+
+
+class ShardedCarService:
+    """ База, разложенная по шардам: каталоги shard_00 ... shard_K-1.
+
+    Машина и ее продажи лежат в шарде, который выбирается по хешу vin;
+    каждый шард - обычная база CarService со своими файлами и индексами.
+    Модели (маленький справочник) копируются во все шарды, чтобы шард
+    сам собирал get_car_info. Запросы по vin идут в один шард, обходы -
+    по всем шардам по очереди.
+
+    Если машина сменила vin и новый vin попадает в другой шард, машина
+    остается на месте, а в shard_routes_index.txt записывается, где ее
+    искать. Раскладку по хешу восстанавливает reshard.
+    """
+
+    def __init__(
+        self, root_directory_path: str, shards: int | None = None, **options
+    ) -> None:
+        """ Открывает или создает базу с шардами.
+
+        shards - число шардов новой базы; у существующей базы число шардов
+        берется из shards.json. options передаются в CarService каждого
+        шарда.
+        """
+        root = database_path(root_directory_path)
+        root.mkdir(parents=True, exist_ok=True)
+        layout_path = root / SHARDS_FILE
+        if layout_path.exists():
+            count = json.loads(layout_path.read_text())['shards']
+            if shards is not None and shards != count:
+                raise ValueError(
+                    f'В базе {count} шардов, для смены числа шардов '
+                    f'используйте reshard'
+                )
+        else:
+            cars_path = root / 'cars.txt'
+            if cars_path.exists() and cars_path.stat().st_size:
+                raise ValueError(
+                    f'{root}: база без шардов, переведите ее командой reshard'
+                )
+            count = shards or DEFAULT_SHARDS
+            layout_path.write_text(json.dumps({'shards': count}))
+
+        self.root_directory_path = root
+        self.shards = [
+            CarService(str(root / f'shard_{index:02d}'), **options)
+            for index in range(count)
+        ]
+        # Один пул процессов для обходов всех шардов
+        for shard in self.shards[1:]:
+            shard.scanner = self.shards[0].scanner
+        # vin -> номер шарда для машин, которые лежат не в своем шарде.
+        # Пишется с той же надежностью, что и шарды, и под своей
+        # блокировкой (между процессами - как у шардов, через flock)
+        self.lock = make_lock(
+            options.get('concurrency', 'none'), root / 'bibip.lock'
+        )
+        self.routes_sync = SyncPolicy(
+            options.get('durability', 'none'),
+            options.get('group_commit_ops', 100),
+            options.get('group_commit_ms', 10)
+        )
+        self.routes = TableIndex(
+            root / 'shard_routes_index.txt',
+            options.get('index_format', 'json'),
+            options.get('checkpoint_every', 1000),
+            self.routes_sync
+        )
+
+    # Выбор шарда
+    def shard_number(self, vin: str) -> int:
+        """ Номер шарда, в котором лежит машина с этим vin """
+        with self.lock.read():
+            index = self.routes.get(vin)
+        if index is None:
+            index = shard_of(vin, len(self.shards))
+        return index
+
+    def shard_for(self, vin: str) -> CarService:
+        return self.shards[self.shard_number(vin)]
+
+    def shard_for_sale(self, sales_number: str) -> CarService | None:
+        """ Шард, в котором лежит продажа (номер продажи не содержит шард,
+        поэтому спрашиваем индексы всех шардов) """
+        for shard in self.shards:
+            if sales_number in shard.sales_index:
+                return shard
+        return None
+
+    # Модели - во все шарды
+    def add_model(self, model: Model) -> Model:
+        for shard in self.shards:
+            shard.add_model(model)
+        return model
+
+    def add_models(self, models: list[Model | dict]) -> list[Model]:
+        models = [Model.model_validate(model) for model in models]
+        for shard in self.shards:
+            shard.add_models(models)
+        return models
+
+    def find_model(self, id: int) -> Model | None:
+        return self.shards[0].find_model(id)
+
+    # Запросы по vin - в один шард
+    def add_car(self, car: Car) -> Car:
+        return self.shard_for(car.vin).add_car(car)
+
+    def add_cars(self, cars: list[Car | dict]) -> list[Car]:
+        cars = [Car.model_validate(car) for car in cars]
+        by_shard: dict[int, list[Car]] = {}
+        for car in cars:
+            by_shard.setdefault(self.shard_number(car.vin), []).append(car)
+        for index, shard_cars in by_shard.items():
+            self.shards[index].add_cars(shard_cars)
+        return cars
+
+    def find_car(self, vin: str) -> Car | None:
+        return self.shard_for(vin).find_car(vin)
+
+    def update_status(self, vin: str, new_status: CarStatus) -> Car | None:
+        return self.shard_for(vin).update_status(vin, new_status)
+
+    def get_car_info(self, vin: str) -> CarFullInfo | None:
+        return self.shard_for(vin).get_car_info(vin)
+
+    def get_cars_info(self, vins: list[str]) -> list[CarFullInfo | None]:
+        """ Каждый шард получает одну пачку своих vin """
+        by_shard: dict[int, list[int]] = {}
+        for position, vin in enumerate(vins):
+            by_shard.setdefault(self.shard_number(vin), []).append(position)
+
+        result: list[CarFullInfo | None] = [None] * len(vins)
+        for index, positions in by_shard.items():
+            infos = self.shards[index].get_cars_info(
+                [vins[position] for position in positions]
+            )
+            for position, info in zip(positions, infos):
+                result[position] = info
+        return result
+
+    def sell_car(self, sale: Sale) -> Car | None:
+        """ Продажа пишется в шард машины (номер продажи проверяется на
+        уникальность внутри шарда) """
+        return self.shard_for(sale.car_vin).sell_car(sale)
+
+    def sell_cars(self, sales: list[Sale | dict]) -> list[Car | None]:
+        sales = [Sale.model_validate(sale) for sale in sales]
+        by_shard: dict[int, list[int]] = {}
+        for position, sale in enumerate(sales):
+            index = self.shard_number(sale.car_vin)
+            by_shard.setdefault(index, []).append(position)
+
+        # Результаты возвращаем в порядке входной пачки
+        result: list[Car | None] = [None] * len(sales)
+        for index, positions in by_shard.items():
+            cars = self.shards[index].sell_cars(
+                [sales[position] for position in positions]
+            )
+            for position, car in zip(positions, cars):
+                result[position] = car
+        return result
+
+    def find_sale(self, sales_number: str) -> Sale | None:
+        shard = self.shard_for_sale(sales_number)
+        if shard is None:
+            print('Данные о продаже не найдены')
+            return None
+        return shard.find_sale(sales_number)
+
+    def revert_sale(self, sales_number: str) -> Car | None:
+        shard = self.shard_for_sale(sales_number)
+        if shard is None:
+            print('Данные о продаже не найдены')
+            return None
+        return shard.revert_sale(sales_number)
+
+    def update_vin(self, vin: str, new_vin: str) -> Car | None:
+        """ Меняет vin; машина остается в своем шарде """
+        # Маршруты, потом шард: в этом порядке блокировки берут все
+        with self.lock.write():
+            index = self.shard_number(vin)
+            shard = self.shards[index]
+            with shard.lock.write():
+                car = shard.update_vin(vin, new_vin)
+                if not car:
+                    return None
+                # Маршрут не должен попасть на диск раньше нового vin
+                shard.sync_policy.flush()
+                if shard_of(new_vin, len(self.shards)) != index:
+                    self.routes.put(new_vin, index)
+                if self.routes.get(vin) is not None:
+                    self.routes.delete(vin)
+        return car
+
+    # Обходы - по всем шардам
+    def get_cars(self, status: CarStatus) -> list[Car]:
+        """ Машины с нужным статусом: шарды по порядку, внутри шарда - в
+        порядке добавления """
+        return [car for shard in self.shards for car in shard.get_cars(status)]
+
+    def iter_cars(
+        self,
+        status: CarStatus | None = None,
+        model: int | None = None,
+        limit: int | None = None,
+        cursor: int = 0
+    ):
+        """ Лениво отдает пары (курсор, машина), см. CarService.iter_cars """
+        first, shard_cursor = divmod(cursor, SHARD_CURSOR)
+
+        def matching():
+            for index in range(first, len(self.shards)):
+                start = shard_cursor if index == first else 0
+                for next_cursor, car in self.shards[index].iter_cars(
+                    status, model, None, start
+                ):
+                    yield index * SHARD_CURSOR + next_cursor, car
+
+        return islice(matching(), limit)
+
+    def get_cars_page(
+        self,
+        status: CarStatus | None = None,
+        model: int | None = None,
+        limit: int = 50,
+        cursor: int = 0
+    ) -> tuple[list[Car], int | None]:
+        """ Страница машин и курсор следующей страницы (None - это конец) """
+        page = list(self.iter_cars(status, model, limit + 1, cursor))
+        cars = [car for _, car in page[:limit]]
+        next_cursor = page[limit - 1][0] if len(page) > limit else None
+        return cars, next_cursor
+
+    def top_models_by_sales(
+        self, limit: int = 3
+    ) -> list[ModelSaleStats] | None:
+        """ Складывает счетчики продаж моделей всех шардов """
+        stats: dict[int, tuple] = {}
+        for shard in self.shards:
+            for model, (count, highest) in shard.model_sales_stats().items():
+                total, top_price = stats.get(model, (0, highest))
+                stats[model] = (total + count, max(top_price, highest))
+
+        top_models_data = []
+        for model_id, sales_number in top_models(stats, limit):
+            model = self.find_model(model_id)
+            if not model:
+                return None
+            top_models_data.append(ModelSaleStats(
+                car_model_name=model.name,
+                brand=model.brand,
+                sales_number=sales_number
+            ))
+        return top_models_data
+
+    def sales_report(
+        self,
+        group_by: str = 'month',
+        date_from: datetime | None = None,
+        date_to: datetime | None = None
+    ) -> list[SalesReport]:
+        """ Складывает суммы продаж всех шардов """
+        totals: dict[str, list] = {}
+        for shard in self.shards:
+            shard_totals = shard.sales_totals(group_by, date_from, date_to)
+            for group, values in shard_totals.items():
+                merge_sales(totals, group, values)
+        return report_rows(totals)
+
+    def inventory_report(self, group_by: str = 'status') -> list[InventoryReport]:
+        """ Складывает суммы машин всех шардов """
+        totals: dict[str, list] = {}
+        for shard in self.shards:
+            for group, values in shard.inventory_totals(group_by).items():
+                merge_inventory(totals, group, values)
+        return inventory_rows(totals)
+
+    # Обслуживание
+    def compact_sales(self) -> int:
+        return sum(shard.compact_sales() for shard in self.shards)
+
+    def checkpoint(self) -> None:
+        for shard in self.shards:
+            shard.checkpoint()
+        with self.lock.write():
+            self.routes.checkpoint()
+
+    def close(self) -> None:
+        for shard in self.shards:
+            shard.close()
+        with self.lock.write():
+            self.routes_sync.flush()
+            self.routes.close()
+        self.lock.close()
+
+    def __enter__(self) -> 'ShardedCarService':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def open_car_service(root_directory_path: str, **options):
+    """ CarService или ShardedCarService - по раскладке каталога базы """
+    if (database_path(root_directory_path) / SHARDS_FILE).exists():
+        return ShardedCarService(root_directory_path, **options)
+    return CarService(root_directory_path, **options)
+
+
+def batches(rows, batch_size: int):
+    """ Делит поток записей на пачки """
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        yield batch
+
+
+# Перевод базы в раскладку с другим числом шардов
+def reshard(
+    root_directory_path: str, shards: int, batch_size: int = 10000
+) -> dict:
+    """ Переписывает базу (с шардами или без) в раскладку из shards шардов.
+
+    Новая база собирается рядом, в каталоге <база>.reshard, затем
+    подменяет старую; старая остается в <база>.bak. Базу на время
+    перевода нужно остановить. Возвращает число перенесенных записей
+    (и пропущенных продаж, у которых не нашлась машина).
+    """
+    source = open_car_service(root_directory_path)
+    root = source.root_directory_path
+    target_root = root.with_name(root.name + '.reshard')
+    backup_root = root.with_name(root.name + '.bak')
+    if target_root.exists() or backup_root.exists():
+        raise FileExistsError(
+            f'Сначала уберите {target_root} и {backup_root}'
+        )
+    stores = (
+        source.shards if isinstance(source, ShardedCarService) else [source]
+    )
+    target = ShardedCarService(str(target_root), shards)
+    counts = {'models': 0, 'cars': 0, 'sales': 0, 'skipped_sales': 0}
+
+    model_lines = sorted(line for _, line in stores[0].models_index.items())
+    for batch in batches(model_lines, batch_size):
+        target.add_models(stores[0].read_rows(stores[0].models_data_path, batch))
+        counts['models'] += len(batch)
+
+    for store in stores:
+        for batch in batches((car for _, car in store.iter_cars()), batch_size):
+            target.add_cars(batch)
+            counts['cars'] += len(batch)
+
+    for store in stores:
+        line_vins = store.sale_vins()
+        sale_lines = sorted(line for _, line in store.sales_index.items())
+        for batch in batches(sale_lines, batch_size):
+            sales = store.read_rows(store.sales_data_path, batch)
+            # Продажа переезжает вместе с машиной под ее текущим vin
+            for line, sale in zip(batch, sales):
+                sale.car_vin = line_vins.get(line, sale.car_vin)
+            for sale, sold in zip(sales, target.sell_cars(sales)):
+                # Продажи машин, которых нет под vin продажи, не переносятся
+                if sold is None:
+                    counts['skipped_sales'] += 1
+                    continue
+                counts['sales'] += 1
+                # sell_cars помечает машину проданной; возвращаем статус,
+                # если в старой базе он был другим
+                car = store.find_car(sale.car_vin)
+                if car.status != CarStatus.sold:
+                    target.update_status(car.vin, car.status)
+
+    target.checkpoint()
+    target.close()
+    source.close()
+    os.replace(root, backup_root)
+    os.replace(target_root, root)
+    return counts
@@ -0,0 +1,135 @@
+from pathlib import Path
+import mmap
+import os
+import struct
+
+# Формат файла:
+#   заголовок (32 байта): MAGIC, версия, тип ключа, ширина ключа, число записей
+#   записи фиксированной ширины, отсортированные по ключу:
+#   ключ (дополненный нулевыми байтами) + номер строки (8 байт)
+MAGIC = b'BIBIPIDX'
+VERSION = 1
+HEADER = struct.Struct('>8sBcHQ')
+HEADER_SIZE = 32
+LINE = struct.Struct('>Q')
+INT_OFFSET = 2 ** 63
+
+
+def is_sorted_index(path: Path) -> bool:
+    """ Проверяет, записан ли файл индекса в сортированном формате """
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except FileNotFoundError:
+        return False
+
+
+def encode_key(key, key_type: bytes) -> bytes:
+    """ Кодирует ключ так, чтобы порядок байт совпадал с порядком ключей """
+    if key_type == b'i':
+        return (key + INT_OFFSET).to_bytes(8, 'big')
+    return key.encode('utf-8')
+
+
+def decode_key(raw: bytes, key_type: bytes):
+    """ Восстанавливает ключ из байтового представления """
+    if key_type == b'i':
+        return int.from_bytes(raw, 'big') - INT_OFFSET
+    return raw.rstrip(b'\0').decode('utf-8')
+
+
+# Запись индекса в сортированном формате
+def write_sorted_index(path: Path, pairs) -> None:
+    """ Записывает пары [ключ, номер строки] в сортированный файл """
+    pairs = list(pairs)
+    is_int = bool(pairs) and all(type(key) is int for key, _ in pairs)
+    key_type = b'i' if is_int else b's'
+    encoded = sorted(
+        (encode_key(key, key_type), line) for key, line in pairs
+    )
+    width = max((len(key) for key, _ in encoded), default=1)
+
+    with open(path, "wb") as f:
+        header = HEADER.pack(MAGIC, VERSION, key_type, width, len(encoded))
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        f.write(b''.join(
+            key.ljust(width, b'\0') + LINE.pack(line)
+            for key, line in encoded
+        ))
+
+
+class SortedIndexReader:
+    """ Поиск по сортированному индексу двоичным поиском через mmap """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        raw = self._file.read(HEADER.size)
+        if len(raw) < HEADER.size:
+            self._file.close()
+            raise ValueError(f'{path}: индекс оборван')
+        magic, version, key_type, width, count = HEADER.unpack(raw)
+        if magic != MAGIC or version != VERSION:
+            self._file.close()
+            raise ValueError(f'{path} не является индексом версии {VERSION}')
+        self.key_type = key_type
+        self.width = width
+        self.count = count
+        self.entry_size = width + LINE.size
+        size = os.fstat(self._file.fileno()).st_size
+        if size < HEADER_SIZE + count * self.entry_size:
+            self._file.close()
+            raise ValueError(f'{path}: индекс оборван')
+        self._mm = None
+        if count:
+            self._mm = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+
+    def __len__(self) -> int:
+        return self.count
+
+    # Ключ записи с номером i
+    def _raw_key(self, i: int) -> bytes:
+        offset = HEADER_SIZE + i * self.entry_size
+        return self._mm[offset:offset + self.width]
+
+    # Номер строки записи с номером i
+    def _line(self, i: int) -> int:
+        offset = HEADER_SIZE + i * self.entry_size + self.width
+        return LINE.unpack(self._mm[offset:offset + LINE.size])[0]
+
+    def get(self, key) -> int | None:
+        """ Номер строки по ключу, O(log n) чтений """
+        if not self.count:
+            return None
+        if (self.key_type == b'i') != (type(key) is int):
+            return None
+        target = encode_key(key, self.key_type)
+        if len(target) > self.width:
+            return None
+        target = target.ljust(self.width, b'\0')
+
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._raw_key(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._raw_key(lo) == target:
+            return self._line(lo)
+        return None
+
+    def items(self) -> list:
+        """ Все пары [ключ, номер строки] в порядке ключей """
+        return [
+            [decode_key(self._raw_key(i), self.key_type), self._line(i)]
+            for i in range(self.count)
+        ]
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+        self._file.close()
+
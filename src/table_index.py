@@ -0,0 +1,765 @@
+from abc import ABC, abstractmethod
+from decimal import Decimal
+from pathlib import Path
+import heapq
+import json
+import os
+import sys
+import threading
+
+from durability import SyncPolicy, temp_path
+import metrics
+from sorted_index import SortedIndexReader, is_sorted_index, write_sorted_index
+
+INDEX_FORMATS = ('json', 'sorted')
+# Журнал сливается с базой, когда в нем накопится 1/CHECKPOINT_RATIO от
+# числа записей индекса: переписывание базы в среднем стоит O(1) на запись
+CHECKPOINT_RATIO = 4
+
+
+class JournaledIndex(ABC):
+    """ Индекс, который хранится в памяти и на диске.
+
+    На диске индекс состоит из базового файла и журнала изменений рядом
+    с ним. Изменения дописываются в журнал, а когда в нем накопится не
+    меньше checkpoint_every операций и не меньше 1/CHECKPOINT_RATIO от
+    числа записей индекса, журнал сливается с базовым файлом. Файлы
+    перечитываются, только если изменились на диске.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        checkpoint_every: int = 1000,
+        sync: SyncPolicy | None = None
+    ) -> None:
+        self.path = path
+        self.journal_path = path.with_suffix('.journal')
+        self.checkpoint_every = checkpoint_every
+        # Когда записи журнала сбрасываются на диск (см. durability.py)
+        self.sync = sync or SyncPolicy()
+        # Журнал открыт на чтение и дозапись все время работы
+        self._journal_file = None
+        self._journal_ino: int | None = None
+        # Базовый файл был испорчен или потерян и восстановлен в памяти,
+        # его нужно переписать (см. save_recovered)
+        self._recovered = False
+        # Отпечаток загруженной базы: () - база еще не загружена, None -
+        # файла нет
+        self._stamp: tuple | None = ()
+        self._journal_stamp: tuple | None = None
+        self._journal_offset = 0
+        self._journal_ops = 0
+        # Счетчик загрузок с диска (поколение индекса в памяти)
+        self.generation = 0
+        # Перечитывание и запись индекса из нескольких потоков по очереди
+        self._mutex = threading.RLock()
+
+    # Отпечаток файла на диске
+    def _file_stamp(self, path: Path) -> tuple | None:
+        """ Возвращает (inode, mtime, размер) файла """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    @abstractmethod
+    def _load_base(self) -> None:
+        """ Читает базовый файл в память """
+
+    @abstractmethod
+    def _apply(self, op: list) -> None:
+        """ Применяет одну запись журнала к индексу в памяти """
+
+    @abstractmethod
+    def _snapshot(self):
+        """ Состояние индекса с учетом журнала """
+
+    @abstractmethod
+    def _dump(self, state, path: Path) -> None:
+        """ Записывает состояние в файл path """
+
+    @abstractmethod
+    def _install(self, state) -> None:
+        """ Делает записанное состояние базой индекса в памяти """
+
+    @abstractmethod
+    def _entries(self) -> int:
+        """ Число записей индекса в памяти (от него зависит, как часто
+        журнал сливается с базой) """
+
+    def _reset_journal(self) -> None:
+        self._journal_stamp = None
+        self._journal_offset = 0
+        self._journal_ops = 0
+
+    # Открытый журнал
+    def _journal(self):
+        """ Файл журнала, открытый без буфера на чтение и дозапись.
+
+        Открывается один раз; если журнал подменили на диске (другой
+        inode), открывается заново.
+        """
+        stamp = self._journal_stamp
+        if (
+            self._journal_file is not None
+            and stamp is not None
+            and stamp[0] == self._journal_ino
+        ):
+            return self._journal_file
+        self._close_journal()
+        self._journal_file = open(self.journal_path, "a+b", buffering=0)
+        self._journal_ino = os.fstat(self._journal_file.fileno()).st_ino
+        if metrics.active:
+            metrics.record('file_opens')
+        return self._journal_file
+
+    def _close_journal(self) -> None:
+        if self._journal_file is not None:
+            self.sync.release(self._journal_file)
+            self._journal_file.close()
+            self._journal_file = None
+            self._journal_ino = None
+
+    # Проигрывание журнала с последней прочитанной позиции
+    def _replay_journal(self, size: int) -> None:
+        f = self._journal()
+        tail = os.pread(f.fileno(), size - self._journal_offset, self._journal_offset)
+        if metrics.active:
+            metrics.record('bytes_read', len(tail))
+        # Недописанную последнюю строку пропускаем
+        complete = tail[:tail.rfind(b'\n') + 1]
+        for raw in complete.splitlines():
+            self._apply(json.loads(raw))
+            self._journal_ops += 1
+        self._journal_offset += len(complete)
+
+    def _refresh(self) -> None:
+        """ Перечитывает файлы, только если они изменились на диске """
+        with self._mutex:
+            stamp = self._file_stamp(self.path)
+            if stamp != self._stamp:
+                if metrics.active:
+                    metrics.record('index_loads')
+                    metrics.record('file_opens')
+                    metrics.record('bytes_read', stamp[2] if stamp else 0)
+                self._load_base()
+                self._reset_journal()
+                self._stamp = stamp
+                self.generation += 1
+            journal_stamp = self._file_stamp(self.journal_path)
+            if journal_stamp != self._journal_stamp:
+                size = journal_stamp[2] if journal_stamp else 0
+                if size < self._journal_offset:
+                    self._load_base()
+                    self._reset_journal()
+                self._journal_stamp = journal_stamp
+                if journal_stamp is not None:
+                    self._replay_journal(size)
+                self.generation += 1
+
+    def refresh(self) -> int:
+        """ Подхватывает изменения с диска, возвращает поколение индекса """
+        self._refresh()
+        return self.generation
+
+    @property
+    def recovered(self) -> bool:
+        """ Индекс восстановлен в памяти, но еще не записан на диск """
+        return self._recovered
+
+    def save_recovered(self) -> None:
+        """ Записывает на диск индекс, восстановленный по данным (под
+        блокировкой на запись: читатели файлов не пишут) """
+        with self._mutex:
+            self._refresh()
+            if self._recovered:
+                self._write_base(self._snapshot())
+
+    # Дописывает записи в журнал
+    def _append(self, ops: list) -> None:
+        """ Дописывает операции в журнал и применяет их в памяти """
+        with self._mutex:
+            self._refresh()
+            # Журнал пишется поверх базы, поэтому сначала сохраняем
+            # восстановленную базу
+            if self._recovered:
+                self._write_base(self._snapshot())
+            data = ''.join(json.dumps(op) + '\n' for op in ops).encode()
+            f = self._journal()
+            f.write(data)
+            self.sync.written(f)
+            if metrics.active:
+                metrics.record('bytes_written', len(data))
+            for op in ops:
+                self._apply(op)
+            self._journal_ops += len(ops)
+            self._journal_offset += len(data)
+            self._journal_stamp = self._file_stamp(self.journal_path)
+            if self._checkpoint_due():
+                self.checkpoint()
+
+    def _checkpoint_due(self) -> bool:
+        """ Журнал пора слить с базой: порог растет вместе с базой, иначе
+        каждая запись в большой индекс стоила бы O(размер индекса) """
+        return self._journal_ops >= max(
+            self.checkpoint_every, self._entries() // CHECKPOINT_RATIO
+        )
+
+    # Запись базового файла
+    def _write_base(self, state) -> None:
+        """ Пишет базу во временный файл и подменяет им старую: при сбое
+        на диске остается целый старый или целый новый файл """
+        with self._mutex:
+            tmp_path = temp_path(self.path)
+            try:
+                self._dump(state, tmp_path)
+                self.sync.replace(tmp_path, self.path)
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+            # Журнал очищаем только после того, как база записана; открытый
+            # на дозапись журнал продолжит писать с начала файла
+            self._journal().truncate(0)
+            self.sync.sync_path(self.journal_path)
+            self._install(state)
+            self._reset_journal()
+            self._recovered = False
+            self._stamp = self._file_stamp(self.path)
+            self._journal_stamp = self._file_stamp(self.journal_path)
+            if metrics.active:
+                metrics.record('file_opens')
+                metrics.record('bytes_written', self._stamp[2])
+
+    def checkpoint(self) -> None:
+        """ Сливает журнал с базовым файлом индекса """
+        with self._mutex:
+            self._refresh()
+            if self._journal_ops:
+                self._write_base(self._snapshot())
+
+    def close(self) -> None:
+        """ Закрывает файлы; при следующем обращении они откроются заново """
+        with self._mutex:
+            self._close_journal()
+            self._journal_stamp = None
+            self._stamp = ()
+
+
+class TableIndex(JournaledIndex):
+    """ Индекс таблицы: ключ -> номер строки.
+
+    Базовый файл - JSON или сортированный формат (см. sorted_index.py).
+    Вставки, переименования и удаления дописываются в журнал.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        index_format: str = 'json',
+        checkpoint_every: int = 1000,
+        sync: SyncPolicy | None = None,
+        recover=None
+    ) -> None:
+        if index_format not in INDEX_FORMATS:
+            raise ValueError(f'Неизвестный формат индекса: {index_format}')
+        super().__init__(path, checkpoint_every, sync)
+        # Функция, которая строит пары [ключ, номер строки] по файлу с
+        # данными, если базовый файл индекса испорчен или потерян
+        self.recover = recover
+        # Формат новых файлов; у непустого файла формат берется с диска
+        self.index_format = index_format
+        # База: словарь или SortedIndexReader; поверх нее изменения журнала
+        self._base: dict | SortedIndexReader = {}
+        self._overlay: dict = {}
+        self._count = 0
+
+    def _close_reader(self) -> None:
+        if isinstance(self._base, SortedIndexReader):
+            self._base.close()
+            self._base = {}
+
+    def _load_base(self) -> None:
+        self._close_reader()
+        try:
+            if is_sorted_index(self.path):
+                # Сортированный индекс не читаем целиком, ищем через mmap
+                self._base = SortedIndexReader(self.path)
+                self.index_format = 'sorted'
+                return
+            with open(self.path, "r") as f:
+                text = f.read()
+            if text.strip():
+                pairs = json.loads(text)
+                self.index_format = 'json'
+            else:
+                pairs = self._recover_lost()
+        except FileNotFoundError:
+            pairs = self._recover_lost()
+        except ValueError:
+            # Файл оборван или испорчен - строим индекс по данным
+            if self.recover is None:
+                raise ValueError(f'{self.path}: файл индекса испорчен')
+            pairs = self.recover()
+            self._recovered = True
+        self._base = {key: line for key, line in pairs}
+
+    def _recover_lost(self) -> list:
+        """ Пары для пустого базового файла.
+
+        Индекс, в который ни разу не писали, - это пустой файл без журнала.
+        Если при этом в файле с данными есть записи, файл индекса потерян:
+        строим его по данным.
+        """
+        if self.recover is None or self.journal_path.exists():
+            return []
+        pairs = self.recover()
+        if pairs:
+            self._recovered = True
+        return pairs
+
+    def _reset_journal(self) -> None:
+        super()._reset_journal()
+        self._overlay = {}
+        self._count = len(self._base)
+
+    def _get(self, key) -> int | None:
+        if key in self._overlay:
+            return self._overlay[key]
+        return self._base.get(key)
+
+    def _apply(self, op: list) -> None:
+        if op[0] == 'put':
+            if self._get(op[1]) is None:
+                self._count += 1
+            self._overlay[op[1]] = op[2]
+        elif op[0] == 'del':
+            if self._get(op[1]) is not None:
+                self._count -= 1
+            self._overlay[op[1]] = None
+
+    def _snapshot(self) -> dict:
+        """ Словарь ключ -> номер строки со всеми записями индекса """
+        if isinstance(self._base, SortedIndexReader):
+            entries = {key: line for key, line in self._base.items()}
+        else:
+            entries = dict(self._base)
+        for key, line in self._overlay.items():
+            if line is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = line
+        return entries
+
+    def _dump(self, entries: dict, path: Path) -> None:
+        pairs = sorted([key, line] for key, line in entries.items())
+        # Отображенный в память старый файл больше не нужен
+        self._close_reader()
+        if self.index_format == 'sorted':
+            write_sorted_index(path, pairs)
+        else:
+            with open(path, "w") as f:
+                json.dump(pairs, f)
+
+    def _install(self, entries: dict) -> None:
+        self._base = entries
+
+    def _entries(self) -> int:
+        return self._count
+
+    def get(self, key) -> int | None:
+        """ Номер строки по ключу """
+        self._refresh()
+        return self._get(key)
+
+    def get_many(self, keys) -> list[int | None]:
+        """ Номера строк по ключам (файлы проверяются один раз) """
+        self._refresh()
+        return [self._get(key) for key in keys]
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        self._refresh()
+        return self._count
+
+    def items(self) -> list:
+        """ Пары [ключ, номер строки], отсортированные по ключу """
+        self._refresh()
+        return sorted([key, line] for key, line in self._snapshot().items())
+
+    def replace(self, pairs: list) -> None:
+        """ Полностью заменяет содержимое индекса """
+        self._refresh()
+        self._write_base({key: line for key, line in pairs})
+
+    def put(self, key, line_number: int) -> None:
+        """ Добавляет пару ключ - номер строки """
+        self._append([['put', key, line_number]])
+
+    def put_many(self, pairs: list) -> None:
+        """ Добавляет пачку пар одной записью в журнал """
+        if pairs:
+            self._append([['put', key, line] for key, line in pairs])
+
+    def rename(self, key, new_key) -> None:
+        """ Меняет ключ записи, номер строки сохраняется """
+        line_number = self.get(key)
+        if line_number is not None:
+            self._append([['del', key], ['put', new_key, line_number]])
+
+    def delete(self, key) -> None:
+        """ Удаляет ключ из индекса """
+        self._append([['del', key]])
+
+    def convert(self, index_format: str) -> int:
+        """ Переписывает индекс в другом формате, возвращает число записей """
+        if index_format not in INDEX_FORMATS:
+            raise ValueError(f'Неизвестный формат индекса: {index_format}')
+        self._refresh()
+        entries = self._snapshot()
+        self.index_format = index_format
+        self._write_base(entries)
+        return len(entries)
+
+    def close(self) -> None:
+        with self._mutex:
+            self._close_reader()
+            super().close()
+
+
+class StatusIndex(JournaledIndex):
+    """ Вторичный индекс: статус машины -> множество номеров строк.
+
+    Базовый файл - JSON {статус: [номера строк]}, в журнал пишутся
+    записи ["set", номер строки, статус].
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        checkpoint_every: int = 1000,
+        sync: SyncPolicy | None = None
+    ) -> None:
+        super().__init__(path, checkpoint_every, sync)
+        self._line_status: dict[int, str] = {}
+        self._lines: dict[str, set[int]] = {}
+
+    def _load_base(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                by_status = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            by_status = {}
+        self._install({
+            line: status
+            for status, lines in by_status.items() for line in lines
+        })
+
+    def _apply(self, op: list) -> None:
+        _, line, status = op
+        old_status = self._line_status.get(line)
+        if old_status is not None:
+            self._lines[old_status].discard(line)
+        self._line_status[line] = status
+        self._lines.setdefault(status, set()).add(line)
+
+    def _snapshot(self) -> dict:
+        return dict(self._line_status)
+
+    def _dump(self, line_status: dict, path: Path) -> None:
+        by_status: dict[str, list[int]] = {}
+        for line, status in sorted(line_status.items()):
+            by_status.setdefault(status, []).append(line)
+        with open(path, "w") as f:
+            json.dump(by_status, f)
+
+    def _install(self, line_status: dict) -> None:
+        self._line_status = dict(line_status)
+        self._lines = {}
+        for line, status in self._line_status.items():
+            self._lines.setdefault(status, set()).add(line)
+
+    def _entries(self) -> int:
+        return len(self._line_status)
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._line_status)
+
+    def count(self, status: str) -> int:
+        """ Число строк с этим статусом """
+        self._refresh()
+        return len(self._lines.get(status, ()))
+
+    def lines(self, status: str) -> list[int]:
+        """ Номера строк с этим статусом по возрастанию """
+        self._refresh()
+        return sorted(self._lines.get(status, ()))
+
+    def set_many(self, pairs: list) -> None:
+        """ Записывает пары (номер строки, статус), если статус изменился """
+        self._refresh()
+        ops = [
+            ['set', line, str(status)] for line, status in pairs
+            if self._line_status.get(line) != status
+        ]
+        if ops:
+            self._append(ops)
+
+    def set(self, line_number: int, status: str) -> None:
+        """ Записывает статус строки """
+        self.set_many([(line_number, status)])
+
+    def replace(self, pairs: list) -> None:
+        """ Полностью заменяет содержимое индекса """
+        self._refresh()
+        self._write_base({line: str(status) for line, status in pairs})
+
+
+def top_models(
+    stats: dict[int, tuple], limit: int
+) -> list[tuple[int, int]]:
+    """ Пары (модель, число продаж) для limit самых продаваемых моделей.
+
+    stats - модель -> (число продаж, самая высокая цена проданной машины).
+    При равном числе продаж выше модель с более дорогой машиной.
+    """
+    return [
+        (model, stats[model][0])
+        for model in heapq.nlargest(
+            limit,
+            (model for model, (count, _) in stats.items() if count),
+            key=lambda model: (*stats[model], model)
+        )
+    ]
+
+
+class ModelSalesIndex(JournaledIndex):
+    """ Счетчики проданных машин по моделям.
+
+    Для каждой модели хранится [число продаж, самая высокая цена, число
+    продаж по этой цене] - этого хватает и для числа продаж, и для
+    порядка моделей с равным числом продаж. В журнал пишутся записи
+    ["add" | "remove", модель, цена] и ["max", модель, цена, число].
+
+    Когда отменяется последняя продажа по самой высокой цене, следующая
+    по величине цена неизвестна: цена становится None, пока сервис не
+    пересчитает ее по проданным машинам модели (см. set_max).
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        checkpoint_every: int = 1000,
+        sync: SyncPolicy | None = None
+    ) -> None:
+        super().__init__(path, checkpoint_every, sync)
+        self._stats: dict[int, list] = {}
+        self._total = 0
+
+    def _load_base(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                stats = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            stats = {}
+        self._install({int(model): stat for model, stat in stats.items()})
+
+    @staticmethod
+    def _add(stats: dict, model: int, price: str) -> None:
+        """ Учитывает продажу модели по цене price в счетчиках stats """
+        stat = stats.get(model)
+        if stat is None:
+            stats[model] = [1, price, 1]
+            return
+        stat[0] += 1
+        if stat[1] is None:
+            return
+        if Decimal(price) > Decimal(stat[1]):
+            stat[1], stat[2] = price, 1
+        elif Decimal(price) == Decimal(stat[1]):
+            stat[2] += 1
+
+    def _apply(self, op: list) -> None:
+        action, model, price = op[:3]
+        stat = self._stats.get(model)
+        if action == 'add':
+            self._add(self._stats, model, price)
+            self._total += 1
+        elif action == 'remove':
+            if stat is None:
+                return
+            self._total -= 1
+            stat[0] -= 1
+            if not stat[0]:
+                del self._stats[model]
+            elif stat[1] is not None and Decimal(price) == Decimal(stat[1]):
+                stat[2] -= 1
+                if not stat[2]:
+                    stat[1] = None
+        elif stat is not None:
+            stat[1], stat[2] = price, op[3]
+
+    def _snapshot(self) -> dict:
+        return {model: list(stat) for model, stat in self._stats.items()}
+
+    def _dump(self, stats: dict, path: Path) -> None:
+        with open(path, "w") as f:
+            json.dump(stats, f)
+
+    def _install(self, stats: dict) -> None:
+        self._stats = {model: list(stat) for model, stat in stats.items()}
+        self._total = sum(stat[0] for stat in self._stats.values())
+
+    def _entries(self) -> int:
+        return len(self._stats)
+
+    def __len__(self) -> int:
+        """ Всего проданных машин """
+        self._refresh()
+        return self._total
+
+    def add(self, model: int, price: Decimal) -> None:
+        self._append([['add', model, str(price)]])
+
+    def remove(self, model: int, price: Decimal) -> None:
+        self._append([['remove', model, str(price)]])
+
+    def add_many(self, pairs: list) -> None:
+        """ Добавляет пачку пар (модель, цена) одной записью в журнал """
+        if pairs:
+            self._append([['add', model, str(price)] for model, price in pairs])
+
+    def unknown_max(self) -> list[int]:
+        """ Модели, у которых самую высокую цену нужно пересчитать """
+        self._refresh()
+        return [
+            model for model, stat in self._stats.items() if stat[1] is None
+        ]
+
+    def set_max(self, model: int, prices: list) -> None:
+        """ Пересчитывает самую высокую цену модели по ценам ее проданных
+        машин """
+        if prices:
+            highest = max(prices)
+            self._append([
+                ['max', model, str(highest), prices.count(highest)]
+            ])
+
+    def replace(self, pairs: list) -> None:
+        """ Полностью заменяет счетчики парами (модель, цена) """
+        self._refresh()
+        stats: dict[int, list] = {}
+        for model, price in pairs:
+            self._add(stats, model, str(price))
+        self._write_base(stats)
+
+    def stats(self) -> dict[int, tuple]:
+        """ Модель -> (число продаж, самая высокая цена) """
+        self._refresh()
+        return {
+            model: (count, Decimal(highest) if highest is not None else None)
+            for model, (count, highest, _) in self._stats.items()
+        }
+
+    def top(self, limit: int) -> list[tuple[int, int]]:
+        """ Пары (модель, число продаж) для limit самых продаваемых моделей """
+        return top_models(self.stats(), limit)
+
+
+class FreeSlots(JournaledIndex):
+    """ Список свободных строк файла с данными.
+
+    Базовый файл - JSON-список номеров строк, в журнал пишутся записи
+    ["free" | "take", номер строки].
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        checkpoint_every: int = 1000,
+        sync: SyncPolicy | None = None
+    ) -> None:
+        super().__init__(path, checkpoint_every, sync)
+        self._lines: set[int] = set()
+
+    def _load_base(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                lines = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            lines = []
+        self._install(set(lines))
+
+    def _apply(self, op: list) -> None:
+        if op[0] == 'free':
+            self._lines.add(op[1])
+        else:
+            self._lines.discard(op[1])
+
+    def _snapshot(self) -> set:
+        return set(self._lines)
+
+    def _dump(self, lines: set, path: Path) -> None:
+        with open(path, "w") as f:
+            json.dump(sorted(lines), f)
+
+    def _install(self, lines: set) -> None:
+        self._lines = set(lines)
+
+    def _entries(self) -> int:
+        return len(self._lines)
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._lines)
+
+    def __contains__(self, line_number: int) -> bool:
+        self._refresh()
+        return line_number in self._lines
+
+    def free(self, line_number: int) -> None:
+        """ Помечает строку свободной """
+        self._append([['free', line_number]])
+
+    def take(self, count: int) -> list[int]:
+        """ Забирает до count свободных строк, начиная с меньших """
+        self._refresh()
+        lines = heapq.nsmallest(count, self._lines)
+        if lines:
+            self._append([['take', line] for line in lines])
+        return lines
+
+    def replace(self, lines) -> None:
+        """ Полностью заменяет список свободных строк """
+        self._refresh()
+        self._write_base(set(lines))
+
+
+# Конвертер индексов базы bibip (вместе с журналами)
+def convert_directory(
+    root_directory_path: Path, index_format: str = 'sorted'
+) -> dict:
+    """ Переводит все индексы базы в нужный формат на месте """
+    root = Path(root_directory_path)
+    converted = {}
+    names = (
+        'cars_index.txt', 'models_index.txt',
+        'sales_index.txt', 'sales_vin_index.txt'
+    )
+    for name in names:
+        path = root / name
+        if path.exists() or path.with_suffix('.journal').exists():
+            index = TableIndex(path)
+            converted[name] = index.convert(index_format)
+            index.close()
+    return converted
+
+
+if __name__ == "__main__":
+    for directory in sys.argv[1:]:
+        for name, count in convert_directory(directory).items():
+            print(f'{directory}/{name}: {count} записей')
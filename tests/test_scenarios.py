@@ -1,12 +1,58 @@
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from pathlib import Path
+import asyncio
+import gc
+import json
+import multiprocessing
+import os
+import struct
 
 import pytest
 
+from async_car_service import AsyncCarService
 from bibip_car_service import CarService
+from bibip_cli import main as bibip_cli
+from sharding import ShardedCarService, shard_of
+from sorted_index import is_sorted_index
+from table_index import StatusIndex, TableIndex, convert_directory
 from models import Car, CarFullInfo, CarStatus, Model, ModelSaleStats, Sale
 
 
+def _add_cars_in_process(path: str, prefix: str, count: int) -> None:
+    service = CarService(path, concurrency="process")
+    for i in range(count):
+        service.add_car(Car(
+            vin=f"{prefix}{i:012d}",
+            model=1,
+            price=Decimal("1000"),
+            date_start=datetime(2024, 1, 1),
+            status=CarStatus.available,
+        ))
+
+
+def _moved_vin(vin: str, shards: int) -> str:
+    return next(
+        f"{vin[:3]}M{vin[-10:]}{i:03d}" for i in range(100)
+        if shard_of(f"{vin[:3]}M{vin[-10:]}{i:03d}", shards) != shard_of(vin, shards)
+    )
+
+
+def _rename_in_shards_in_process(path: str, prefix: str, count: int) -> None:
+    service = ShardedCarService(path, concurrency="process", checkpoint_every=1)
+    for i in range(count):
+        service.update_vin(f"{prefix}{i:012d}", _moved_vin(f"{prefix}{i:012d}", 2))
+    service.close()
+
+
+def _count_cars_in_process(path: str, results) -> None:
+    try:
+        results.put(len(CarService(path, concurrency="process").get_cars(CarStatus.available)))
+    except Exception as error:
+        results.put(repr(error))
+
+
 @pytest.fixture
 def car_data():
     return [
@@ -290,3 +336,954 @@ class TestCarServiceScenarios:
             ModelSaleStats(car_model_name="Pathfinder", brand="Nissan", sales_number=1),
         ]
         assert service.top_models_by_sales() == top_3_models
+
+    def test_index_reloaded_after_external_change(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        other = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data[:5], model_data)
+        assert other.find_car(car_data[5].vin) is None
+        generation = other.cars_index.generation
+
+        service.add_car(car_data[5])
+
+        assert other.find_car(car_data[5].vin) == car_data[5]
+        assert other.cars_index.generation > generation
+
+    def test_sorted_index_after_conversion(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data[:-1], model_data)
+
+        assert convert_directory(service.root_directory_path)["cars_index.txt"] == len(car_data) - 1
+        assert is_sorted_index(service.cars_index_path)
+
+        converted = CarService(tmpdir)
+        assert converted.get_car_info("KNAGM4A77D5316538").car_model_name == "Optima"
+        assert converted.find_car("UNKNOWNVIN") is None
+
+        converted.add_car(car_data[-1])
+        converted.update_vin("KNAGM4A77D5316538", "UPDGM4A77D5316538")
+
+        assert is_sorted_index(service.cars_index_path)
+        assert CarService(tmpdir).find_car(car_data[-1].vin) == car_data[-1]
+        assert CarService(tmpdir).find_car("UPDGM4A77D5316538") is not None
+        assert CarService(tmpdir).get_cars(CarStatus.delivery) == [car_data[-1]]
+
+    def test_index_journal_checkpoint(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir, checkpoint_every=5)
+
+        self._fill_initial_data(service, car_data, model_data)
+        service.update_vin("KNAGM4A77D5316538", "UPDGM4A77D5316538")
+
+        assert service.cars_index.journal_path.stat().st_size > 0
+        assert CarService(tmpdir).find_car("UPDGM4A77D5316538") is not None
+
+        service.checkpoint()
+
+        assert service.cars_index.journal_path.stat().st_size == 0
+        reopened = CarService(tmpdir)
+        assert len(reopened.cars_index) == len(car_data)
+        assert reopened.find_car("KNAGM4A77D5316538") is None
+        assert reopened.find_car("UPDGM4A77D5316538") is not None
+
+    def test_checkpoints_grow_with_index(self, tmpdir: str, monkeypatch):
+        index = TableIndex(Path(tmpdir) / "index.txt", checkpoint_every=10)
+        dumps = []
+        dump = index._dump
+        monkeypatch.setattr(index, "_dump", lambda entries, path: dumps.append(len(entries)) or dump(entries, path))
+        for key in range(5000):
+            index.put(f"KEY{key:014d}", key)
+
+        # База переписывается все реже: не раз в 10 записей, а по мере роста,
+        # и на одну запись в среднем приходится O(1) переписанных записей
+        assert len(dumps) < 50
+        assert all(later > 1.2 * earlier for earlier, later in zip(dumps[2:], dumps[3:]))
+        assert sum(dumps) < 5 * 5000
+        assert TableIndex(index.path).get_many(["KEY00000000004999", "KEY00000000000000"]) == [4999, 0]
+
+    def test_status_checkpoints_grow_with_index(self, tmpdir: str, monkeypatch):
+        index = StatusIndex(Path(tmpdir) / "status.txt", checkpoint_every=10)
+        dumps = []
+        dump = index._dump
+        monkeypatch.setattr(index, "_dump", lambda state, path: dumps.append(len(state)) or dump(state, path))
+        for line in range(5000):
+            index.set(line, CarStatus.available)
+        for line in range(0, 5000, 2):
+            index.set(line, CarStatus.sold)
+
+        assert len(dumps) < 50
+        assert sum(dumps) < 5 * 7500
+        reopened = StatusIndex(index.path)
+        assert (reopened.count(CarStatus.available), reopened.count(CarStatus.sold)) == (2500, 2500)
+
+    def test_batch_load(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        service.add_models(model_data + model_data[:1])
+        service.add_cars([car.model_dump() for car in car_data] + car_data[:2])
+
+        sales = [
+            Sale(
+                sales_number=f"20240903#{vin}",
+                car_vin=vin,
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("1000"),
+            )
+            for vin in ["KNAGM4A77D5316538", "KNAGH4A48A5414970", "JM1BL1M58C1614725", "UNKNOWNVIN"]
+        ]
+        result = service.sell_cars(sales)
+
+        assert [car.status if car else None for car in result] == [CarStatus.sold] * 3 + [None]
+        assert len(service.cars_index) == len(car_data)
+        assert len(service.models_index) == len(model_data)
+        assert service.get_car_info("JM1BL1M58C1614725").sales_cost == Decimal("1000")
+        assert [stat.sales_number for stat in service.top_models_by_sales()] == [2, 1]
+
+    def test_cli_load(self, tmpdir: str, car_data: list[Car], model_data: list[Model], capsys):
+        models_file = f"{tmpdir}/models.csv"
+        with open(models_file, "w") as f:
+            f.write("id,name,brand\n")
+            f.writelines(f"{model.id},{model.name},{model.brand}\n" for model in model_data)
+        cars_file = f"{tmpdir}/cars.jsonl"
+        with open(cars_file, "w") as f:
+            f.writelines(car.model_dump_json() + "\n" for car in car_data)
+
+        database = f"{tmpdir}/db"
+        bibip_cli(["load", database, "models", models_file])
+        bibip_cli(["load", database, "cars", cars_file, "--batch-size", "4"])
+
+        assert "cars: 11 записей" in capsys.readouterr().out
+        assert CarService(database).get_car_info("KNAGM4A77D5316538").car_model_name == "Optima"
+
+    def test_status_index(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+        service.sell_car(
+            Sale(
+                sales_number="20240903#KNAGH4A48A5414970",
+                car_vin="KNAGH4A48A5414970",
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("2100"),
+            )
+        )
+
+        assert [car.vin for car in service.get_cars(CarStatus.sold)] == ["KNAGH4A48A5414970"]
+        assert service.status_index.lines(CarStatus.reserve) == [1, 4]
+
+        # Индекс статусов пропал - строится заново по cars.txt
+        service.cars_status_index_path.write_text("")
+        service.status_index.journal_path.unlink()
+        reopened = CarService(tmpdir)
+        available_cars = [
+            car for car in car_data
+            if car.status == CarStatus.available and car.vin != "KNAGH4A48A5414970"
+        ]
+        assert reopened.get_cars(CarStatus.available) == available_cars
+        assert [car.vin for car in reopened.get_cars(CarStatus.sold)] == ["KNAGH4A48A5414970"]
+
+    def test_sales_vin_index(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+        sale = Sale(
+            sales_number="20240903#KNAGM4A77D5316538",
+            car_vin="KNAGM4A77D5316538",
+            sales_date=datetime(2024, 9, 3),
+            cost=Decimal("2999.99"),
+        )
+        service.sell_car(sale)
+        assert service.sale_line_by_vin("KNAGM4A77D5316538") == 0
+
+        service.revert_sale(sale.sales_number)
+        assert service.sale_line_by_vin("KNAGM4A77D5316538") is None
+
+        service.sell_car(sale.model_copy(update={"sales_number": "20240904#KNAGM4A77D5316538"}))
+        service.update_vin("KNAGM4A77D5316538", "UPDGM4A77D5316538")
+
+        assert service.get_car_info("UPDGM4A77D5316538").sales_cost == sale.cost
+        assert service.sales_vin_index.get("KNAGM4A77D5316538") is None
+
+        # Пустой индекс строится заново по sales.txt
+        service.sales_vin_index.replace([])
+        assert CarService(tmpdir).sale_line_by_vin("KNAGM4A77D5316538") is not None
+
+        # Отмена старой продажи не трогает индекс более поздней продажи
+        first = sale.model_copy(update={"sales_number": "1#KNAGH4A48A5414970", "car_vin": "KNAGH4A48A5414970"})
+        second = first.model_copy(update={"sales_number": "2#KNAGH4A48A5414970"})
+        service.sell_car(first)
+        service.sell_car(second)
+        service.revert_sale(first.sales_number)
+        assert service.sale_line_by_vin("KNAGH4A48A5414970") == service.sales_index.get(second.sales_number)
+
+        # Продажа машины, которой потом сменили vin, отменяется по новому vin
+        renamed = sale.model_copy(update={"sales_number": "1#JM1BL1TFXD1734246", "car_vin": "JM1BL1TFXD1734246"})
+        service.sell_car(renamed)
+        service.update_vin("JM1BL1TFXD1734246", "UPDBL1TFXD1734246")
+        assert service.revert_sale(renamed.sales_number).vin == "UPDBL1TFXD1734246"
+        assert service.find_sale(renamed.sales_number) is None
+        assert service.sale_line_by_vin("UPDBL1TFXD1734246") is None
+        info = CarService(tmpdir).get_car_info("UPDBL1TFXD1734246")
+        assert (info.status, info.sales_cost) == (CarStatus.available, None)
+
+    def test_top_models_by_sales_counters(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+        sales = [
+            Sale(
+                sales_number=f"20240903#{vin}",
+                car_vin=vin,
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("1000"),
+            )
+            for vin in ["KNAGM4A77D5316538", "JM1BL1TFXD1734246", "JM1BL1M58C1614725", "5N1CR2MN9EC641864"]
+        ]
+        for sale in sales:
+            service.sell_car(sale)
+
+        assert [stat.car_model_name for stat in service.top_models_by_sales(limit=2)] == ["3", "Pathfinder"]
+
+        service.revert_sale(sales[1].sales_number)
+        top_models = service.top_models_by_sales(limit=10)
+        assert [(stat.car_model_name, stat.sales_number) for stat in top_models] == [
+            ("Pathfinder", 1),
+            ("3", 1),
+            ("Optima", 1),
+        ]
+
+        # Пропавшие счетчики пересчитываются по проданным машинам
+        service.model_sales_path.write_text("")
+        service.model_sales.journal_path.unlink()
+        assert CarService(tmpdir).top_models_by_sales(limit=10) == top_models
+
+    def test_top_models_max_price_after_revert(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        service.add_car(car_data[3].model_copy(update={"vin": "NEWBL1TFXD1734246", "price": Decimal("2200")}))
+        vins = ["JM1BL1L83C1660152", "JM1BL1TFXD1734246", "NEWBL1TFXD1734246", "KNAGR4A63D5359556", "KNAGH4A48A5414970"]
+        sales = [
+            Sale(sales_number=f"20240903#{vin}", car_vin=vin, sales_date=datetime(2024, 9, 3), cost=Decimal("1000"))
+            for vin in vins
+        ]
+        service.sell_cars(sales)
+        assert [stat.car_model_name for stat in service.top_models_by_sales(limit=2)] == ["3", "Optima"]
+
+        # После отмены продажи по самой высокой цене модели 3 (2635.17)
+        # ее самая высокая цена - 2276.65, ниже, чем у Optima (2376)
+        service.revert_sale(sales[0].sales_number)
+        top = [(stat.car_model_name, stat.sales_number) for stat in service.top_models_by_sales(limit=2)]
+        assert top == [("Optima", 2), ("3", 2)]
+        assert service.model_sales.stats()[3] == (2, Decimal("2276.65"))
+        assert [(stat.car_model_name, stat.sales_number) for stat in CarService(tmpdir).top_models_by_sales(limit=2)] == top
+
+        # На диске по каждой модели только [число продаж, цена, число по цене]
+        service.checkpoint()
+        assert json.loads(service.model_sales_path.read_text()) == {"1": [2, "2376", 1], "3": [2, "2276.65", 1]}
+
+    def test_records_remapped_when_file_grows(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        other = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data[:3], model_data)
+        assert other.find_car(car_data[0].vin) == car_data[0]
+
+        service.add_cars(car_data[3:])
+        service.update_status(car_data[0].vin, CarStatus.reserve)
+
+        assert other.find_car(car_data[-1].vin) == car_data[-1]
+        assert other.find_car(car_data[0].vin).status == CarStatus.reserve
+        assert [raw for _, raw in other.records[other.cars_data_path].scan(9)] == [
+            car.model_dump_json().encode() for car in car_data[9:]
+        ]
+
+    def test_cars_pages(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+        available_cars = [car for car in car_data if car.status == CarStatus.available]
+
+        pages, cursor = [], 0
+        while cursor is not None:
+            cars, cursor = service.get_cars_page(CarStatus.available, limit=3, cursor=cursor)
+            pages.append(cars)
+
+        assert [len(cars) for cars in pages] == [3, 3, 2]
+        assert [car for cars in pages for car in cars] == available_cars
+        assert [car for _, car in service.iter_cars(model=3)] == [car for car in car_data if car.model == 3]
+        assert [car.vin for _, car in service.iter_cars(CarStatus.available, model=4, limit=2)] == [
+            "5N1CR2MN9EC641864",
+            "5N1CR2TS0HW037674",
+        ]
+
+    def test_sales_slot_reuse_and_compaction(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        reader = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+        sales = [
+            Sale(
+                sales_number=f"20240903#{car.vin}",
+                car_vin=car.vin,
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal(i + 1),
+            )
+            for i, car in enumerate(car_data[:4])
+        ]
+        service.sell_cars(sales[:3])
+        service.revert_sale(sales[0].sales_number)
+        service.sell_car(sales[3])
+
+        # Строка отмененной продажи занята новой, живые продажи не затерты
+        assert service.sales_index.get(sales[3].sales_number) == 0
+        assert service.find_sale(sales[1].sales_number) == sales[1]
+        assert reader.get_car_info(car_data[2].vin).sales_cost == sales[2].cost
+
+        service.revert_sale(sales[1].sales_number)
+        assert service.compact_sales() == 501
+
+        assert service.sales_data_path.stat().st_size == 2 * 501
+        assert len(service.sales_free_slots) == 0
+        for sale in (sales[2], sales[3]):
+            assert service.find_sale(sale.sales_number) == sale
+            assert reader.get_car_info(sale.car_vin).sales_cost == sale.cost
+
+    def test_compaction_recovery(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        sales = [
+            Sale(sales_number=f"20240903#{car.vin}", car_vin=car.vin, sales_date=datetime(2024, 9, 3), cost=Decimal(i + 1))
+            for i, car in enumerate(car_data[:4])
+        ]
+        service.sell_cars(sales)
+        service.revert_sale(sales[0].sales_number)
+        service.update_vin(sales[2].car_vin, "UPDGM4A77D5316538")
+
+        # Сбой после подмены sales.txt, но до записи новых индексов
+        def crash(pairs):
+            raise OSError("сбой")
+
+        service.sales_index.replace = crash
+        with pytest.raises(OSError):
+            service.compact_sales()
+        assert service.sales_compact_path.exists()
+
+        # Следующий сервис доводит сжатие до конца
+        recovered = CarService(tmpdir)
+        assert not recovered.sales_compact_path.exists()
+        assert recovered.sales_data_path.stat().st_size == 3 * 501
+        for sale in sales[1:]:
+            assert recovered.find_sale(sale.sales_number) == sale
+        assert recovered.get_car_info("UPDGM4A77D5316538").sales_cost == sales[2].cost
+        assert recovered.get_car_info(sales[3].car_vin).sales_cost == sales[3].cost
+
+    def test_trusted_validation(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        self._fill_initial_data(CarService(tmpdir), car_data, model_data)
+        strict = CarService(tmpdir)
+        trusted = CarService(tmpdir, validation="trusted")
+
+        assert trusted.get_cars(CarStatus.available) == strict.get_cars(CarStatus.available)
+        assert trusted.get_car_info("KNAGM4A77D5316538") == strict.get_car_info("KNAGM4A77D5316538")
+        assert trusted.find_model(3) == model_data[2]
+
+        with pytest.raises(ValueError):
+            CarService(tmpdir, validation="none")
+
+    def test_binary_data_format(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(f"{tmpdir}/binary", data_format="binary")
+
+        self._fill_initial_data(service, car_data, model_data)
+        sale = Sale(
+            sales_number="20240903#JM1BL1M58C1614725",
+            car_vin="JM1BL1M58C1614725",
+            sales_date=datetime(2024, 9, 3),
+            cost=Decimal("2399.99"),
+        )
+        service.sell_car(sale)
+
+        assert service.cars_data_path.stat().st_size < 64 * len(car_data) + 64
+        assert service.find_sale(sale.sales_number) == sale
+        assert service.get_cars(CarStatus.available) == [car for car in car_data if car.status == CarStatus.available]
+        assert [car.vin for _, car in service.iter_cars(model=3)] == [car.vin for car in car_data if car.model == 3]
+        assert CarService(f"{tmpdir}/binary", validation="trusted").get_car_info(sale.car_vin).sales_cost == sale.cost
+
+    def test_migrate_data_to_binary(self, tmpdir: str, car_data: list[Car], model_data: list[Model], monkeypatch):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+        for vin in ("KNAGM4A77D5316538", "JM1BL1M58C1614725"):
+            service.sell_car(Sale(
+                sales_number=f"20240903#{vin}",
+                car_vin=vin,
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("2999.99"),
+            ))
+        # Отмененная продажа оставляет в файле пустую строку
+        service.revert_sale("20240903#KNAGM4A77D5316538")
+        info = service.get_car_info("JM1BL1TFXD1734246")
+        sold_info = service.get_car_info("JM1BL1M58C1614725")
+        service.close()
+
+        # Путь к базе понимается так же, как в CarService, из любого каталога
+        monkeypatch.chdir(service.root_directory_path)
+        bibip_cli(["migrate", tmpdir])
+
+        migrated = CarService(tmpdir)
+        assert migrated.records[migrated.cars_data_path].codec.name == "binary"
+        assert migrated.get_car_info("JM1BL1TFXD1734246") == info
+        assert migrated.get_car_info("JM1BL1M58C1614725") == sold_info
+        assert migrated.find_sale("20240903#KNAGM4A77D5316538") is None
+        assert migrated.get_car_info("KNAGM4A77D5316538").status == CarStatus.available
+        assert not list(Path(tmpdir).glob("*.migrate"))
+        migrated.add_car(car_data[0].model_copy(update={"vin": "NEWGM4A77D5316538", "model": 2**40}))
+        assert migrated.find_car("NEWGM4A77D5316538").model == 2**40
+        assert [car.vin for _, car in migrated.iter_cars(model=2**40)] == ["NEWGM4A77D5316538"]
+
+    def test_concurrent_writers_in_threads(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir, concurrency="thread")
+        for model in model_data:
+            service.add_model(model)
+
+        def add_car(i: int) -> Car:
+            return service.add_car(car_data[i % len(car_data)].model_copy(update={"vin": f"THR{i:014d}"}))
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            pool.map(add_car, range(200))
+            readers = [pool.submit(service.get_cars, CarStatus.available) for _ in range(8)]
+
+        assert all(len(reader.result()) <= 200 for reader in readers)
+        lines = [line for _, line in service.cars_index.items()]
+        assert sorted(lines) == list(range(200))
+        assert service.find_car("THR00000000000123").vin == "THR00000000000123"
+
+        with pytest.raises(ValueError):
+            CarService(tmpdir, concurrency="greenlets")
+
+    def test_concurrent_writers_in_processes(self, tmpdir: str):
+        context = multiprocessing.get_context("fork")
+        workers = [
+            context.Process(target=_add_cars_in_process, args=(str(tmpdir), prefix, 50))
+            for prefix in ("PRA00", "PRB00", "PRC00")
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        service = CarService(tmpdir, concurrency="process")
+        lines = [line for _, line in service.cars_index.items()]
+        assert sorted(lines) == list(range(150))
+        assert len(service.get_cars(CarStatus.available)) == 150
+
+    def test_lazy_rebuild_with_reader_processes(self, tmpdir: str):
+        _add_cars_in_process(tmpdir, "PRD00", 300)
+        bibip_cli(["rebuild", tmpdir])
+
+        # Индекс статусов после rebuild пуст; его строит заново один
+        # процесс под блокировкой на запись, остальные ждут и читают
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        workers = [context.Process(target=_count_cars_in_process, args=(tmpdir, results)) for _ in range(6)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert [results.get() for _ in workers] == [300] * 6
+        assert not [name for name in os.listdir(CarService(tmpdir).root_directory_path) if name.endswith(".tmp")]
+
+    def test_async_service(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        sale = Sale(
+            sales_number="20240903#KNAGM4A77D5316538",
+            car_vin="KNAGM4A77D5316538",
+            sales_date=datetime(2024, 9, 3),
+            cost=Decimal("1999.09"),
+        )
+
+        async def scenario():
+            async with AsyncCarService(tmpdir, max_workers=4) as service:
+                await service.add_models(model_data)
+                await asyncio.gather(*(service.add_car(car) for car in car_data))
+                metrics = service.service.enable_metrics()
+                found = await asyncio.gather(*(service.find_car(sale.car_vin) for _ in range(50)))
+                calls = metrics.snapshot()["find_car"]["calls"]
+                service.service.disable_metrics()
+                await service.sell_car(sale)
+                info = await service.get_car_info(sale.car_vin)
+                return found, calls, info, await service.get_cars(CarStatus.available)
+
+        found, calls, info, available = asyncio.run(scenario())
+
+        # Одновременные одинаковые запросы выполнились один раз, но каждый
+        # получил свою копию машины
+        assert calls == 1
+        assert all(car == found[0] for car in found)
+        found[1].status = CarStatus.sold
+        assert found[0].status == CarStatus.available and found[2].status == CarStatus.available
+        assert found[0].status == CarStatus.available
+        assert info.status == CarStatus.sold and info.sales_cost == sale.cost
+        assert len(available) == len([car for car in car_data if car.status == CarStatus.available]) - 1
+
+    def test_parallel_scan(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        service.sell_car(Sale(
+            sales_number="20240903#JM1BL1M58C1614725",
+            car_vin="JM1BL1M58C1614725",
+            sales_date=datetime(2024, 9, 3),
+            cost=Decimal("2399.99"),
+        ))
+
+        parallel = CarService(tmpdir, scan_workers=2, parallel_scan_threshold=1)
+        parallel.scanner.chunk_size = 3
+        try:
+            assert parallel.get_cars(CarStatus.available) == service.get_cars(CarStatus.available)
+            # Индексы, которые строятся полным обходом
+            parallel.status_index.replace([])
+            parallel.sales_vin_index.replace([])
+            assert parallel.top_models_by_sales() == service.top_models_by_sales()
+            assert parallel.get_car_info("JM1BL1M58C1614725").sales_cost == Decimal("2399.99")
+            assert parallel.status_index.count(CarStatus.sold) == 1
+        finally:
+            parallel.scanner.close()
+
+    def test_sharded_service(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        single = CarService(f"{tmpdir}/single")
+        sharded = ShardedCarService(f"{tmpdir}/sharded", shards=3)
+        sales = [
+            Sale(sales_number=f"20240903#{car.vin}", car_vin=car.vin, sales_date=datetime(2024, 9, 3), cost=car.price)
+            for car in car_data[:5]
+        ]
+        for service in (single, sharded):
+            self._fill_initial_data(service, car_data, model_data)
+            service.sell_cars(sales)
+            service.revert_sale(sales[1].sales_number)
+
+        shard_sizes = [len(shard.cars_index) for shard in sharded.shards]
+        assert sum(shard_sizes) == len(car_data) and max(shard_sizes) < len(car_data)
+        assert sorted(sharded.get_cars(CarStatus.available), key=lambda car: car.vin) == sorted(
+            single.get_cars(CarStatus.available), key=lambda car: car.vin
+        )
+        assert sharded.get_car_info(sales[0].car_vin) == single.get_car_info(sales[0].car_vin)
+        assert sharded.find_sale(sales[2].sales_number) == sales[2]
+        assert sharded.top_models_by_sales() == single.top_models_by_sales()
+
+        # Обход страницами проходит все шарды
+        seen, cursor = [], 0
+        while cursor is not None:
+            page, cursor = sharded.get_cars_page(limit=4, cursor=cursor)
+            seen += [car.vin for car in page]
+        assert sorted(seen) == sorted(car.vin for car in car_data)
+
+        # Новый vin из другого шарда: машина остается на месте
+        old_vin = car_data[0].vin
+        new_vin = next(f"NEW{i:014d}" for i in range(100) if shard_of(f"NEW{i:014d}", 3) != shard_of(old_vin, 3))
+        sharded.update_vin(old_vin, new_vin)
+        assert sharded.find_car(new_vin).vin == new_vin
+        assert sharded.get_car_info(new_vin).sales_cost == sales[0].cost
+
+        # Продажа машины со сменившимся vin переезжает вместе с ней
+        single.update_vin(sales[4].car_vin, "UPDGM4A77D5316538")
+        info, top = single.get_car_info(sales[3].car_vin), single.top_models_by_sales()
+        report, moved = single.sales_report("model"), single.get_car_info("UPDGM4A77D5316538")
+        bibip_cli(["reshard", str(single.root_directory_path), "--shards", "4"])
+        resharded = ShardedCarService(f"{tmpdir}/single")
+        assert len(resharded.shards) == 4
+        assert resharded.get_car_info(sales[3].car_vin) == info
+        assert resharded.get_car_info("UPDGM4A77D5316538") == moved
+        assert resharded.sales_report("model") == report
+        assert resharded.find_car(sales[1].car_vin).status == CarStatus.available
+        assert resharded.top_models_by_sales() == top
+        with pytest.raises(ValueError):
+            ShardedCarService(f"{tmpdir}/single", shards=2)
+
+    def test_shard_routes_from_processes(self, tmpdir: str):
+        with ShardedCarService(tmpdir, shards=2, concurrency="process") as sharded:
+            for prefix in ("PRA00", "PRB00"):
+                for i in range(30):
+                    sharded.add_car(Car(
+                        vin=f"{prefix}{i:012d}",
+                        model=1,
+                        price=Decimal("1000"),
+                        date_start=datetime(2024, 1, 1),
+                        status=CarStatus.available,
+                    ))
+
+        context = multiprocessing.get_context("fork")
+        workers = [
+            context.Process(target=_rename_in_shards_in_process, args=(str(tmpdir), prefix, 30))
+            for prefix in ("PRA00", "PRB00")
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        sharded = ShardedCarService(tmpdir, concurrency="process")
+        moved = [_moved_vin(f"{prefix}{i:012d}", 2) for prefix in ("PRA00", "PRB00") for i in range(30)]
+        assert [sharded.find_car(vin).vin for vin in moved] == moved
+        assert len(sharded.routes) == len(moved)
+
+    def test_metrics(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        service.sell_car(Sale(
+            sales_number="20240903#KNAGM4A77D5316538",
+            car_vin="KNAGM4A77D5316538",
+            sales_date=datetime(2024, 9, 3),
+            cost=Decimal("1999.09"),
+        ))
+
+        calls = []
+        metrics = service.enable_metrics(hook=lambda name, counters: calls.append((name, counters)))
+        CarService(tmpdir).add_car(car_data[0].model_copy(update={"vin": "NEWGM4A77D5316538"}))
+        service.get_car_info("KNAGM4A77D5316538")
+        service.get_cars(CarStatus.available)
+
+        snapshot = metrics.snapshot()
+        info = snapshot["get_car_info"]
+        assert info["calls"] == 1 and info["wall_time"] > 0
+        # Машина, модель и продажа; журнал индекса машин, дописанный другим
+        # объектом, дочитан через уже открытый файл
+        assert info["records_decoded"] == 3
+        assert info["bytes_read"] > 3 * 501
+        assert info["file_opens"] == 0
+        assert snapshot["find_car"]["calls"] == 1 and snapshot["find_model"]["calls"] == 1
+        # Одна машина продана, одна добавлена
+        assert snapshot["get_cars"]["records_decoded"] == len([car for car in car_data if car.status == CarStatus.available])
+        assert [name for name, _ in calls] == ["find_car", "find_model", "get_car_info", "get_cars"]
+
+        service.disable_metrics()
+        service.find_car("KNAGM4A77D5316538")
+        assert metrics.snapshot()["find_car"]["calls"] == 1
+
+    def test_durability_modes(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        per_op = CarService(f"{tmpdir}/per_op", durability="fsync-per-op")
+        per_op.add_models(model_data)
+        metrics = per_op.enable_metrics()
+        per_op.add_car(car_data[0])
+        # Файл с данными, индекс машин и индекс статусов
+        assert metrics.snapshot()["add_car"]["fsyncs"] == 3
+
+        group = CarService(f"{tmpdir}/group", durability="group-commit", group_commit_ops=1000, group_commit_ms=60000)
+        group.add_models(model_data)
+        metrics = group.enable_metrics()
+        for car in car_data:
+            group.add_car(car)
+        assert metrics.snapshot()["add_car"]["fsyncs"] == 0
+        group.sync()
+        assert metrics.snapshot()["sync"]["fsyncs"] > 0
+        assert CarService(f"{tmpdir}/group").get_cars(CarStatus.reserve) == group.get_cars(CarStatus.reserve)
+
+        with pytest.raises(ValueError):
+            CarService(tmpdir, durability="always")
+
+    def test_index_recovery(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        sales = [
+            Sale(sales_number=f"20240903#{car.vin}", car_vin=car.vin, sales_date=datetime(2024, 9, 3), cost=car.price)
+            for car in car_data[:3]
+        ]
+        service.sell_cars(sales)
+        service.revert_sale(sales[1].sales_number)
+        service.checkpoint()
+        available = service.get_cars(CarStatus.available)
+
+        # Оборванный при сбое файл индекса
+        with open(service.cars_index_path, "w") as f:
+            f.write('[["5N1AR2MM4DC605884", 9], ["5N1CR')
+        recovered = CarService(tmpdir)
+        assert recovered.get_cars(CarStatus.available) == available
+        assert recovered.find_car(car_data[4].vin) == car_data[4]
+        assert len(json.loads(service.cars_index_path.read_text())) == len(car_data)
+
+        # Потерянные файлы индексов
+        for path in (service.models_index_path, service.sales_index_path):
+            path.unlink()
+            path.with_suffix(".journal").unlink(missing_ok=True)
+        recovered = CarService(tmpdir)
+        assert recovered.find_model(3) == model_data[2]
+        assert recovered.find_sale(sales[0].sales_number) == sales[0]
+        # Отмененная продажа не вернулась
+        assert recovered.find_sale(sales[1].sales_number) is None
+
+        parallel = CarService(tmpdir, scan_workers=2, parallel_scan_threshold=1)
+        try:
+            assert parallel.rebuild_indexes() == {"cars_index.txt": 11, "models_index.txt": 5, "sales_index.txt": 2}
+            assert parallel.get_car_info(sales[2].car_vin).sales_cost == sales[2].cost
+            assert parallel.get_cars(CarStatus.available) == available
+        finally:
+            parallel.scanner.close()
+
+    def test_lazy_startup_and_close(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        # Незакрытые сервисы прошлых тестов не должны закрыть свои файлы посреди теста
+        gc.collect()
+        open_files = len(os.listdir("/proc/self/fd"))
+        service = CarService(tmpdir, concurrency="process")
+        # Файлы создаются при первом обращении
+        assert list(service.root_directory_path.iterdir()) == []
+        assert service.find_car(car_data[0].vin) is None
+        self._fill_initial_data(service, car_data, model_data)
+        for car in car_data:
+            service.get_car_info(car.vin)
+
+        # Все файлы уже открыты и остаются открытыми
+        metrics = service.enable_metrics()
+        for car in car_data:
+            assert service.find_car(car.vin) == car
+            service.get_car_info(car.vin)
+        service.update_status(car_data[0].vin, CarStatus.reserve)
+        assert sum(counters["file_opens"] for counters in metrics.snapshot().values()) == 0
+        service.disable_metrics()
+
+        service.close()
+        assert len(os.listdir("/proc/self/fd")) == open_files
+        # После close файлы открываются заново
+        assert service.find_car(car_data[0].vin).status == CarStatus.reserve
+
+        with CarService(tmpdir) as other:
+            assert other.find_model(model_data[0].id) == model_data[0]
+        service.close()
+        assert len(os.listdir("/proc/self/fd")) == open_files
+
+    def test_record_cache(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        vin = car_data[0].vin
+
+        car = service.find_car(vin)
+        # Изменение полученного объекта не попадает в кеш
+        car.price = Decimal("1")
+        assert service.find_car(vin) == car_data[0]
+        assert service.cache_stats()["cars"]["hits"] == 1
+        assert service.cache_stats()["cars"]["misses"] == 1
+
+        service.update_status(vin, CarStatus.reserve)
+        assert service.find_car(vin).status == CarStatus.reserve
+        service.update_vin(vin, "NEWGM4A77D5316538")
+        assert service.find_car(vin) is None
+        assert service.find_car("NEWGM4A77D5316538").status == CarStatus.reserve
+
+        sale = Sale(sales_number="20240903#NEWGM4A77D5316538", car_vin="NEWGM4A77D5316538", sales_date=datetime(2024, 9, 3), cost=Decimal("1"))
+        service.sell_car(sale)
+        assert service.find_sale(sale.sales_number) == sale
+        assert service.find_car("NEWGM4A77D5316538").status == CarStatus.sold
+        service.revert_sale(sale.sales_number)
+        assert service.find_sale(sale.sales_number) is None
+        assert service.find_car("NEWGM4A77D5316538").status == CarStatus.available
+        service.sell_cars([sale])
+        assert service.find_car("NEWGM4A77D5316538").status == CarStatus.sold
+
+        # Запись другим объектом очищает кеш
+        CarService(tmpdir).update_status("NEWGM4A77D5316538", CarStatus.delivery)
+        assert service.find_car("NEWGM4A77D5316538").status == CarStatus.delivery
+
+        for _ in range(3):
+            for model in model_data:
+                assert service.find_model(model.id) == model
+        assert service.cache_stats()["models"]["hits"] >= 2 * len(model_data)
+
+        small = CarService(tmpdir, cache_size=2)
+        for car in car_data[1:]:
+            small.find_car(car.vin)
+        assert small.cache_stats()["cars"]["size"] == 2
+        disabled = CarService(tmpdir, cache_size=0)
+        assert disabled.find_car(car_data[1].vin) == car_data[1]
+        assert disabled.cache_stats()["cars"] == {"hits": 0, "misses": 0, "size": 0, "maxsize": 0}
+
+    def test_get_cars_info(self, tmpdir: str, car_data: list[Car], model_data: list[Model], monkeypatch):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        sales = [
+            Sale(sales_number=f"20240903#{car.vin}", car_vin=car.vin, sales_date=datetime(2024, 9, 3), cost=car.price)
+            for car in car_data[2:5]
+        ]
+        service.sell_cars(sales)
+        service.find_car(car_data[3].vin)
+
+        vins = [car.vin for car in reversed(car_data)] + ["UNKNOWN0000000000", car_data[3].vin]
+        expected = [service.get_car_info(vin) for vin in vins]
+        # Индексы машин и продаж опрашиваются пачкой, а не по одному vin
+        service.caches[service.cars_data_path].clear()
+        for index in (service.cars_index, service.sales_vin_index):
+            monkeypatch.setattr(index, "get", None)
+        metrics = service.enable_metrics()
+        assert service.get_cars_info(vins) == expected
+        assert expected[-2] is None and expected[-1].sales_cost == car_data[3].price
+        # Каждая машина, модель и продажа разобраны не больше одного раза
+        assert metrics.snapshot()["get_cars_info"]["records_decoded"] <= len(car_data) + len(model_data) + len(sales)
+        service.disable_metrics()
+
+        sharded = ShardedCarService(f"{tmpdir}/sharded", shards=3)
+        self._fill_initial_data(sharded, car_data, model_data)
+        sharded.sell_cars(sales)
+        assert sharded.get_cars_info(vins) == expected
+
+    def test_sales_report(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        sales = [
+            Sale(
+                sales_number=f"2024{month:02d}03#{car.vin}",
+                car_vin=car.vin,
+                sales_date=datetime(2024, month, 3 + position % 2),
+                cost=car.price - position,
+            )
+            for position, (month, car) in enumerate(zip([8, 8, 9, 9, 9, 10], car_data))
+        ]
+        service.sell_cars(sales)
+        service.revert_sale(sales[5].sales_number)
+        service.update_vin(sales[0].car_vin, "NEWGM4A77D5316538")
+        live = sales[:5]
+
+        def expected(group_of, selected):
+            groups = {}
+            for position, sale in enumerate(live):
+                if sale in selected:
+                    groups.setdefault(group_of(sale, car_data[position]), []).append((sale, car_data[position]))
+            return {
+                group: (len(rows), sum(sale.cost for sale, _ in rows), sum(car.price - sale.cost for sale, car in rows) / len(rows))
+                for group, rows in groups.items()
+            }
+
+        def actual(report):
+            return {row.group: (row.sales_number, row.revenue, row.average_discount) for row in report}
+
+        brands = {model.id: model.brand for model in model_data}
+        assert actual(service.sales_report("month")) == expected(lambda sale, car: f"{sale.sales_date:%Y-%m}", live)
+        assert actual(service.sales_report("brand")) == expected(lambda sale, car: brands[car.model], live)
+        september = service.sales_report("day", datetime(2024, 9, 1), datetime(2024, 10, 1))
+        assert actual(september) == expected(lambda sale, car: f"{sale.sales_date:%Y-%m-%d}", live[2:])
+        assert [row.group for row in september] == ["2024-09-03", "2024-09-04"]
+        assert service.sales_report("model", datetime(2025, 1, 1)) == []
+        with pytest.raises(ValueError):
+            service.sales_report("year")
+
+        sharded = ShardedCarService(f"{tmpdir}/sharded", shards=3)
+        self._fill_initial_data(sharded, car_data, model_data)
+        sharded.sell_cars(live)
+        sharded.update_vin(sales[0].car_vin, "NEWGM4A77D5316538")
+        for group_by in ("brand", "model", "day", "month"):
+            assert sharded.sales_report(group_by) == service.sales_report(group_by)
+
+    def test_sales_totals_with_time_zones(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        # Пачки по 2 строки: суммы складываются по ходу обхода
+        service = CarService(tmpdir, scan_workers=1, parallel_scan_threshold=2)
+        self._fill_initial_data(service, car_data, model_data)
+        moscow = timezone(timedelta(hours=3))
+        dates = [
+            datetime(2024, 2, 1, 1, 0, tzinfo=moscow),
+            datetime(2024, 2, 1, 12, 0),
+            datetime(2024, 2, 10, 12, 0, tzinfo=timezone.utc),
+            datetime(2024, 3, 1, 2, 0, tzinfo=moscow),
+            datetime(2024, 3, 5),
+        ]
+        sales = [
+            Sale(sales_number=f"{position}#{car.vin}", car_vin=car.vin, sales_date=sales_date, cost=car.price)
+            for position, (sales_date, car) in enumerate(zip(dates, car_data))
+        ]
+        service.sell_cars(sales)
+
+        # Время без часового пояса - UTC, сравниваются моменты времени
+        february = service.sales_totals("model", datetime(2024, 2, 1), datetime(2024, 3, 1))
+        assert sum(count for count, _, _ in february.values()) == 3
+        assert sum(revenue for _, revenue, _ in february.values()) == sum(sale.cost for sale in sales[1:4])
+        late = service.sales_totals("model", datetime(2024, 1, 31, 22, 0, tzinfo=timezone.utc))
+        assert sum(count for count, _, _ in late.values()) == 5
+
+    def test_column_files(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir, columns=True)
+        self._fill_initial_data(service, car_data, model_data)
+        sale = Sale(sales_number="20240903#KNAGM4A77D5316538", car_vin="KNAGM4A77D5316538", sales_date=datetime(2024, 9, 3), cost=Decimal("1999.09"))
+        service.sell_car(sale)
+
+        def column(table: str, name: str, code: str) -> list:
+            data = (service.root_directory_path / f"{table}.{name}.col").read_bytes()
+            return [value for (value,) in struct.iter_unpack(f"<{code}", data)]
+
+        # Колонки ведутся и без numpy
+        assert column("cars", "price", "q") == [int(car.price * 100) for car in car_data]
+        assert column("cars", "status", "b")[0] == 3
+        assert column("sales", "car_line", "q") == [0]
+        assert column("sales", "cost", "q") == [199909]
+        service.revert_sale(sale.sales_number)
+        assert column("sales", "car_line", "q") == [-1]
+        assert column("cars", "status", "b")[0] == 1
+        service.update_vin(sale.car_vin, "NEWGM4A77D5316538")
+        # Другой сервис видит columns.json и тоже ведет колонки
+        CarService(tmpdir).sell_car(sale.model_copy(update={"car_vin": "NEWGM4A77D5316538"}))
+        assert column("sales", "car_line", "q") == [0]
+        service.compact_sales()
+        assert column("sales", "cost", "q") == [199909]
+
+    def test_columns_with_sorted_index(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir, index_format="sorted", checkpoint_every=1, columns=True)
+        self._fill_initial_data(service, car_data, model_data)
+        sale = Sale(sales_number="20240903#KNAGM4A77D5316538", car_vin="KNAGM4A77D5316538", sales_date=datetime(2024, 9, 3), cost=Decimal("1999.09"))
+        service.sell_car(sale)
+        service.close()
+
+        # Пустые строки продаж не ищутся в индексе машин
+        reopened = CarService(tmpdir)
+        assert is_sorted_index(reopened.cars_index_path)
+        assert reopened.revert_sale(sale.sales_number).status == CarStatus.available
+        data = (reopened.root_directory_path / "sales.car_line.col").read_bytes()
+        assert [value for (value,) in struct.iter_unpack("<q", data)] == [-1]
+
+    def test_columns_enabled_by_other_service(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        running = CarService(tmpdir)
+        self._fill_initial_data(running, car_data, model_data)
+        assert running.find_car(car_data[2].vin).status == CarStatus.available
+
+        # Колонки включает другой сервис, уже запущенный тоже начинает их вести
+        CarService(tmpdir).rebuild_columns()
+        running.update_status(car_data[2].vin, CarStatus.reserve)
+        data = (running.root_directory_path / "cars.status.col").read_bytes()
+        assert [value for (value,) in struct.iter_unpack("<b", data)][2] == 2
+        reserved = sum(car.status == CarStatus.reserve for car in car_data) + 1
+        assert {row.group: row.cars_number for row in CarService(tmpdir).inventory_report()}["reserve"] == reserved
+        running.close()
+
+    def test_column_reports(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        pytest.importorskip("numpy")
+        sales = [
+            Sale(sales_number=f"2024{month:02d}03#{car.vin}", car_vin=car.vin, sales_date=datetime(2024, month, 3), cost=car.price - 10)
+            for month, car in zip([8, 8, 9, 9, 10, 10], car_data)
+        ]
+        plain = CarService(f"{tmpdir}/plain")
+        columnar = CarService(f"{tmpdir}/columnar", columns=True)
+        for service in (plain, columnar):
+            self._fill_initial_data(service, car_data, model_data)
+            service.sell_cars(sales)
+            service.revert_sale(sales[5].sales_number)
+            service.update_vin(sales[0].car_vin, "NEWGM4A77D5316538")
+        assert columnar.column_arrays() is not None and plain.column_arrays() is None
+
+        # Суммы совпадают вплоть до числа знаков после запятой
+        for group_by in ("brand", "model", "day", "month"):
+            assert repr(columnar.sales_report(group_by)) == repr(plain.sales_report(group_by))
+            assert repr(columnar.sales_totals(group_by)) == repr(plain.sales_totals(group_by))
+        september = (datetime(2024, 9, 1), datetime(2024, 10, 1))
+        assert columnar.sales_report("brand", *september) == plain.sales_report("brand", *september)
+        for group_by in ("status", "brand", "model"):
+            assert repr(columnar.inventory_report(group_by)) == repr(plain.inventory_report(group_by))
+        assert {row.group: row.cars_number for row in plain.inventory_report()} == {"available": 5, "sold": 5, "delivery": 1}
+
+        # Колонки, разошедшиеся с данными, строятся заново
+        (columnar.root_directory_path / "cars.price.col").write_bytes(b"")
+        assert columnar.inventory_report("brand") == plain.inventory_report("brand")
+
+        # Дни и месяцы - по UTC в обоих путях
+        car = car_data[6]
+        moscow = timezone(timedelta(hours=3))
+        for service in (plain, columnar):
+            service.sell_car(Sale(
+                sales_number=f"20240201#{car.vin}",
+                car_vin=car.vin,
+                sales_date=datetime(2024, 2, 1, 1, 0, tzinfo=moscow),
+                cost=car.price,
+            ))
+        for group_by in ("day", "month"):
+            assert repr(sorted(columnar.sales_totals(group_by).items())) == repr(sorted(plain.sales_totals(group_by).items()))
+        assert "2024-01-31" in plain.sales_totals("day") and "2024-01" in plain.sales_totals("month")